@@ -1,26 +1,109 @@
-from joblib import load
-import pandas as pd
+import os
+import threading
 
+import numpy as np
 
-def predict_gender(height_cm, weight_kg):
-    model_loaded = load('pkl/weight-height.pkl')
+import compiled_models as cmp
 
-    prediction = model_loaded.predict([[height_cm, weight_kg]])
+GENDER_MODEL_PATH = 'pkl/weight-height.pkl'
+BODY_FAT_MODEL_PATH = 'pkl/body_fat.pkl'
 
-    return str(prediction[0])
+BODY_FAT_FEATURES = ["age", "gender", "height_cm", "weight_kg"]
 
+# Dùng bản compiled (.npz, chỉ cần NumPy) khi có và khớp với file .pkl
+USE_COMPILED_MODELS = True
+
+
+class ModelRegistry:
+    """
+    Keeps loaded models warm in memory.
+
+    Each model is loaded from disk on first use and reused afterwards; it is
+    reloaded automatically when the file's modification time changes. When a
+    compiled .npz export of the model exists and was built from the current
+    pickle, it is used instead so scikit-learn is never imported.
+    """
+
+    def __init__(self, use_compiled=USE_COMPILED_MODELS):
+        self.use_compiled = use_compiled
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _signature(self, path):
+        compiled_path = cmp.compiled_path_for(path)
+        pickle_mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+        compiled_mtime = None
+        if self.use_compiled and compiled_path.exists():
+            compiled_mtime = os.stat(compiled_path).st_mtime_ns
+        if pickle_mtime is None and compiled_mtime is None:
+            raise FileNotFoundError(path)
+        return pickle_mtime, compiled_mtime
+
+    def _load(self, path, signature):
+        pickle_mtime, compiled_mtime = signature
+        if compiled_mtime is not None:
+            compiled = cmp.load_model(cmp.compiled_path_for(path))
+            # Bỏ qua bản compiled cũ nếu file .pkl đã được huấn luyện lại
+            if pickle_mtime is None or compiled.source_sha256 == cmp.file_sha256(path):
+                return compiled
+
+        from joblib import load
+        return load(path)
+
+    def get(self, path):
+        """Return the model stored at `path`, loading or reloading it if needed"""
+        signature = self._signature(path)
+        cached = self._models.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        with self._lock:
+            cached = self._models.get(path)
+            if cached is None or cached[0] != signature:
+                cached = (signature, self._load(path, signature))
+                self._models[path] = cached
+            return cached[1]
+
+    def clear(self):
+        """Drop every cached model"""
+        with self._lock:
+            self._models.clear()
 
-def predict_body_fat(age, gender, height_cm, weight_kg):
-    model_loaded = load('pkl/body_fat.pkl')
 
-    if gender.lower() == 'male':
-        gender = 1
-    else:
-        gender = 0
+registry = ModelRegistry()
 
-    features = ["age", "gender", "height_cm", "weight_kg"]
 
-    input_data = pd.DataFrame([[age, gender, height_cm, weight_kg]], columns=features)
+def predict_gender_many(heights_cm, weights_kg):
+    model_loaded = registry.get(GENDER_MODEL_PATH)
+
+    features = np.column_stack([np.asarray(heights_cm, dtype = np.float64),
+                                np.asarray(weights_kg, dtype = np.float64)])
+    prediction = model_loaded.predict(features)
+
+    return np.asarray(prediction).astype(str)
+
+
+def predict_gender(height_cm, weight_kg):
+    return str(predict_gender_many([height_cm], [weight_kg])[0])
+
+
+def predict_body_fat_many(ages, genders, heights_cm, weights_kg):
+    model_loaded = registry.get(BODY_FAT_MODEL_PATH)
+
+    # male -> 1, các giá trị khác -> 0
+    genders = np.char.lower(np.asarray(genders, dtype = str)) == 'male'
+
+    input_data = np.column_stack([np.asarray(ages, dtype = np.float64),
+                                  genders.astype(np.float64),
+                                  np.asarray(heights_cm, dtype = np.float64),
+                                  np.asarray(weights_kg, dtype = np.float64)])
+    if not isinstance(model_loaded, cmp.CompiledModel):
+        import pandas as pd
+        input_data = pd.DataFrame(input_data, columns = BODY_FAT_FEATURES)
     prediction = model_loaded.predict(input_data)
 
-    return round(prediction[0], 2)
+    return np.round(prediction, 2)
+
+
+def predict_body_fat(age, gender, height_cm, weight_kg):
+    return predict_body_fat_many([age], [gender], [height_cm], [weight_kg])[0]
@@ -9,12 +9,24 @@ load_dotenv()
 os.environ['LANGCHAIN_API_KEY'] = os.getenv('LANGCHAIN_API_KEY')
 os.environ['GOOGLE_API_KEY'] = os.getenv('GOOGLE_API_KEY')
 
-# Loading the model
-llm = GoogleGenerativeAI(model = 'gemini-2.0-flash', temperature = 0.1)
+# The model client is created on first use so importing this module stays cheap
+llm = None
+
+
+def get_llm():
+    global llm
+    if llm is None:
+        llm = GoogleGenerativeAI(model = 'gemini-2.0-flash', temperature = 0.1)
+    return llm
 
 
 def ai_health_recommendations(measurements):
     print("AI đang đưa ra các đánh giá các thông số sức khoẻ . . .")
+    # Kết quả thăng bằng có thể chưa có khi khuyến cáo chạy song song với bài đo
+    balance = ''
+    if measurements.get('ols') is not None:
+        balance = f""",
+            Thời gian thăng bằng trên 1 chân {measurements['ols']} giây"""
     prompt = ChatPromptTemplate.from_messages([
         ('system',
          'Bạn là một chuyên gia sức khỏe, hãy đưa ra nhận xét chi tiết về tất cả các chỉ số tôi cung cấp và khuyến cáo chuyên sâu về sức khỏe dựa trên các chỉ số cơ thể sau'
@@ -33,11 +45,10 @@ def ai_health_recommendations(measurements):
             Khối lượng xương: {measurements['bm']} kg, 
             Khối lượng cơ: {measurements['ms']} kg, 
             Tỷ lệ protein: {measurements['pp']}%, 
-            Mỡ nội tạng: {measurements['vf']},
-            Thời gian thăng bằng trên 1 chân {measurements['ols']} giây."""
+            Mỡ nội tạng: {measurements['vf']}{balance}."""
          )
     ])
 
-    response = llm.invoke(prompt.format()).replace('*', '')
+    response = get_llm().invoke(prompt.format()).replace('*', '')
 
     return response
@@ -0,0 +1,403 @@
+"""
+asyncio MQTT 3.1.1 client.
+
+AsyncMQTTClient speaks MQTT directly over asyncio streams, so it runs on the
+event loop that also drives the BLE scale (main.connect_and_measure) instead
+of paho's network thread. Streams work on every event loop, including the
+Windows proactor loop that bleak uses, where add_reader-based integrations
+of paho do not.
+
+It keeps the interface of mqtt_client_handler.MQTTClient: publish(topic,
+payload, qos) and the ThingsBoard RPC handling in on_message. Published
+messages go through the same disk-backed TelemetryQueue, and are sent in
+coalesced batches with at most `max_inflight` unacknowledged. publish()
+returns a future that completes when the broker acknowledged the message;
+publish_async() awaits it. Both may be called from any thread.
+
+The packet helpers (encode_*, read_packet) implement the subset of the
+protocol the client needs: CONNECT, PUBLISH with QoS 0/1 (QoS 2 messages
+are sent as QoS 1), PUBACK, SUBSCRIBE, PINGREQ and DISCONNECT.
+"""
+import asyncio
+import concurrent.futures
+import json
+import logging
+import struct
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from telemetry_queue import QUEUE_CONFIG, TelemetryQueue, coalesce
+
+logger = logging.getLogger(__name__)
+
+ASYNC_MQTT_CONFIG = {
+    'keepalive': 60,  # seconds
+    'connect_timeout': 10.0,  # seconds
+    'reconnect_min_delay': 1.0,  # seconds, doubled after every failed attempt
+    'reconnect_max_delay': 60.0,
+    'rpc_topic': 'v1/devices/me/rpc/request/+',
+    'attributes_topic': 'v1/devices/me/attributes',
+}
+
+# Packet types
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+class MQTTProtocolError(ConnectionError):
+    pass
+
+
+def encode_remaining_length(length: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+
+def encode_string(text: str) -> bytes:
+    data = text.encode('utf-8')
+    return struct.pack('!H', len(data)) + data
+
+
+def encode_packet(packet_type: int, flags: int, body: bytes) -> bytes:
+    return bytes([(packet_type << 4) | flags]) + encode_remaining_length(len(body)) + body
+
+
+def encode_connect(client_id: str, username: Optional[str] = None, password: Optional[str] = None,
+                   keepalive: int = 60, clean_session: bool = True) -> bytes:
+    flags = (0x02 if clean_session else 0) | (0x80 if username is not None else 0) | \
+            (0x40 if password is not None else 0)
+    body = encode_string('MQTT') + bytes([4, flags]) + struct.pack('!H', keepalive) + encode_string(client_id)
+    if username is not None:
+        body += encode_string(username)
+    if password is not None:
+        body += encode_string(password)
+    return encode_packet(CONNECT, 0, body)
+
+
+def encode_publish(topic: str, payload: bytes, qos: int = 0, mid: int = 0,
+                   retain: bool = False, dup: bool = False) -> bytes:
+    flags = (0x08 if dup else 0) | (qos << 1) | (0x01 if retain else 0)
+    body = encode_string(topic) + (struct.pack('!H', mid) if qos else b'') + payload
+    return encode_packet(PUBLISH, flags, body)
+
+
+def decode_publish(flags: int, body: bytes) -> Tuple[str, bytes, int, int]:
+    """Returns (topic, payload, qos, message id)"""
+    (length,) = struct.unpack_from('!H', body)
+    topic = body[2:2 + length].decode('utf-8')
+    qos = (flags >> 1) & 0x03
+    position = 2 + length
+    mid = 0
+    if qos:
+        (mid,) = struct.unpack_from('!H', body, position)
+        position += 2
+    return topic, body[position:], qos, mid
+
+
+def encode_subscribe(mid: int, topic: str, qos: int = 0) -> bytes:
+    return encode_packet(SUBSCRIBE, 0x02, struct.pack('!H', mid) + encode_string(topic) + bytes([qos]))
+
+
+def encode_mid(packet_type: int, mid: int) -> bytes:
+    """PUBACK and the other packets whose body is just a message id"""
+    return encode_packet(packet_type, 0, struct.pack('!H', mid))
+
+
+async def read_packet(reader: asyncio.StreamReader) -> Tuple[int, int, bytes]:
+    """Read one packet; returns (packet type, flags, body)"""
+    first = await reader.readexactly(1)
+    length, multiplier = 0, 1
+    for _ in range(4):
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    else:
+        raise MQTTProtocolError("Malformed remaining length")
+    body = await reader.readexactly(length) if length else b''
+    return first[0] >> 4, first[0] & 0x0F, body
+
+
+class AsyncMQTTClient:
+    """
+    MQTT client running on an asyncio event loop
+
+    Args:
+        broker_address: Broker host name
+        port: Broker port
+        username: User name (ThingsBoard device token)
+        password: Password
+        client_id: MQTT client id
+        queue_dir: Directory of the outbound TelemetryQueue (default: QUEUE_CONFIG['queue_dir'])
+        config: ASYNC_MQTT_CONFIG and QUEUE_CONFIG overrides
+    """
+
+    def __init__(self, broker_address, port, username, password, client_id="client", queue_dir=None,
+                 config: Dict[str, Any] = None):
+        self.broker_address = broker_address
+        self.port = port
+        self.username = username
+        self.password = password
+        self.client_id = client_id
+        self.config = {**QUEUE_CONFIG, **ASYNC_MQTT_CONFIG, **(config or {})}
+        self.queue = TelemetryQueue(queue_dir, self.config)
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._new_entries: Optional[asyncio.Event] = None
+        self._inflight: Dict[int, asyncio.Future] = {}  # mid -> PUBACK future
+        self._next_mid = 0
+        # Futures handed out by publish(), completed when their entry is acknowledged
+        self._waiters: Dict[int, concurrent.futures.Future] = {}
+        self._waiters_lock = threading.Lock()
+        self.connected = False
+        self.messages_sent = 0
+
+    # ------------------------------------------------------------------
+    # Public interface
+
+    async def start(self) -> None:
+        """Start connecting (and reconnecting) on the running event loop"""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._new_entries = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    def connect(self) -> None:
+        """Compatibility with MQTTClient: start on the running loop if there is one"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return  # start() is awaited once the loop runs
+        asyncio.ensure_future(self.start())
+
+    def publish(self, topic: str, payload: Any, qos: int = 1) -> concurrent.futures.Future:
+        """
+        Queue a JSON payload for sending; safe to call from any thread
+
+        Returns:
+            Future completed with True once the broker acknowledged the message
+        """
+        future = concurrent.futures.Future()
+        try:
+            # Giữ khoá để xác nhận không thể đến trước khi future được đăng ký
+            with self._waiters_lock:
+                seq = self.queue.append(topic, json.dumps(payload), qos)
+                self._waiters[seq] = future
+        except Exception as e:
+            print("Đã xảy ra lỗi trong quá trình publish lên MQTT Broker:", e)
+            future.set_exception(e)
+            return future
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._new_entries.set)
+        print('Đã đưa dữ liệu vào hàng đợi gửi MQTT Broker !')
+        return future
+
+    async def publish_async(self, topic: str, payload: Any, qos: int = 1) -> bool:
+        """Queue a payload and wait for the broker's acknowledgement"""
+        return await asyncio.wrap_future(self.publish(topic, payload, qos))
+
+    def on_connect(self) -> None:
+        print("Kết nối với MQTT Broker thành công!")
+
+    def on_message(self, topic: str, payload: bytes) -> None:
+        text = payload.decode("utf-8")
+        print("Received:", text)
+        try:
+            jsonobj = json.loads(text)
+            if jsonobj.get('method') == "setValue":
+                self.publish(self.config['attributes_topic'], {'value': jsonobj.get('params')})
+        except Exception as e:
+            print("Đã xảy ra lỗi trong quá trình phản hồi MQTT Broker:", e)
+
+    async def aclose(self) -> None:
+        """Stop the client on its own loop: disconnect cleanly and save the queue position"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.queue.close()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Stop the client from another thread, or after its loop has ended"""
+        if self._loop is not None and self._loop.is_running():
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is self._loop:
+                running.create_task(self.aclose())
+                return
+            try:
+                asyncio.run_coroutine_threadsafe(self.aclose(), self._loop).result(timeout)
+                return
+            except (concurrent.futures.TimeoutError, RuntimeError) as e:
+                logger.warning(f"MQTT client did not stop cleanly: {e}")
+        self.queue.close()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {'connected': self.connected, 'pending': self.queue.pending(),
+                'inflight': len(self._inflight), 'messages_sent': self.messages_sent}
+
+    # ------------------------------------------------------------------
+    # Connection handling
+
+    async def _run(self) -> None:
+        delay = self.config['reconnect_min_delay']
+        while True:
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.broker_address, self.port), self.config['connect_timeout'])
+            except (OSError, asyncio.TimeoutError) as e:
+                print("Chưa kết nối được MQTT Broker, sẽ thử lại:", e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.config['reconnect_max_delay'])
+                continue
+
+            try:
+                await self._session(reader, writer)
+                delay = self.config['reconnect_min_delay']
+            except asyncio.CancelledError:
+                await self._disconnect(writer)
+                raise
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, MQTTProtocolError) as e:
+                if self.connected:
+                    print("Mất kết nối với MQTT Broker, dữ liệu sẽ được gửi lại khi kết nối lại:", e)
+                else:
+                    print("Kết nối bị lỗi:", e)
+            finally:
+                self._drop_connection(writer)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.config['reconnect_max_delay'])
+
+    async def _disconnect(self, writer: asyncio.StreamWriter) -> None:
+        if self.connected:
+            try:
+                writer.write(encode_packet(DISCONNECT, 0, b''))
+                await asyncio.wait_for(writer.drain(), 1.0)
+            except (OSError, asyncio.TimeoutError):
+                pass
+
+    def _drop_connection(self, writer: asyncio.StreamWriter) -> None:
+        self.connected = False
+        self._writer = None
+        writer.close()
+        # Tin chưa được xác nhận vẫn còn trong hàng đợi trên đĩa và sẽ được gửi lại
+        for future in self._inflight.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Connection lost"))
+        self._inflight.clear()
+
+    async def _session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        keepalive = self.config['keepalive']
+        writer.write(encode_connect(self.client_id, self.username, self.password, keepalive))
+        await writer.drain()
+        packet_type, _, body = await asyncio.wait_for(read_packet(reader), self.config['connect_timeout'])
+        if packet_type != CONNACK or len(body) < 2:
+            raise MQTTProtocolError(f"Expected CONNACK, got packet type {packet_type}")
+        if body[1] != 0:
+            raise MQTTProtocolError(f"Connection refused with code {body[1]}")
+
+        self._writer = writer
+        self.connected = True
+        self.on_connect()
+        writer.write(encode_subscribe(self._mid(), self.config['rpc_topic']))
+        pending = self.queue.pending()
+        if pending:
+            logger.info(f"Sending {pending} queued MQTT messages")
+
+        tasks = {asyncio.ensure_future(self._receive(reader, writer)),
+                 asyncio.ensure_future(self._drain(writer)),
+                 asyncio.ensure_future(self._keepalive(writer))}
+        try:
+            done, _ = await asyncio.wait(tasks, return_when = asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions = True)
+        for task in done:
+            task.result()
+
+    def _mid(self) -> int:
+        self._next_mid = self._next_mid % 65535 + 1
+        return self._next_mid
+
+    async def _receive(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        timeout = self.config['keepalive'] * 1.5
+        while True:
+            packet_type, flags, body = await asyncio.wait_for(read_packet(reader), timeout)
+            if packet_type == PUBACK:
+                future = self._inflight.pop(struct.unpack('!H', body[:2])[0], None)
+                if future is not None and not future.done():
+                    future.set_result(True)
+            elif packet_type == PUBLISH:
+                topic, payload, qos, mid = decode_publish(flags, body)
+                if qos:
+                    writer.write(encode_mid(PUBACK, mid))
+                self.on_message(topic, payload)
+            elif packet_type not in (SUBACK, PINGRESP):
+                logger.debug(f"Ignoring MQTT packet type {packet_type}")
+
+    async def _keepalive(self, writer: asyncio.StreamWriter) -> None:
+        while True:
+            await asyncio.sleep(self.config['keepalive'] / 2)
+            writer.write(encode_packet(PINGREQ, 0, b''))
+            await writer.drain()
+
+    async def _drain(self, writer: asyncio.StreamWriter) -> None:
+        """Send the queue from the first unacknowledged entry, with a bounded in-flight window"""
+        window = asyncio.Semaphore(self.config['max_inflight'])
+        next_seq = self.queue.acked_through + 1
+        while True:
+            self._new_entries.clear()
+            entries = self.queue.read(next_seq, self.config['batch_size'])
+            if not entries:
+                await self._new_entries.wait()
+                continue
+
+            for topic, payload, qos, seqs in coalesce(entries, self.config):
+                await window.acquire()
+                mid = self._mid() if qos else 0
+                if isinstance(payload, str):
+                    payload = payload.encode('utf-8')
+                writer.write(encode_publish(topic, payload, min(qos, 1), mid))
+                await writer.drain()
+                self.messages_sent += 1
+                next_seq = seqs[-1] + 1
+                if not qos:
+                    window.release()
+                    self._acknowledged(seqs)
+                    continue
+                future = self._loop.create_future()
+                self._inflight[mid] = future
+                future.add_done_callback(lambda f, seqs = seqs: self._on_puback(f, seqs, window))
+
+    def _on_puback(self, future: asyncio.Future, seqs: List[int], window: asyncio.Semaphore) -> None:
+        window.release()
+        if not future.cancelled() and future.exception() is None:
+            self._acknowledged(seqs)
+
+    def _acknowledged(self, seqs: List[int]) -> None:
+        self.queue.ack(seqs)
+        with self._waiters_lock:
+            waiters = [self._waiters.pop(seq, None) for seq in seqs]
+        for waiter in waiters:
+            if waiter is not None and not waiter.done():
+                waiter.set_result(True)
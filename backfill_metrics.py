@@ -0,0 +1,269 @@
+"""
+Recompute body-composition metrics for the whole measurement history.
+
+Streams user_data.csv in chunks, recomputes gender and bmi..ideal_weight in a
+process pool with the batch APIs of calc_metrics and ai_predict, and writes a
+new versioned CSV atomically. The camera-bound one-leg balance test is never
+run: the stored oneleg_standing value is kept as is. Progress is checkpointed
+after every chunk so an interrupted run resumes where it stopped. The default
+version tag is derived from the input file's modification time, so rerunning
+the same command on an unchanged file picks up the checkpoint.
+
+Usage:
+    python backfill_metrics.py [--input user_data/user_data.csv] [--version v2] [--workers 4]
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+import ai_predict as ap
+import calc_metrics as cm
+from csv_update import CSV_CONFIG, CSV_HEADERS
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_CONFIG = {
+    'chunk_size': 5000,
+    'workers': os.cpu_count() or 1,
+    'max_pending_chunks_per_worker': 2,
+}
+
+# Columns rewritten by the backfill, and the measurement key each one holds
+RECOMPUTED_COLUMNS = {
+    header: key for header, key in CSV_HEADERS.items()
+    if header in ('gender', 'bmi', 'bmr', 'tdee', 'lean_body_mass', 'fat_percentage', 'water_percentage',
+                  'bone_mass', 'muscle_mass', 'protein_percentage', 'visceral_fat', 'ideal_weight')
+}
+
+INPUT_COLUMNS = ('age', 'height', 'weight', 'activity_factor')
+
+
+def _to_float(values):
+    """Parse a list of CSV strings; unparsable values become NaN"""
+    result = np.full(len(values), np.nan)
+    for i, value in enumerate(values):
+        try:
+            result[i] = float(value)
+        except (TypeError, ValueError):
+            pass
+    return result
+
+
+def recompute_chunk(header, rows):
+    """
+    Recompute the metric columns of a chunk of raw CSV rows
+
+    Rows whose age/height/weight/activity factor are missing or invalid are
+    returned unchanged.
+
+    Args:
+        header: Column names of the CSV file
+        rows: List of rows (lists of strings)
+
+    Returns:
+        List of rows with the recomputed columns replaced
+    """
+    index = {name: i for i, name in enumerate(header)}
+    inputs = {name: _to_float([row[index[name]] if index[name] < len(row) else '' for row in rows])
+              for name in INPUT_COLUMNS}
+
+    valid = np.ones(len(rows), dtype = bool)
+    for values in inputs.values():
+        valid &= np.isfinite(values) & (values > 0)
+    positions = np.flatnonzero(valid)
+    if len(positions) == 0:
+        return rows
+
+    age, height, weight, activity_factor = (inputs[name][positions] for name in INPUT_COLUMNS)
+
+    gender = ap.predict_gender_many(height, weight)
+    metrics = cm.get_body_metrics_batch(gender, age, height, weight, activity_factor)
+    metrics['gender'] = gender
+    # Như calculate_body_metrics: phần trăm mỡ lấy từ mô hình body_fat
+    metrics['fp'] = ap.predict_body_fat_many(age, gender, height, weight)
+
+    columns = [(index[header_name], metrics[key]) for header_name, key in RECOMPUTED_COLUMNS.items()
+               if header_name in index]
+    for j, position in enumerate(positions):
+        row = list(rows[position])
+        row.extend([''] * (len(header) - len(row)))
+        for column, values in columns:
+            value = values[j]
+            row[column] = str(value) if isinstance(value, str) else str(round(float(value), 2))
+        rows[position] = row
+    return rows
+
+
+class BackfillJob:
+    """
+    Chunked, resumable recomputation of one history file into a versioned copy
+
+    Args:
+        version: Output version tag; defaults to the input file's modification
+            time, so a rerun on the same input resumes the same checkpoint
+    """
+
+    def __init__(self, input_path=None, version=None, chunk_size=None, workers=None, config=None):
+        self.config = config or CSV_CONFIG
+        self.input_path = Path(input_path or self.config['file_path'])
+        self.version = version or self._default_version()
+        self.chunk_size = chunk_size or BACKFILL_CONFIG['chunk_size']
+        self.workers = workers or BACKFILL_CONFIG['workers']
+        self.output_path = self.input_path.with_name(f"{self.input_path.stem}.{self.version}{self.input_path.suffix}")
+        self.partial_path = self.output_path.with_name(self.output_path.name + '.partial')
+        self.checkpoint_path = self.output_path.with_name(self.output_path.name + '.checkpoint')
+
+    def _default_version(self):
+        # Tên phiên bản cố định theo file nguồn để chạy lại thì tiếp tục được từ checkpoint
+        try:
+            modified = datetime.fromtimestamp(self.input_path.stat().st_mtime)
+        except OSError:
+            modified = datetime.now()
+        return modified.strftime('%Y%m%d_%H%M%S')
+
+    def _source_signature(self):
+        stat = self.input_path.stat()
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def _load_checkpoint(self):
+        """Return the checkpoint of a previous run of this version, if it is still usable"""
+        if not (self.checkpoint_path.exists() and self.partial_path.exists()):
+            return None
+        try:
+            with open(self.checkpoint_path, 'r', encoding = 'utf-8') as file:
+                checkpoint = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable checkpoint {self.checkpoint_path}: {e}")
+            return None
+        if checkpoint.get('source') != self._source_signature():
+            logger.warning("Source file changed since the checkpoint was written, starting over")
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self, rows_done, output_bytes):
+        checkpoint = {'source': self._source_signature(), 'rows_done': rows_done, 'output_bytes': output_bytes}
+        temp_path = self.checkpoint_path.with_name(self.checkpoint_path.name + '.tmp')
+        with open(temp_path, 'w', encoding = 'utf-8') as file:
+            json.dump(checkpoint, file)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def _chunks(self, reader, skip_rows):
+        chunk = []
+        for row in reader:
+            # Bỏ qua dòng trống và các dòng đã xử lý ở lần chạy trước
+            if not row:
+                continue
+            if skip_rows > 0:
+                skip_rows -= 1
+                continue
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def run(self):
+        """
+        Run (or resume) the backfill
+
+        Returns:
+            Dictionary with the output path, processed rows and throughput
+        """
+        if not self.input_path.exists():
+            raise FileNotFoundError(self.input_path)
+
+        checkpoint = self._load_checkpoint()
+        rows_done = checkpoint['rows_done'] if checkpoint else 0
+        if checkpoint:
+            logger.info(f"Resuming backfill {self.version} after {rows_done} rows")
+
+        start_time = time.perf_counter()
+        rows_this_run = 0
+        max_pending = self.workers * BACKFILL_CONFIG['max_pending_chunks_per_worker']
+
+        with open(self.input_path, 'r', encoding = self.config['encoding'], newline = '') as src, \
+                open(self.partial_path, 'r+b' if checkpoint else 'wb') as raw_dst, \
+                ProcessPoolExecutor(max_workers = self.workers) as executor:
+            reader = csv.reader(src)
+            header = next(reader, None)
+            if header is None:
+                raise ValueError(f"Empty history file: {self.input_path}")
+
+            if checkpoint:
+                raw_dst.truncate(checkpoint['output_bytes'])
+                raw_dst.seek(checkpoint['output_bytes'])
+            else:
+                # Header được mã hóa với encoding của file (kèm BOM nếu là utf-8-sig)
+                raw_dst.write(self._encode_rows([header], self.config['encoding']))
+
+            pending = deque()
+
+            def write_next():
+                nonlocal rows_done, rows_this_run
+                rows = pending.popleft().result()
+                raw_dst.write(self._encode_rows(rows))
+                raw_dst.flush()
+                os.fsync(raw_dst.fileno())
+                rows_done += len(rows)
+                rows_this_run += len(rows)
+                self._save_checkpoint(rows_done, raw_dst.tell())
+                elapsed = time.perf_counter() - start_time
+                logger.info(f"Backfilled {rows_done} rows ({rows_this_run / elapsed:.0f} rows/s)")
+
+            for chunk in self._chunks(reader, rows_done):
+                pending.append(executor.submit(recompute_chunk, header, chunk))
+                if len(pending) >= max_pending:
+                    write_next()
+            while pending:
+                write_next()
+
+        os.replace(self.partial_path, self.output_path)
+        self.checkpoint_path.unlink(missing_ok = True)
+
+        elapsed = time.perf_counter() - start_time
+        result = {
+            'output': str(self.output_path),
+            'rows': rows_done,
+            'rows_this_run': rows_this_run,
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(rows_this_run / elapsed, 1) if elapsed > 0 else None,
+        }
+        logger.info(f"Backfill complete: {result}")
+        return result
+
+    def _encode_rows(self, rows, encoding=None):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        if encoding is None:
+            encoding = 'utf-8' if self.config['encoding'] == 'utf-8-sig' else self.config['encoding']
+        return buffer.getvalue().encode(encoding)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description = "Recompute body-composition metrics for the whole history")
+    parser.add_argument('--input', default = CSV_CONFIG['file_path'], help = "History CSV to recompute")
+    parser.add_argument('--version', help = "Output version tag (default: modification time of the input)")
+    parser.add_argument('--chunk-size', type = int, default = BACKFILL_CONFIG['chunk_size'])
+    parser.add_argument('--workers', type = int, default = BACKFILL_CONFIG['workers'])
+    args = parser.parse_args(argv)
+
+    job = BackfillJob(args.input, args.version, args.chunk_size, args.workers)
+    print(json.dumps(job.run(), indent = 2))
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level = logging.INFO, format = '%(levelname)s: %(message)s')
+    sys.exit(main())
@@ -0,0 +1,326 @@
+"""
+Benchmarks for the per-measurement hot path.
+
+Covers data_parser for both device formats, every calc_metrics function,
+calculate_body_metrics (camera stubbed out), ai_predict predictions and
+CSVDataManager.update_csv / read_csv_data on synthetic histories, and
+JSON vs telemetry_codec encoding of the MQTT payload (time, plus the bytes
+on the wire under report['payload_bytes']).
+
+Usage:
+    python benchmark_hot_path.py --output bench.json
+    python benchmark_hot_path.py --output bench.json --compare baseline.json --threshold 0.2
+    python benchmark_hot_path.py --sizes 1000 100000 --filter calc_metrics
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import logging
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_CONFIG = {
+    'sizes': [1000, 100000, 1000000],  # History sizes (rows) for the CSV benchmarks
+    'repeat': 5,  # Timed runs per benchmark; the median is reported
+    'min_run_time': 0.1,  # Seconds each timed run should last at least
+    'threshold': 0.2,  # Relative slowdown of the median that counts as a regression
+    'telemetry_batch': 50,  # Entries in the coalesced catch-up message (QUEUE_CONFIG['batch_size'])
+}
+
+SAMPLE_USER = {
+    'name': 'Lê Đạt',
+    'dob': '23/09/1999',
+    'gender': 'Nam',
+    'cccd_id': '084099010894',
+    'address': 'Số 767, Khóm 3, Phường 7, Thành phố Trà Vinh, Trà Vinh',
+    'height': 170.0,
+    'weight': 65.5,
+    'age': 25,
+    'activity_factor': 1.55,
+}
+
+# Notification payloads of the two supported scales, both decoding to 65.5 kg
+SAMPLE_PAYLOADS = {
+    'Crenot Gofit S2': bytes.fromhex('00000000000008ffdc0000'),
+    'MI SCALE2': bytes([0x02]) + int(65.5 * 200).to_bytes(2, 'little') + bytes(10),
+}
+
+
+def stub_camera_and_llm():
+    """Replace the camera-bound and LLM modules so benchmarks never open a camera or call an API"""
+    balance = types.ModuleType('oneleg_timer')
+    balance.one_leg_balance_detection = lambda *args, **kwargs: {'session_duration': 30.0, 'avg_offset': 0.0}
+    sys.modules['oneleg_timer'] = balance
+
+    standing = types.ModuleType('oneleg_standing_timer')
+    standing.one_leg_balance_detection = balance.one_leg_balance_detection
+    sys.modules['oneleg_standing_timer'] = standing
+
+    recommendations = types.ModuleType('ai_recommendations')
+    recommendations.ai_health_recommendations = lambda measurements: ''
+    sys.modules['ai_recommendations'] = recommendations
+
+
+def measure(func, repeat=None, min_run_time=None):
+    """
+    Time `func` and return per-call statistics in microseconds
+
+    The number of calls per run is calibrated so a run lasts at least
+    `min_run_time` seconds; `repeat` runs are made.
+    """
+    repeat = repeat or BENCHMARK_CONFIG['repeat']
+    min_run_time = min_run_time or BENCHMARK_CONFIG['min_run_time']
+
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_run_time or number >= 1 << 20:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(min_run_time / elapsed) + 1))
+
+    runs = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        runs.append((time.perf_counter() - start) / number)
+
+    return {
+        'median_us': statistics.median(runs) * 1e6,
+        'mean_us': statistics.fmean(runs) * 1e6,
+        'min_us': min(runs) * 1e6,
+        'stdev_us': (statistics.stdev(runs) if len(runs) > 1 else 0.0) * 1e6,
+        'calls_per_run': number,
+        'runs': repeat,
+    }
+
+
+def parser_benchmarks():
+    import data_parser as parser
+
+    return {f"data_parser[{device}]": (lambda d=device, p=payload: parser.data_parser(p, d))
+            for device, payload in SAMPLE_PAYLOADS.items()}
+
+
+def calc_metrics_benchmarks():
+    import calc_metrics as cm
+
+    g, a, h, w = 'male', SAMPLE_USER['age'], SAMPLE_USER['height'], SAMPLE_USER['weight']
+    return {
+        'calc_metrics.get_bmi': lambda: cm.get_bmi(h, w),
+        'calc_metrics.get_bmr_tdee': lambda: cm.get_bmr_tdee(w, h, a, g, SAMPLE_USER['activity_factor']),
+        'calc_metrics.get_lbm': lambda: cm.get_lbm(h, w, g),
+        'calc_metrics.get_fat_percentage': lambda: cm.get_fat_percentage(g, a, w, h),
+        'calc_metrics.get_water_percentage': lambda: cm.get_water_percentage(g, a, w, h),
+        'calc_metrics.get_bone_mass': lambda: cm.get_bone_mass(h, w, g),
+        'calc_metrics.get_muscle_mass': lambda: cm.get_muscle_mass(g, a, w, h),
+        'calc_metrics.get_protein_percentage': lambda: cm.get_protein_percentage(g, a, w, h),
+        'calc_metrics.get_visceral_fat': lambda: cm.get_visceral_fat(h, w, a),
+        'calc_metrics.get_ideal_weight': lambda: cm.get_ideal_weight(g, h),
+        'calc_metrics.get_body_metrics_batch[1000]': lambda: cm.get_body_metrics_batch(
+            [g] * 1000, [a] * 1000, [h] * 1000, [w] * 1000, [SAMPLE_USER['activity_factor']] * 1000),
+    }
+
+
+def body_composition_benchmarks():
+    import calc_body_composition as cbc
+
+    return {'calc_body_composition.calculate_body_metrics': lambda: cbc.calculate_body_metrics(SAMPLE_USER)}
+
+
+def ai_predict_benchmarks():
+    import ai_predict as ap
+
+    h, w, a = SAMPLE_USER['height'], SAMPLE_USER['weight'], SAMPLE_USER['age']
+    return {
+        'ai_predict.predict_gender': lambda: ap.predict_gender(h, w),
+        'ai_predict.predict_body_fat': lambda: ap.predict_body_fat(a, 'male', h, w),
+    }
+
+
+def telemetry_samples(batch_size):
+    """One measurement dict and a catch-up batch of [(ts, values)] as the outbound queue sends them"""
+    import calc_body_composition as cbc
+
+    values = cbc.calculate_body_metrics(SAMPLE_USER)
+    start = int(time.time() * 1000)
+    return values, [(start + i * 60000, values) for i in range(batch_size)]
+
+
+def telemetry_benchmarks():
+    import telemetry_codec
+
+    values, batch = telemetry_samples(BENCHMARK_CONFIG['telemetry_batch'])
+    size = len(batch)
+    payload = telemetry_codec.encode_measurement(values)
+    batch_payload = telemetry_codec.encode_batch(batch)
+    return {
+        'telemetry.json_dumps': lambda: json.dumps(values),
+        'telemetry.encode_measurement': lambda: telemetry_codec.encode_measurement(values),
+        'telemetry.decode_payload': lambda: telemetry_codec.decode_payload(payload),
+        f"telemetry.json_dumps_batch[{size}]":
+            lambda: json.dumps([{'ts': ts, 'values': v} for ts, v in batch], ensure_ascii = False),
+        f"telemetry.encode_batch[{size}]": lambda: telemetry_codec.encode_batch(batch),
+        f"telemetry.decode_payload_batch[{size}]": lambda: telemetry_codec.decode_payload(batch_payload),
+    }
+
+
+def telemetry_payload_bytes():
+    """Bytes on the wire per encoding, for a single measurement and a catch-up batch"""
+    import telemetry_codec
+
+    values, batch = telemetry_samples(BENCHMARK_CONFIG['telemetry_batch'])
+    json_batch = json.dumps([{'ts': ts, 'values': v} for ts, v in batch], ensure_ascii = False)
+    return {
+        'json': len(json.dumps(values).encode('utf-8')),
+        'binary': len(telemetry_codec.encode_measurement(values)),
+        f"json_batch[{len(batch)}]": len(json_batch.encode('utf-8')),
+        f"binary_batch[{len(batch)}]": len(telemetry_codec.encode_batch(batch)),
+    }
+
+
+def write_synthetic_history(path, rows):
+    """Write a history CSV with `rows` measurement rows in the CSV_HEADERS layout"""
+    import calc_body_composition as cbc
+    from csv_update import CSVDataManager
+
+    config = {'file_path': str(path), 'encoding': 'utf-8-sig', 'date_format': "%d/%m/%Y %H:%M"}
+    manager = CSVDataManager(config)
+    row = manager.prepare_csv_row(SAMPLE_USER, cbc.calculate_body_metrics(SAMPLE_USER))
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(list(manager.headers.keys()))
+    for _ in range(rows):
+        writer.writerow(row)
+    path.write_text(buffer.getvalue(), encoding = config['encoding'], newline = '')
+    return config
+
+
+def csv_benchmarks(sizes, workdir, name_filter=None):
+    """Build the history files only for the sizes whose benchmarks pass `name_filter`"""
+    from csv_update import CSVDataManager
+    import calc_body_composition as cbc
+
+    def selected(size):
+        names = (f"CSVDataManager.read_csv_data[{size}]", f"CSVDataManager.update_csv[{size}]")
+        return not name_filter or any(name_filter in name for name in names)
+
+    sizes = [size for size in sizes if selected(size)]
+    if not sizes:
+        return {}
+    measurements = cbc.calculate_body_metrics(SAMPLE_USER)
+    benchmarks = {}
+    for size in sizes:
+        config = write_synthetic_history(Path(workdir) / f"history_{size}.csv", size)
+        manager = CSVDataManager(config)
+        benchmarks[f"CSVDataManager.read_csv_data[{size}]"] = manager.read_csv_data
+        # update_csv appends, so the file grows slightly during the run; that is negligible next to `size`
+        benchmarks[f"CSVDataManager.update_csv[{size}]"] = \
+            lambda m=manager: m.update_csv(SAMPLE_USER, measurements)
+    return benchmarks
+
+
+def run(sizes=None, name_filter=None):
+    """Run every benchmark and return the JSON-serializable report"""
+    stub_camera_and_llm()
+    sizes = BENCHMARK_CONFIG['sizes'] if sizes is None else sizes
+
+    report = {
+        'created': datetime.now().isoformat(timespec = 'seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': {},
+    }
+
+    with tempfile.TemporaryDirectory() as workdir:
+        groups = [parser_benchmarks, calc_metrics_benchmarks, body_composition_benchmarks, ai_predict_benchmarks,
+                  telemetry_benchmarks, lambda: csv_benchmarks(sizes, workdir, name_filter)]
+        # update_csv logs and prints on every call; keep benchmark output readable
+        logging.getLogger('csv_update').setLevel(logging.WARNING)
+        for group in groups:
+            for name, func in group().items():
+                if name_filter and name_filter not in name:
+                    continue
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result = measure(func)
+                report['results'][name] = result
+                logger.info(f"{name}: {result['median_us']:.2f} us")
+
+    if not name_filter or 'telemetry' in name_filter:
+        report['payload_bytes'] = telemetry_payload_bytes()
+
+    return report
+
+
+def compare(current, baseline, threshold=None):
+    """
+    Compare the medians of two reports
+
+    Returns:
+        List of regressions, each a dictionary with the benchmark name, both
+        medians and the relative change
+    """
+    threshold = BENCHMARK_CONFIG['threshold'] if threshold is None else threshold
+    regressions = []
+    for name, result in current['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or previous['median_us'] <= 0:
+            continue
+        change = result['median_us'] / previous['median_us'] - 1
+        if change > threshold:
+            regressions.append({
+                'name': name,
+                'baseline_us': previous['median_us'],
+                'current_us': result['median_us'],
+                'change': round(change, 4),
+            })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description = "Benchmark the per-measurement hot path")
+    parser.add_argument('--output', help = "Write the JSON report to this file")
+    parser.add_argument('--compare', help = "Baseline JSON report to compare against")
+    parser.add_argument('--threshold', type = float, default = BENCHMARK_CONFIG['threshold'],
+                        help = "Relative slowdown that counts as a regression (default: 0.2 = 20%%)")
+    parser.add_argument('--sizes', type = int, nargs = '*', default = BENCHMARK_CONFIG['sizes'],
+                        help = "History sizes in rows for the CSV benchmarks")
+    parser.add_argument('--filter', help = "Only run benchmarks whose name contains this text")
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.filter)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding = 'utf-8') as file:
+            baseline = json.load(file)
+        report['regressions'] = compare(report, baseline, args.threshold)
+
+    text = json.dumps(report, indent = 2)
+    if args.output:
+        Path(args.output).write_text(text, encoding = 'utf-8')
+    else:
+        print(text)
+
+    for regression in report.get('regressions', []):
+        logger.error(f"REGRESSION {regression['name']}: {regression['baseline_us']:.2f} us -> "
+                     f"{regression['current_us']:.2f} us (+{regression['change']:.0%})")
+    return 1 if report.get('regressions') else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level = logging.INFO, format = '%(levelname)s: %(message)s')
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""
+Write-behind (group commit) writer for measurement rows.
+
+update_csv opens the CSV file, appends one row and closes it for every
+record. BufferedCSVWriter validates and queues rows instead, and a
+background thread appends them in batches, flushing when `batch_size`
+rows are waiting or `flush_interval` seconds after the first queued row.
+The file stays open between batches.
+
+Durability policies (when data reaches the disk, not just the OS cache):
+    'none'   flush to the OS after each batch, never fsync
+    'batch'  fsync after each batch (default)
+    'row'    flush and fsync after every row
+
+With a storage backend configured (see storage_backends), each batch is
+written in one transaction instead.
+
+A batch that cannot be written (e.g. LockTimeout while another process
+merges shards) goes back to the front of the queue and is retried with
+exponential backoff; submit() keeps applying `max_queue` backpressure in the
+meantime. After `max_retries` failed attempts, or when the writer is closing,
+the rows are appended to `<name>.recovery.csv` next to the file instead of being dropped.
+"""
+import atexit
+import csv
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from csv_update import CSVDataManager
+from file_lock import FileLock
+
+logger = logging.getLogger(__name__)
+
+WRITER_CONFIG = {
+    'batch_size': 100,
+    'flush_interval': 0.5,  # seconds
+    'durability': 'batch',  # 'none', 'batch' or 'row'
+    'max_queue': 10000,  # submit() waits for room beyond this many queued rows
+    'latency_samples': 1000,
+    'retry_delay': 0.5,  # seconds before retrying a failed batch, doubled per failure
+    'retry_max_delay': 30.0,
+    'max_retries': 20,  # Failed attempts before a batch is spilled to the recovery file
+}
+
+DURABILITY_POLICIES = ('none', 'batch', 'row')
+
+
+class BufferedCSVWriter:
+    """
+    Background batch writer in front of a CSVDataManager
+
+    Args:
+        manager: CSVDataManager whose file (or backend) receives the rows
+        config: WRITER_CONFIG overrides
+    """
+
+    def __init__(self, manager: Optional[CSVDataManager] = None, config: Dict[str, Any] = None):
+        self.manager = manager or CSVDataManager()
+        self.config = {**WRITER_CONFIG, **(config or {})}
+        if self.config['durability'] not in DURABILITY_POLICIES:
+            raise ValueError(f"Unknown durability policy: {self.config['durability']}")
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._pending = 0  # Rows queued or being written
+        self._file = None
+        self._file_id = None
+
+        self.rows_written = 0
+        self.batches_written = 0
+        self.failed_batches = 0  # Failed write attempts (the batch is retried or spilled)
+        self.spilled_rows = 0
+        self._latencies = deque(maxlen = self.config['latency_samples'])
+
+        self._thread = threading.Thread(target = self._run, name = 'csv-writer', daemon = True)
+        self._thread.start()
+
+    def submit(self, user_info: Dict[str, Any], measurements: Dict[str, Any],
+               timeout: Optional[float] = None) -> Tuple[bool, List[str]]:
+        """
+        Validate a record and queue it for writing
+
+        Returns:
+            Tuple of (queued, list_of_messages), like CSVDataManager.update_csv
+        """
+        is_valid, errors = self.manager.validate_data(user_info, measurements)
+        if not is_valid:
+            return False, errors
+        row = self.manager.prepare_csv_row(user_info, measurements)
+
+        with self._condition:
+            if self._closed:
+                return False, ["Writer is closed"]
+            if not self._condition.wait_for(lambda: len(self._queue) < self.config['max_queue'] or self._closed,
+                                            timeout = timeout):
+                return False, [f"Write queue is full ({len(self._queue)} rows)"]
+            self._queue.append((time.perf_counter(), row))
+            self._pending += 1
+            self._condition.notify_all()
+        return True, ["Row queued"]
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every row queued so far is written; returns False on timeout"""
+        with self._condition:
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: self._pending == 0, timeout = timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Write every queued row, then stop the background thread and close the file"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+    def _next_batch(self) -> List[Tuple[float, List[Any]]]:
+        with self._condition:
+            while True:
+                if self._queue:
+                    waited = time.perf_counter() - self._queue[0][0]
+                    if (len(self._queue) >= self.config['batch_size'] or self._closed
+                            or waited >= self.config['flush_interval']):
+                        count = min(len(self._queue), self.config['batch_size'])
+                        batch = [self._queue.popleft() for _ in range(count)]
+                        self._condition.notify_all()
+                        return batch
+                    self._condition.wait(self.config['flush_interval'] - waited)
+                elif self._closed:
+                    return []
+                else:
+                    self._condition.wait()
+
+    def _run(self):
+        failures = 0
+        while True:
+            entries = self._next_batch()
+            if not entries:
+                break
+            batch = [row for _, row in entries]
+
+            start = time.perf_counter()
+            try:
+                self._write(batch)
+                self.rows_written += len(batch)
+                self.batches_written += 1
+                failures = 0
+            except Exception as e:
+                failures += 1
+                self.failed_batches += 1
+                if failures <= self.config['max_retries'] and not self._closed:
+                    delay = min(self.config['retry_max_delay'], self.config['retry_delay'] * 2 ** (failures - 1))
+                    logger.warning(f"Failed to write {len(batch)} rows (attempt {failures}), "
+                                   f"retrying in {delay:.1f}s: {e}")
+                    with self._condition:
+                        # Đưa lô trở lại đầu hàng đợi, giữ nguyên thứ tự
+                        self._queue.extendleft(reversed(entries))
+                        self._condition.wait_for(lambda: self._closed, timeout = delay)
+                    continue
+                logger.error(f"Failed to write {len(batch)} rows after {failures} attempts: {e}")
+                self._spill(batch)
+                failures = 0
+            self._latencies.append(time.perf_counter() - start)
+
+            with self._condition:
+                self._pending -= len(batch)
+                self._condition.notify_all()
+        self._close_file()
+
+    def recovery_path(self):
+        path = self.manager.file_path
+        return path.with_name(f'{path.stem}.recovery.csv')
+
+    def _spill(self, batch: List[List[Any]]):
+        """Append rows that could not be written to the recovery file, as the last resort"""
+        path = self.recovery_path()
+        try:
+            path.parent.mkdir(parents = True, exist_ok = True)
+            with open(path, mode = 'a', newline = '', encoding = self.manager.config['encoding']) as file:
+                writer = csv.writer(file)
+                if file.tell() == 0:
+                    writer.writerow(list(self.manager.headers.keys()))
+                writer.writerows(batch)
+                file.flush()
+                os.fsync(file.fileno())
+            self.spilled_rows += len(batch)
+            logger.error(f"Saved {len(batch)} unwritten rows to {path}")
+        except OSError as e:
+            logger.critical(f"Lost {len(batch)} rows, recovery file {path} is not writable: {e}")
+
+    def _open_file(self):
+        """Keep the file open across batches; reopen it if it was replaced (e.g. by fix_csv_file)"""
+        path = self.manager.file_path
+        file_id = None
+        if path.exists():
+            stat = path.stat()
+            file_id = (stat.st_dev, stat.st_ino)
+        if self._file is None or file_id != self._file_id:
+            self._close_file()
+            self.manager.ensure_directory_exists()
+            self._file = open(path, mode = 'a', newline = '', encoding = self.manager.config['encoding'])
+            stat = os.fstat(self._file.fileno())
+            self._file_id = (stat.st_dev, stat.st_ino)
+        return self._file
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._file_id = None
+
+    def _write(self, batch: List[List[Any]]):
+        if self.manager.backend is not None:
+            self.manager.backend.append_rows(batch)
+            return
+
+        with FileLock(self.manager.file_path, self.manager.config.get('lock_timeout', 10.0)):
+            file = self._open_file()
+            writer = csv.writer(file)
+            if file.tell() == 0:
+                writer.writerow(list(self.manager.headers.keys()))
+
+            durability = self.config['durability']
+            for row in batch:
+                writer.writerow(row)
+                if durability == 'row':
+                    file.flush()
+                    os.fsync(file.fileno())
+            file.flush()
+            if durability == 'batch':
+                os.fsync(file.fileno())
+
+    def metrics(self) -> Dict[str, Any]:
+        """Queue depth, throughput counters and flush latency (ms) over the recent batches"""
+        with self._condition:
+            queue_depth = len(self._queue)
+            pending = self._pending
+        latencies = sorted(self._latencies)
+
+        def percentile(fraction):
+            return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 3)
+
+        return {
+            'queue_depth': queue_depth,
+            'pending_rows': pending,
+            'rows_written': self.rows_written,
+            'batches_written': self.batches_written,
+            'failed_batches': self.failed_batches,
+            'spilled_rows': self.spilled_rows,
+            'flush_ms_p50': percentile(0.5) if latencies else None,
+            'flush_ms_p95': percentile(0.95) if latencies else None,
+            'flush_ms_max': round(latencies[-1] * 1000, 3) if latencies else None,
+        }
+
+
+_shared_writer = None
+_shared_writer_lock = threading.Lock()
+
+
+def get_shared_writer() -> BufferedCSVWriter:
+    """Process-wide writer for the default CSV file, flushed and closed at exit"""
+    global _shared_writer
+    with _shared_writer_lock:
+        if _shared_writer is None:
+            _shared_writer = BufferedCSVWriter()
+            atexit.register(_shared_writer.close)
+        return _shared_writer
+
+
+def flush_shared_writer(timeout: Optional[float] = None) -> bool:
+    """Flush the process-wide writer if one was created"""
+    return _shared_writer.flush(timeout) if _shared_writer is not None else True
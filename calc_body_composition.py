@@ -1,54 +1,146 @@
+import logging
+import time
+
 import calc_metrics as cm
-import oneleg_standing_timer as ast
 import ai_predict as ap
-import oneleg_timer as ot
+from lazy_imports import lazy_import
 
-def calculate_body_metrics(user_info):
-    # Tính BMI
-    bmi = cm.get_bmi(user_info['height'], user_info['weight'])
+# OpenCV/MediaPipe chỉ được nạp khi bắt đầu bài đo thăng bằng
+ast = lazy_import('oneleg_standing_timer')
+ot = lazy_import('oneleg_timer')
+
+logger = logging.getLogger(__name__)
+
+# Đồ thị tính toán chỉ số: mỗi chỉ số chỉ khai báo cách tính từ các chỉ số khác
+# (qua context.get), nên mỗi giá trị trung gian chỉ được tính đúng một lần cho mỗi lần đo
+METRIC_GRAPH = {
     # Dự đoán giới tính
-    predicted_gender = ap.predict_gender(user_info['height'], user_info['weight'])
+    'gender': lambda c: ap.predict_gender(c.height, c.weight),
+    # Tính BMI
+    'bmi': lambda c: cm.get_bmi(c.height, c.weight),
     # Tính BMR và TDEE
-    bmr, tdee = cm.get_bmr_tdee(user_info['weight'], user_info['height'], user_info['age'], predicted_gender,
-                                user_info['activity_factor'])
+    'bmr_tdee': lambda c: cm.get_bmr_tdee(c.weight, c.height, c.age, c.get('gender'), c.activity_factor),
     # Tính LBM (Lean Body Mass)
-    lbm = cm.get_lbm(user_info['height'], user_info['weight'], predicted_gender)
-    # Tính fat percentage (phần trăm mỡ)
-    fp = ap.predict_body_fat(user_info['age'], predicted_gender, user_info['height'], user_info['weight'])
+    'lbm': lambda c: cm.get_lbm(c.height, c.weight, c.get('gender')),
+    # Phần trăm mỡ theo công thức, dùng làm đầu vào cho nước/cơ/protein
+    'fat_formula': lambda c: cm.get_fat_percentage(c.get('gender'), c.age, c.weight, c.height, c.get('lbm')),
+    # Tính fat percentage (phần trăm mỡ) bằng mô hình
+    'fp': lambda c: ap.predict_body_fat(c.age, c.get('gender'), c.height, c.weight),
     # Tính water percentage (phần trăm nước)
-    wp = cm.get_water_percentage(predicted_gender, user_info['age'], user_info['weight'], user_info['height'])
+    'wp': lambda c: cm.get_water_percentage(c.get('gender'), c.age, c.weight, c.height, c.get('fat_formula')),
     # Tính bone mass (khối lượng xương)
-    bm = cm.get_bone_mass(user_info['height'], user_info['weight'], predicted_gender)
+    'bm': lambda c: cm.get_bone_mass(c.height, c.weight, c.get('gender'), c.get('lbm')),
     # Tính muscle mass (khối lượng cơ)
-    ms = cm.get_muscle_mass(predicted_gender, user_info['age'], user_info['weight'], user_info['height'])
+    'ms': lambda c: cm.get_muscle_mass(c.get('gender'), c.age, c.weight, c.height, c.get('fat_formula'), c.get('bm')),
     # Tính protein percentage (phần trăm protein)
-    pp = cm.get_protein_percentage(predicted_gender, user_info['age'], user_info['weight'], user_info['height'], True)
+    'pp': lambda c: cm.get_protein_percentage(c.get('gender'), c.age, c.weight, c.height, True,
+                                              fat_percentage = c.get('fat_formula'),
+                                              water_percentage = c.get('wp'),
+                                              bone_mass = c.get('bm'),
+                                              muscle_mass = c.get('ms')),
     # Tính visceral fat (mỡ nội tạng)
-    vf = cm.get_visceral_fat(user_info['height'], user_info['weight'], user_info['age'])
+    'vf': lambda c: cm.get_visceral_fat(c.height, c.weight, c.age),
     # Tính ideal weight (cân nặng lý tưởng)
-    iw = cm.get_ideal_weight(predicted_gender, user_info['height'], True)
+    'iw': lambda c: cm.get_ideal_weight(c.get('gender'), c.height, True),
     # Đo thời gian thăng bằng trên 1 chân
-    ols = ot.one_leg_balance_detection()
-    # Trả về tất cả các kết quả dưới dạng dictionary
+    'ols': lambda c: ot.one_leg_balance_detection(),
+}
+
+
+class MetricContext:
+    """
+    Evaluation context for one measurement.
+
+    Each metric in METRIC_GRAPH is computed at most once and shared with every
+    metric that depends on it. Self time (excluding dependencies) of every
+    computed metric is recorded in `timings`, in seconds.
+    """
+
+    def __init__(self, user_info, graph=None):
+        self.user_info = user_info
+        self.graph = graph or METRIC_GRAPH
+        self.height = user_info['height']
+        self.weight = user_info['weight']
+        self.age = user_info['age']
+        self.activity_factor = user_info['activity_factor']
+        self.values = {}
+        self.timings = {}
+        self._dependency_time = 0.0
+
+    def get(self, name):
+        """Return metric `name`, computing it (and its dependencies) on first use"""
+        if name not in self.values:
+            outer_dependency_time = self._dependency_time
+            self._dependency_time = 0.0
+            start = time.perf_counter()
+            self.values[name] = self.graph[name](self)
+            elapsed = time.perf_counter() - start
+            self.timings[name] = elapsed - self._dependency_time
+            self._dependency_time = outer_dependency_time + elapsed
+        return self.values[name]
+
+
+def _collect_timings(context, timings):
+    if timings is not None:
+        timings.update(context.timings)
+    logger.debug("Metric timings (ms): %s",
+                 {name: round(seconds * 1000, 3) for name, seconds in context.timings.items()})
+
+
+def _instant_metrics(context):
+    bmr, tdee = context.get('bmr_tdee')
     return {
-        'gender': predicted_gender,
-        'weight': user_info['weight'],
-        'age': user_info['age'],
-        'bmi': bmi,
+        'gender': context.get('gender'),
+        'weight': context.weight,
+        'age': context.age,
+        'bmi': context.get('bmi'),
         'bmr': bmr,
         'tdee': tdee,
-        'lbm': lbm,
-        'fp': fp,
-        'wp': wp,
-        'bm': bm,
-        'ms': ms,
-        'pp': pp,
-        'vf': vf,
-        'iw': iw,
-        'ols': round(ols['session_duration'], 1)
+        'lbm': context.get('lbm'),
+        'fp': context.get('fp'),
+        'wp': context.get('wp'),
+        'bm': context.get('bm'),
+        'ms': context.get('ms'),
+        'pp': context.get('pp'),
+        'vf': context.get('vf'),
+        'iw': context.get('iw'),
     }
 
 
+def calculate_instant_metrics(user_info, timings=None):
+    """
+    Tính các chỉ số tức thời (mọi chỉ số trừ bài thăng bằng một chân, cần camera).
+
+    Nếu truyền vào dictionary `timings`, thời gian tính (giây) của từng chỉ số
+    sẽ được ghi vào đó.
+    """
+    context = MetricContext(user_info)
+    result = _instant_metrics(context)
+    _collect_timings(context, timings)
+    return result
+
+
+def measure_one_leg_balance():
+    """Đo thời gian thăng bằng trên 1 chân (giây), làm tròn như trong calculate_body_metrics"""
+    return round(ot.one_leg_balance_detection()['session_duration'], 1)
+
+
+def calculate_body_metrics(user_info, timings=None):
+    """
+    Tính toàn bộ chỉ số cơ thể cho một lần đo.
+
+    Nếu truyền vào dictionary `timings`, thời gian tính (giây) của từng chỉ số
+    sẽ được ghi vào đó.
+    """
+    context = MetricContext(user_info)
+    # Trả về tất cả các kết quả dưới dạng dictionary
+    result = _instant_metrics(context)
+    # Đo thời gian thăng bằng trên 1 chân
+    result['ols'] = round(context.get('ols')['session_duration'], 1)
+    _collect_timings(context, timings)
+    return result
+
+
 def weight_dont_duplicate(user_info, weight):
     return weight != user_info['weight']
 
@@ -1,6 +1,8 @@
 from math import floor
 from datetime import datetime
 
+import numpy as np
+
 # Tính tuổi dựa trên ngày sinh
 def calculate_age(dob_str):
     dob = datetime.strptime(dob_str, "%d/%m/%Y")
@@ -69,7 +71,7 @@ def get_lbm(height, weight, gender):
         return round(lbm, 2)
 
 
-def get_fat_percentage(gender, age, weight, height):
+def get_fat_percentage(gender, age, weight, height, lbm=None):
     # Set a constant to remove from lbm
     if gender == 'female' and age <= 49:
         const = 9.25
@@ -79,7 +81,8 @@ def get_fat_percentage(gender, age, weight, height):
         const = 0.8
 
     # Calculate body fat percentage
-    lbm = get_lbm(height, weight, gender)
+    if lbm is None:
+        lbm = get_lbm(height, weight, gender)
 
     if gender == 'male' and weight < 61:
         coefficient = 0.98
@@ -105,8 +108,10 @@ def get_fat_percentage(gender, age, weight, height):
     return check_val_overflow(fat_percentage, 5, 75)
 
 
-def get_water_percentage(gender, age, weight, height):
-    water_percentage = (100 - get_fat_percentage(gender, age, weight, height)) * 0.7
+def get_water_percentage(gender, age, weight, height, fat_percentage=None):
+    if fat_percentage is None:
+        fat_percentage = get_fat_percentage(gender, age, weight, height)
+    water_percentage = (100 - fat_percentage) * 0.7
 
     if water_percentage <= 50:
         coefficient = 1.02
@@ -123,13 +128,14 @@ def get_water_percentage(gender, age, weight, height):
     return check_val_overflow(water_percentage, 35, 75)
 
 
-def get_bone_mass(height, weight, gender):
+def get_bone_mass(height, weight, gender, lbm=None):
     if gender == 'female':
         base = 0.245691014
     else:
         base = 0.18016894
 
-    lbm = get_lbm(height, weight, gender)
+    if lbm is None:
+        lbm = get_lbm(height, weight, gender)
     bone_mass = (base - (lbm * 0.05158)) * -1
 
     if bone_mass > 2.2:
@@ -148,10 +154,12 @@ def get_bone_mass(height, weight, gender):
     return check_val_overflow(bone_mass, 0.5, 8)
 
 
-def get_muscle_mass(gender, age, weight, height):
-    muscle_mass = weight - ((get_fat_percentage(gender, age, weight, height) * 0.01) * weight) - get_bone_mass(height,
-                                                                                                               weight,
-                                                                                                               gender)
+def get_muscle_mass(gender, age, weight, height, fat_percentage=None, bone_mass=None):
+    if fat_percentage is None:
+        fat_percentage = get_fat_percentage(gender, age, weight, height)
+    if bone_mass is None:
+        bone_mass = get_bone_mass(height, weight, gender)
+    muscle_mass = weight - ((fat_percentage * 0.01) * weight) - bone_mass
 
     # Capping muscle mass
     if gender == 'female' and muscle_mass >= 84:
@@ -164,15 +172,26 @@ def get_muscle_mass(gender, age, weight, height):
     return check_val_overflow(muscle_mass, 10, 120)
 
 
-def get_protein_percentage(gender, age, weight, height, orig=True):
+def get_protein_percentage(gender, age, weight, height, orig=True, fat_percentage=None, water_percentage=None,
+                           bone_mass=None, muscle_mass=None):
+    # Các chỉ số trung gian đã tính sẵn (nếu có) được dùng lại thay vì tính lại
+    if fat_percentage is None and (water_percentage is None or not orig):
+        fat_percentage = get_fat_percentage(gender, age, weight, height)
+    if water_percentage is None:
+        water_percentage = get_water_percentage(gender, age, weight, height, fat_percentage)
+
     # Use original algorithm from mi fit (or legacy guess one)
     if orig:
-        protein_percentage = (get_muscle_mass(gender, age, weight, height) / weight) * 100
-        protein_percentage -= get_water_percentage(gender, age, weight, height)
+        if muscle_mass is None:
+            muscle_mass = get_muscle_mass(gender, age, weight, height, fat_percentage, bone_mass)
+        protein_percentage = (muscle_mass / weight) * 100
+        protein_percentage -= water_percentage
     else:
-        protein_percentage = 100 - (floor(get_fat_percentage(gender, age, weight, height) * 100) / 100)
-        protein_percentage -= floor(get_water_percentage(gender, age, weight, height) * 100) / 100
-        protein_percentage -= floor((get_bone_mass(height, weight, gender) / weight * 100) * 100) / 100
+        if bone_mass is None:
+            bone_mass = get_bone_mass(height, weight, gender)
+        protein_percentage = 100 - (floor(fat_percentage * 100) / 100)
+        protein_percentage -= floor(water_percentage * 100) / 100
+        protein_percentage -= floor((bone_mass / weight * 100) * 100) / 100
 
     protein_percentage = round(protein_percentage, 2)
 
@@ -203,3 +222,137 @@ def get_ideal_weight(gender, height, orig=True):
         ideal_weight = (22 * height) * height / 10000
         ideal_weight = round(ideal_weight, 2)
         return check_val_overflow(ideal_weight, 5.5, 198)
+
+
+
+# ==============================================================================
+# BATCH (VECTORIZED) API
+# ==============================================================================
+
+def _round_batch(values, ndigits=2):
+    """
+    Làm tròn giống hệt hàm round() của Python cho cả mảng.
+
+    np.round nhân với 10**ndigits rồi làm tròn nên có thể lệch 0.01 ở các giá trị
+    nằm sát điểm giữa; những phần tử đó được làm tròn lại bằng round() gốc.
+    """
+    values = np.asarray(values, dtype = np.float64)
+    rounded = np.round(values, ndigits)
+    scaled = values * 10 ** ndigits
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if np.any(near_half):
+        rounded[near_half] = [round(float(v), ndigits) for v in values[near_half]]
+    return rounded
+
+
+def get_body_metrics_batch(gender, age, height, weight, activity_factor=None, orig=True):
+    """
+    Tính toàn bộ chỉ số cơ thể cho nhiều phép đo trong một lần gọi.
+
+    Kết quả giống hệt khi gọi từng hàm get_* ở trên cho từng dòng, nhưng các nhánh
+    if/else được thay bằng np.where và check_val_overflow được thay bằng np.clip.
+
+    Args:
+        gender: Mảng giới tính ('male' / 'female')
+        age: Mảng tuổi
+        height: Mảng chiều cao (cm)
+        weight: Mảng cân nặng (kg)
+        activity_factor: Mảng hệ số hoạt động (tùy chọn, cần để tính BMR/TDEE)
+        orig: Dùng thuật toán gốc của Mi Fit (giống tham số orig của các hàm get_*)
+
+    Returns:
+        Dictionary tên chỉ số -> mảng numpy, cùng khóa với calculate_body_metrics
+        ('bmi', 'lbm', 'fp', 'wp', 'bm', 'ms', 'pp', 'vf', 'iw' và 'bmr', 'tdee'
+        nếu có activity_factor)
+    """
+    gender = np.asarray(gender)
+    age = np.asarray(age, dtype = np.float64)
+    height = np.asarray(height, dtype = np.float64)
+    weight = np.asarray(weight, dtype = np.float64)
+    gender, age, height, weight = np.broadcast_arrays(gender, age, height, weight)
+
+    male = gender == 'male'
+    female = gender == 'female'
+
+    metrics = {}
+
+    # BMI
+    metrics['bmi'] = _round_batch(weight / ((height / 100) ** 2))
+
+    # BMR và TDEE
+    if activity_factor is not None:
+        bmr = np.where(male,
+                       88.362 + (13.397 * weight) + (4.799 * height) - (5.677 * age),
+                       447.593 + (9.247 * weight) + (3.098 * height) - (4.330 * age))
+        tdee = bmr * np.asarray(activity_factor, dtype = np.float64)
+        metrics['bmr'] = _round_batch(bmr)
+        metrics['tdee'] = _round_batch(tdee)
+
+    # LBM
+    lbm = _round_batch(np.where(male,
+                                (0.32810 * weight) + (0.33929 * height) - 29.5336,
+                                (0.29569 * weight) + (0.41813 * height) - 43.2933))
+    metrics['lbm'] = lbm
+
+    # Fat percentage
+    const = np.where(female, np.where(age <= 49, 9.25, 7.25), 0.8)
+    female_coefficient = np.where(height > 160, 1.03, 1.0)
+    coefficient = np.select(
+        [male & (weight < 61), female & (weight > 60), female & (weight < 50)],
+        [0.98, 0.96 * female_coefficient, 1.02 * female_coefficient],
+        default = 1.0)
+    fp = (1.0 - (((lbm - const) * coefficient) / weight)) * 100
+    fp = np.where(fp > 63, 75, fp)
+    fp = np.clip(fp, 5, 75)
+    metrics['fp'] = fp
+
+    # Water percentage
+    wp = (100 - fp) * 0.7
+    coefficient = np.where(wp <= 50, 1.02, 0.98)
+    wp = np.where(wp * coefficient >= 65, 75, wp)
+    wp = np.clip(_round_batch(wp * coefficient), 35, 75)
+    metrics['wp'] = wp
+
+    # Bone mass
+    base = np.where(female, 0.245691014, 0.18016894)
+    bm = (base - (lbm * 0.05158)) * -1
+    bm = np.where(bm > 2.2, bm + 0.1, bm - 0.1)
+    bm = np.where((female & (bm > 5.1)) | (male & (bm > 5.2)), 8, bm)
+    bm = np.clip(_round_batch(bm), 0.5, 8)
+    metrics['bm'] = bm
+
+    # Muscle mass
+    ms = weight - ((fp * 0.01) * weight) - bm
+    ms = np.where((female & (ms >= 84)) | (male & (ms >= 93.5)), 120, ms)
+    ms = np.clip(_round_batch(ms), 10, 120)
+    metrics['ms'] = ms
+
+    # Protein percentage
+    if orig:
+        pp = (ms / weight) * 100
+        pp -= wp
+    else:
+        pp = 100 - (np.floor(fp * 100) / 100)
+        pp -= np.floor(wp * 100) / 100
+        pp -= np.floor((bm / weight * 100) * 100) / 100
+    metrics['pp'] = np.clip(_round_batch(pp), 5, 32)
+
+    # Visceral fat
+    sub_calc = np.where(height < weight * 1.6,
+                        ((height * 0.4) - (height * (height * 0.0826))) * -1,
+                        0.765 + height * -0.0015)
+    vf = np.where(height < weight * 1.6,
+                  ((weight * 305) / (sub_calc + 48)) - 2.9 + (age * 0.15),
+                  (((height * 0.143) - (weight * sub_calc)) * -1) + (age * 0.15) - 5.0)
+    metrics['vf'] = np.clip(_round_batch(vf), 1, 50)
+
+    # Ideal weight
+    holtek = np.clip(_round_batch((22 * height) * height / 10000), 5.5, 198)
+    if orig:
+        metrics['iw'] = np.select([female, male],
+                                  [_round_batch((height - 70) * 0.6), _round_batch((height - 80) * 0.7)],
+                                  default = holtek)
+    else:
+        metrics['iw'] = holtek
+
+    return metrics
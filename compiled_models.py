@@ -0,0 +1,159 @@
+"""
+NumPy-only inference for the models in pkl/.
+
+export_models.py flattens the fitted scikit-learn estimators into .npz files
+(coefficients for linear models, support vectors for SVMs, node arrays for
+decision trees). This module evaluates those files without importing
+scikit-learn, pandas or joblib.
+"""
+import abc
+import hashlib
+from pathlib import Path
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+# Number of rows evaluated at once by kernel models (bounds kernel matrix memory)
+KERNEL_CHUNK_SIZE = 2048
+
+
+def compiled_path_for(model_path):
+    """Path of the compiled file that belongs to a .pkl model"""
+    return Path(model_path).with_suffix('.npz')
+
+
+def file_sha256(path):
+    """SHA-256 of a file, used to tie a compiled model to its source pickle"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CompiledModel(abc.ABC):
+    """Base class for compiled models; `predict` takes a 2-D array in feature order"""
+
+    kind = None
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.feature_names = list(arrays['feature_names']) if 'feature_names' in arrays else None
+        self.source_sha256 = str(arrays['source_sha256']) if 'source_sha256' in arrays else None
+
+    @abc.abstractmethod
+    def predict(self, features):
+        raise NotImplementedError
+
+    @staticmethod
+    def _as_matrix(features):
+        features = np.asarray(features, dtype = np.float64)
+        return features.reshape(1, -1) if features.ndim == 1 else features
+
+
+class CompiledLinearModel(CompiledModel):
+    """Linear regression: X @ coef + intercept"""
+
+    kind = 'linear'
+
+    def __init__(self, arrays):
+        super().__init__(arrays)
+        self.coef = arrays['coef']
+        self.intercept = arrays['intercept']
+
+    def predict(self, features):
+        return self._as_matrix(features) @ self.coef + self.intercept
+
+
+class CompiledSVC(CompiledModel):
+    """Binary support vector classifier: sign of the kernel decision function"""
+
+    kind = 'svc'
+
+    def __init__(self, arrays):
+        super().__init__(arrays)
+        self.kernel = str(arrays['kernel'])
+        self.support_vectors = arrays['support_vectors']
+        self.dual_coef = arrays['dual_coef']
+        self.intercept = float(arrays['intercept'])
+        self.gamma = float(arrays['gamma'])
+        self.coef0 = float(arrays['coef0'])
+        self.degree = int(arrays['degree'])
+        self.classes = arrays['classes']
+        self._sv_sq_norms = np.einsum('ij,ij->i', self.support_vectors, self.support_vectors)
+
+    def _kernel(self, features):
+        dot = features @ self.support_vectors.T
+        if self.kernel == 'linear':
+            return dot
+        if self.kernel == 'poly':
+            return (self.gamma * dot + self.coef0) ** self.degree
+        if self.kernel == 'sigmoid':
+            return np.tanh(self.gamma * dot + self.coef0)
+        # rbf
+        sq_dist = np.einsum('ij,ij->i', features, features)[:, None] + self._sv_sq_norms[None, :] - 2 * dot
+        return np.exp(-self.gamma * np.maximum(sq_dist, 0))
+
+    def decision_function(self, features):
+        features = self._as_matrix(features)
+        result = np.empty(len(features))
+        for start in range(0, len(features), KERNEL_CHUNK_SIZE):
+            chunk = features[start:start + KERNEL_CHUNK_SIZE]
+            result[start:start + len(chunk)] = self._kernel(chunk) @ self.dual_coef + self.intercept
+        return result
+
+    def predict(self, features):
+        return self.classes[(self.decision_function(features) > 0).astype(np.intp)]
+
+
+class CompiledTree(CompiledModel):
+    """Decision tree (regressor or classifier) stored as flattened node arrays"""
+
+    kind = 'tree'
+
+    def __init__(self, arrays):
+        super().__init__(arrays)
+        self.children_left = arrays['children_left']
+        self.children_right = arrays['children_right']
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.value = arrays['value']
+        self.classes = arrays['classes'] if 'classes' in arrays else None
+
+    def apply(self, features):
+        """Index of the leaf reached by every row"""
+        features = self._as_matrix(features)
+        rows = np.arange(len(features))
+        nodes = np.zeros(len(features), dtype = np.intp)
+        active = self.children_left[nodes] != -1
+        while np.any(active):
+            current = nodes[active]
+            go_left = features[rows[active], self.feature[current]] <= self.threshold[current]
+            nodes[active] = np.where(go_left, self.children_left[current], self.children_right[current])
+            active = self.children_left[nodes] != -1
+        return nodes
+
+    def predict(self, features):
+        leaf_values = self.value[self.apply(features)]
+        if self.classes is not None:
+            return self.classes[np.argmax(leaf_values, axis = 1)]
+        return leaf_values[:, 0]
+
+
+MODEL_TYPES = {model_type.kind: model_type for model_type in (CompiledLinearModel, CompiledSVC, CompiledTree)}
+
+
+def load_model(path):
+    """Load a compiled model written by export_models.py"""
+    with np.load(path, allow_pickle = False) as data:
+        arrays = {name: data[name] for name in data.files}
+
+    version = int(arrays.get('format_version', -1))
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported compiled model format {version} in {path}")
+
+    kind = str(arrays['kind'])
+    if kind not in MODEL_TYPES:
+        raise ValueError(f"Unknown compiled model kind '{kind}' in {path}")
+    return MODEL_TYPES[kind](arrays)
@@ -0,0 +1,303 @@
+"""
+Incremental, compressed backups of the CSV history.
+
+The CSV is append-only apart from amend_row, which rewrites rows in its last
+64 KB. A backup therefore stores the bytes added since the previous backup
+plus that window (OVERLAP_BYTES) as a compressed segment, and a
+restore replays the segments of a chain in order, each one written at its
+start offset. A chain starts with a full segment; a new chain is started
+every `full_interval_days`, or whenever the bytes before the next segment
+no longer match what was backed up (file repaired, restored or rewritten).
+
+Every segment is a restore point. After each backup the retention policy
+keeps the latest point of each of the last `keep_daily` days and
+`keep_weekly` ISO weeks, plus the current chain, and deletes the segments
+nothing depends on any more.
+
+Files (in BACKUP_CONFIG['backup_dir']):
+    manifest.json                 segments in order, with offsets and checksums
+    seg-000042-incr.csv.gz        compressed bytes [start, end) of the CSV
+
+Usage:
+    python csv_backups.py backup
+    python csv_backups.py list
+    python csv_backups.py restore [--point 42] --output restored.csv
+    python csv_backups.py prune
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+BACKUP_CONFIG = {
+    'backup_dir': 'user_data/backups',
+    'compression': 'gzip',  # 'gzip' or 'zstd' (requires the zstandard package)
+    'compression_level': 6,
+    'full_interval_days': 7,
+    'keep_daily': 7,
+    'keep_weekly': 4,
+    'chunk_bytes': 1 << 20,
+}
+
+# Must cover the region CSVDataManager.amend_row may rewrite
+OVERLAP_BYTES = 65536
+FINGERPRINT_BYTES = 4096
+
+MANIFEST_FILE = 'manifest.json'
+EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+def _open_compressed(path: Path, mode: str, compression: str, level: int = 6):
+    if compression == 'gzip':
+        return gzip.open(path, mode, compresslevel = level) if 'w' in mode else gzip.open(path, mode)
+    if compression == 'zstd':
+        import zstandard
+
+        if 'w' in mode:
+            return zstandard.ZstdCompressor(level = level).stream_writer(open(path, 'wb'), closefd = True)
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd = True)
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def _fingerprint(path: Path, offset: int) -> str:
+    """Hash of the bytes just before `offset`"""
+    start = max(0, offset - FINGERPRINT_BYTES)
+    with open(path, 'rb') as file:
+        file.seek(start)
+        return hashlib.sha256(file.read(offset - start)).hexdigest()
+
+
+class BackupStore:
+    """
+    Segment store for one CSV file
+
+    Args:
+        source: CSV file to back up
+        config: BACKUP_CONFIG overrides
+    """
+
+    def __init__(self, source, config: Dict[str, Any] = None):
+        self.source = Path(source)
+        self.config = {**BACKUP_CONFIG, **(config or {})}
+        self.backup_dir = Path(self.config['backup_dir'])
+        self.manifest_path = self.backup_dir / MANIFEST_FILE
+
+    def load_manifest(self) -> Dict[str, Any]:
+        if self.manifest_path.exists():
+            with open(self.manifest_path, 'r', encoding = 'utf-8') as file:
+                return json.load(file)
+        return {'source': str(self.source), 'next_seq': 1, 'segments': []}
+
+    def _save_manifest(self, manifest: Dict[str, Any]) -> None:
+        temp = self.backup_dir / f'.{MANIFEST_FILE}.tmp'
+        with open(temp, 'w', encoding = 'utf-8') as file:
+            json.dump(manifest, file, indent = 2)
+        os.replace(temp, self.manifest_path)
+
+    def _needs_full(self, last: Optional[Dict[str, Any]], size: int) -> bool:
+        if last is None:
+            return True
+        chain_start = datetime.fromisoformat(last['chain_created'])
+        if datetime.now() - chain_start >= timedelta(days = self.config['full_interval_days']):
+            return True
+        # The next segment starts OVERLAP_BYTES before the end of the last one;
+        # everything before that must still be what was backed up
+        return size < last['end'] or _fingerprint(self.source, last['next_start']) != last['next_start_fingerprint']
+
+    def backup(self) -> Optional[Dict[str, Any]]:
+        """
+        Write a segment with the bytes changed since the last backup
+
+        Returns:
+            The new manifest entry, or None if there was nothing to back up
+        """
+        if not self.source.exists():
+            return None
+        self.backup_dir.mkdir(parents = True, exist_ok = True)
+        manifest = self.load_manifest()
+        segments = manifest['segments']
+        last = segments[-1] if segments else None
+
+        size = self.source.stat().st_size
+        full = self._needs_full(last, size)
+        if not full and size == last['end'] and _fingerprint(self.source, size) == last['end_fingerprint']:
+            return None
+
+        start = 0 if full else last['next_start']
+        seq = manifest['next_seq']
+        kind = 'full' if full else 'incr'
+        name = f'seg-{seq:06d}-{kind}.csv{EXTENSIONS[self.config["compression"]]}'
+        temp = self.backup_dir / f'.{name}.tmp'
+
+        digest = hashlib.sha256()
+        end = start
+        with open(self.source, 'rb') as src, _open_compressed(temp, 'wb', self.config['compression'],
+                                                              self.config['compression_level']) as dst:
+            src.seek(start)
+            # Đọc theo từng khối để không phải nạp cả file vào bộ nhớ
+            while end < size:
+                chunk = src.read(min(self.config['chunk_bytes'], size - end))
+                if not chunk:
+                    break
+                dst.write(chunk)
+                digest.update(chunk)
+                end += len(chunk)
+        os.replace(temp, self.backup_dir / name)
+
+        now = datetime.now().isoformat(timespec = 'seconds')
+        next_start = max(0, end - OVERLAP_BYTES)
+        entry = {
+            'seq': seq,
+            'file': name,
+            'kind': kind,
+            'start': start,
+            'end': end,
+            'sha256': digest.hexdigest(),
+            'compressed_bytes': (self.backup_dir / name).stat().st_size,
+            'created': now,
+            'chain': seq if full else last['chain'],
+            'chain_created': now if full else last['chain_created'],
+            'compression': self.config['compression'],
+            'end_fingerprint': _fingerprint(self.source, end),
+            'next_start': next_start,
+            'next_start_fingerprint': _fingerprint(self.source, next_start),
+        }
+        segments.append(entry)
+        manifest['next_seq'] = seq + 1
+        self._save_manifest(manifest)
+        logger.info(f"Backup segment {name}: bytes {start}-{end} ({entry['compressed_bytes']} bytes compressed)")
+
+        self.prune()
+        return entry
+
+    def _chain(self, manifest: Dict[str, Any], point: Optional[int]) -> List[Dict[str, Any]]:
+        segments = manifest['segments']
+        if not segments:
+            raise LookupError("No backups to restore")
+        target = segments[-1] if point is None else next((s for s in segments if s['seq'] == point), None)
+        if target is None:
+            raise LookupError(f"No restore point {point}")
+        return [s for s in segments if s['chain'] == target['chain'] and s['seq'] <= target['seq']]
+
+    def restore(self, output, point: Optional[int] = None) -> Path:
+        """
+        Rebuild the CSV as it was at a restore point (default: the latest)
+
+        The result is written to a temp file, checked against the segment
+        checksums and then moved to `output` with os.replace.
+        """
+        output = Path(output)
+        chain = self._chain(self.load_manifest(), point)
+        output.parent.mkdir(parents = True, exist_ok = True)
+        temp = output.with_name(f'.{output.name}.restore.tmp')
+        try:
+            with open(temp, 'w+b') as dst:
+                for segment in chain:
+                    dst.seek(segment['start'])
+                    dst.truncate()
+                    digest = hashlib.sha256()
+                    with _open_compressed(self.backup_dir / segment['file'], 'rb', segment['compression']) as src:
+                        while True:
+                            chunk = src.read(self.config['chunk_bytes'])
+                            if not chunk:
+                                break
+                            dst.write(chunk)
+                            digest.update(chunk)
+                    if digest.hexdigest() != segment['sha256'] or dst.tell() != segment['end']:
+                        raise ValueError(f"Backup segment {segment['file']} is corrupted")
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(temp, output)
+        finally:
+            if temp.exists():
+                temp.unlink()
+        logger.info(f"Restored restore point {chain[-1]['seq']} ({chain[-1]['created']}) to {output}")
+        return output
+
+    def prune(self) -> List[str]:
+        """
+        Apply the retention policy
+
+        Returns:
+            Names of the deleted segment files
+        """
+        manifest = self.load_manifest()
+        segments = manifest['segments']
+        if not segments:
+            return []
+
+        keep_points = set()
+        for period, count in ((lambda s: s['created'][:10], self.config['keep_daily']),
+                              (lambda s: '%d-W%02d' % datetime.fromisoformat(s['created']).isocalendar()[:2],
+                               self.config['keep_weekly'])):
+            latest_per_period = {}
+            for segment in segments:
+                latest_per_period[period(segment)] = segment['seq']
+            keep_points.update(sorted(latest_per_period.values())[-count:] if count else [])
+
+        # A restore point needs every earlier segment of its chain; the current chain is always kept
+        current_chain = segments[-1]['chain']
+        needed_until = {}
+        for segment in segments:
+            if segment['seq'] in keep_points or segment['chain'] == current_chain:
+                needed_until[segment['chain']] = segment['seq']
+
+        kept, deleted = [], []
+        for segment in segments:
+            if segment['seq'] <= needed_until.get(segment['chain'], 0):
+                kept.append(segment)
+            else:
+                deleted.append(segment['file'])
+
+        if deleted:
+            manifest['segments'] = kept
+            self._save_manifest(manifest)
+            for name in deleted:
+                (self.backup_dir / name).unlink(missing_ok = True)
+            logger.info(f"Retention removed {len(deleted)} backup segments")
+        return deleted
+
+    def restore_points(self) -> List[Dict[str, Any]]:
+        return [{key: segment[key] for key in ('seq', 'kind', 'created', 'end', 'compressed_bytes')}
+                for segment in self.load_manifest()['segments']]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from csv_update import CSV_CONFIG
+
+    parser = argparse.ArgumentParser(description = "Incremental compressed backups of the CSV history")
+    parser.add_argument('command', choices = ['backup', 'list', 'restore', 'prune'])
+    parser.add_argument('--source', default = CSV_CONFIG['file_path'])
+    parser.add_argument('--backup-dir', default = BACKUP_CONFIG['backup_dir'])
+    parser.add_argument('--point', type = int, help = "Restore point (segment number), default latest")
+    parser.add_argument('--output', help = "File to restore into")
+    args = parser.parse_args(argv)
+
+    store = BackupStore(args.source, {'backup_dir': args.backup_dir})
+    if args.command == 'backup':
+        entry = store.backup()
+        print(f"Wrote {entry['file']}" if entry else "Nothing to back up")
+    elif args.command == 'list':
+        for point in store.restore_points():
+            print(f"{point['seq']:6d}  {point['kind']}  {point['created']}  {point['end']:>12d} bytes  "
+                  f"{point['compressed_bytes']:>10d} compressed")
+    elif args.command == 'restore':
+        if not args.output:
+            parser.error("restore requires --output")
+        store.restore(args.output, args.point)
+    else:
+        print(f"Removed {len(store.prune())} segments")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level = logging.INFO, format = '%(levelname)s: %(message)s')
+    sys.exit(main())
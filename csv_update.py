@@ -1,11 +1,19 @@
 import csv
+import io
 import os
+import shutil
 from datetime import datetime
 import pandas as pd
-from typing import Dict, Any, Optional, List, Tuple
+from typing import Dict, Any, Optional, List, Tuple, Callable, Iterator, Union
 import logging
 from pathlib import Path
 
+from csv_backups import BackupStore
+from file_lock import FileLock
+from history_index import get_history_index
+from stats_sidecar import StatisticsSidecar, get_sidecar
+from storage_backends import create_backend
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -13,7 +21,14 @@ logger = logging.getLogger(__name__)
 CSV_CONFIG = {
     'file_path': 'user_data/user_data.csv',
     'encoding': 'utf-8-sig',  # Better for Vietnamese text
-    'date_format': "%d/%m/%Y %H:%M"
+    'date_format': "%d/%m/%Y %H:%M",
+    'backend': 'csv',  # 'csv' or 'sqlite' (see storage_backends)
+    'database_path': 'user_data/user_data.db',
+    'backup_dir': 'user_data/backups',
+    'write_behind': False,  # Queue update_csv() rows for a background batch writer (see buffered_writer)
+    'sharded_writes': False,  # Append update_csv() rows to a per-process shard (see sharded_writes)
+    'shard_dir': 'user_data/shards',
+    'lock_timeout': 10.0  # Seconds to wait for the CSV file lock
 }
 
 # Define CSV headers and their corresponding data mapping
@@ -45,6 +60,62 @@ CSV_HEADERS = {
     'oneleg_standing': 'ols'
 }
 
+# Column dtypes of typed reads (read_csv_data(typed = True)): repeated text
+# as categoricals, measurements as float32, datetime parsed with date_format
+CATEGORICAL_COLUMNS = ('name', 'gender', 'dob', 'cccd_id', 'address')
+CSV_SCHEMA = {
+    header: 'datetime64[ns]' if header == 'datetime' else 'category' if header in CATEGORICAL_COLUMNS else 'float32'
+    for header in CSV_HEADERS
+}
+
+
+def apply_csv_schema(df: pd.DataFrame, date_format: str = CSV_CONFIG['date_format']) -> pd.DataFrame:
+    """
+    Convert the columns of a history DataFrame to CSV_SCHEMA
+
+    Values that do not parse (bad numbers or datetimes) become NaN/NaT.
+    """
+    for column in df.columns:
+        dtype = CSV_SCHEMA.get(column)
+        if dtype is None or str(df[column].dtype) == dtype:
+            continue
+        if column == 'datetime':
+            df[column] = pd.to_datetime(df[column], format = date_format, errors = 'coerce')
+        elif dtype == 'category':
+            df[column] = df[column].astype('category')
+        else:
+            if not pd.api.types.is_numeric_dtype(df[column]):
+                df[column] = pd.to_numeric(df[column], errors = 'coerce')
+            df[column] = df[column].astype('float32')
+    return df
+
+
+def memory_footprint(df: pd.DataFrame) -> int:
+    """Bytes used by a DataFrame, including the Python strings of object columns"""
+    return int(df.memory_usage(deep = True).sum())
+
+
+class CSVRepairResult:
+    """Outcome of CSVDataManager.repair_csv_file; the data itself stays on disk"""
+
+    def __init__(self, file_path: Path, encoding: str, columns: List[str]):
+        self.file_path = file_path
+        self.encoding = encoding
+        self.columns = columns
+        self.repaired = False
+        self.header_replaced = False
+        self.rows_recovered = 0
+        self.corrupted_count = 0
+        self.corrupted_lines: List[int] = []  # First line numbers only, see max_reported
+        self.backup_path: Optional[Path] = None
+
+    def chunks(self, chunksize: int = 50000, **read_csv_kwargs) -> Iterator[pd.DataFrame]:
+        """Read the (repaired) file lazily, `chunksize` rows at a time, with the expected column names"""
+        if not self.rows_recovered:
+            return iter(())
+        return iter(pd.read_csv(self.file_path, encoding = self.encoding, chunksize = chunksize,
+                                header = 0, names = self.columns, **read_csv_kwargs))
+
 
 class CSVDataManager:
     """Enhanced CSV data management class with better error handling and validation"""
@@ -54,6 +125,7 @@ class CSVDataManager:
         self.config = config or CSV_CONFIG
         self.headers = CSV_HEADERS
         self.file_path = Path(self.config['file_path'])
+        self.backend = create_backend({**CSV_CONFIG, **self.config}, list(self.headers.keys()))
 
     def get_safe_value(self, data: Dict[str, Any], key: str, default: Any = '') -> Any:
         """
@@ -95,8 +167,8 @@ class CSVDataManager:
 
         for header, data_key in self.headers.items():
             if header == 'datetime':
-                # Auto-generate datetime
-                row_data.append(self.format_datetime())
+                # Use the measurement time if provided, otherwise auto-generate datetime
+                row_data.append(combined_data.get('datetime') or self.format_datetime())
             elif data_key is None:
                 # Skip fields with no mapping
                 row_data.append('')
@@ -202,23 +274,24 @@ class CSVDataManager:
 
     def backup_csv_file(self) -> Optional[Path]:
         """
-        Create a backup of the CSV file
+        Create an incremental, compressed backup of the CSV file
+
+        Only the bytes written since the previous backup are stored (see
+        csv_backups); old backups are removed by the retention policy.
 
         Returns:
-            Path to backup file or None if backup failed
+            Path to the new backup segment, or None if nothing changed or backup failed
         """
         if not self.file_path.exists():
             return None
 
         try:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            backup_path = self.file_path.with_suffix(f'.backup_{timestamp}.csv')
-
-            # Copy file with proper encoding
-            with open(self.file_path, 'r', encoding = self.config['encoding']) as src:
-                with open(backup_path, 'w', encoding = self.config['encoding'], newline = '') as dst:
-                    dst.write(src.read())
-
+            store = BackupStore(self.file_path, {'backup_dir': self.config.get('backup_dir',
+                                                                              self.file_path.parent / 'backups')})
+            entry = store.backup()
+            if entry is None:
+                return None
+            backup_path = store.backup_dir / entry['file']
             logger.info(f"Backup created: {backup_path}")
             return backup_path
 
@@ -226,6 +299,15 @@ class CSVDataManager:
             logger.error(f"Failed to create backup: {e}")
             return None
 
+    def latest_backup(self) -> Optional[Path]:
+        """Newest backup segment, if it covers the current file"""
+        store = BackupStore(self.file_path, {'backup_dir': self.config.get('backup_dir',
+                                                                          self.file_path.parent / 'backups')})
+        segments = store.load_manifest()['segments']
+        if segments and segments[-1]['end'] == self.file_path.stat().st_size:
+            return store.backup_dir / segments[-1]['file']
+        return None
+
     def file_exists_and_has_content(self) -> bool:
         """Check if CSV file exists and has content"""
         return self.file_path.exists() and self.file_path.stat().st_size > 0
@@ -261,18 +343,23 @@ class CSVDataManager:
                 if backup_path:
                     messages.append(f"Backup created: {backup_path.name}")
 
-            # Check if file exists and has headers
-            file_needs_headers = not self.file_exists_and_has_content()
+            if self.backend is not None:
+                self.backend.append_row(self.prepare_csv_row(user_info, measurements))
+                logger.info(f"Data successfully written to {self.config['backend']} storage")
+                messages.append(f"Data successfully saved to {self.config['backend']} storage")
+                print('✓ Đã cập nhật dữ liệu thành công!')
+                return True, messages
 
             # Prepare row data
             row_data = self.prepare_csv_row(user_info, measurements)
 
-            # Write to CSV
-            with open(self.file_path, mode = 'a', newline = '', encoding = self.config['encoding']) as file:
+            # Write to CSV, holding the file lock so rows of other processes do not interleave
+            with FileLock(self.file_path, self.config.get('lock_timeout', 10.0)), \
+                    open(self.file_path, mode = 'a', newline = '', encoding = self.config['encoding']) as file:
                 writer = csv.writer(file)
 
                 # Write headers if file is new or empty
-                if file_needs_headers:
+                if file.tell() == 0:
                     headers = list(self.headers.keys())
                     writer.writerow(headers)
                     logger.info("CSV headers written")
@@ -281,6 +368,7 @@ class CSVDataManager:
                 # Write data row
                 writer.writerow(row_data)
 
+            # Không cập nhật sidecar ở đây: get_statistics tự đọc nốt các hàng mới khi được gọi
             logger.info(f"Data successfully written to {self.file_path}")
             messages.append(f"Data successfully saved to {self.file_path.name}")
             print('✓ Đã cập nhật vào file CSV thành công!')
@@ -292,24 +380,150 @@ class CSVDataManager:
             print(f'✗ Lỗi khi cập nhật CSV: {e}')
             return False, [error_msg]
 
-    def read_csv_data(self, fix_corrupted: bool = True) -> pd.DataFrame:
+    def amend_row(self, row_datetime: str, name: str, updates: Dict[str, Any],
+                  search_bytes: int = 65536) -> bool:
+        """
+        Update fields of a recently written row in place
+
+        Only the tail of the file (the last `search_bytes` bytes) is read and
+        rewritten, so the cost does not grow with the history size. The most
+        recent row matching both datetime and name is amended.
+
+        Args:
+            row_datetime: Value of the row's datetime column
+            name: Value of the row's name column
+            updates: Dictionary of CSV header -> new value
+            search_bytes: How far back from the end of the file to look
+
+        Returns:
+            True if a matching row was found and updated
+        """
+        if self.backend is not None:
+            try:
+                amended = self.backend.amend_row(row_datetime, name, updates)
+            except Exception as e:
+                logger.error(f"Error amending row: {e}")
+                return False
+            if amended:
+                logger.info(f"Amended row {row_datetime} for {name}: {updates}")
+            else:
+                logger.warning(f"Row {row_datetime} for {name} not found")
+            return amended
+
+        if not self.file_exists_and_has_content():
+            return False
+
+        headers = list(self.headers.keys())
+        unknown = set(updates) - set(headers)
+        if unknown:
+            logger.error(f"Cannot amend unknown columns: {sorted(unknown)}")
+            return False
+
+        # Work on raw bytes; a BOM at the start of the file is kept as part of the first line
+        encoding = 'utf-8' if self.config['encoding'] == 'utf-8-sig' else self.config['encoding']
+
+        try:
+            with FileLock(self.file_path, self.config.get('lock_timeout', 10.0)), open(self.file_path, 'r+b') as file:
+                file_size = file.seek(0, os.SEEK_END)
+                start = max(0, file_size - search_bytes)
+                file.seek(start)
+                tail = file.read()
+
+                # Start at a line boundary so only whole rows are parsed
+                if start > 0:
+                    first_newline = tail.find(b'\n')
+                    if first_newline < 0:
+                        return False
+                    start += first_newline + 1
+                    tail = tail[first_newline + 1:]
+
+                lines = tail.decode(encoding).split('\n')
+                lines = [line + '\n' for line in lines[:-1]] + ([lines[-1]] if lines[-1] else [])
+                for index in range(len(lines) - 1, -1, -1):
+                    row = next(csv.reader([lines[index]]), [])
+                    if len(row) != len(headers) or row[0] != row_datetime or row[1] != name:
+                        continue
+
+                    for header, value in updates.items():
+                        if isinstance(value, float):
+                            value = round(value, 2)
+                        row[headers.index(header)] = '' if value is None else str(value)
+
+                    buffer = io.StringIO()
+                    csv.writer(buffer).writerow(row)
+                    lines[index] = buffer.getvalue()
+
+                    offset = start + len(''.join(lines[:index]).encode(encoding))
+                    file.seek(offset)
+                    file.write(''.join(lines[index:]).encode(encoding))
+                    file.truncate()
+                    file.flush()
+                    # Only the amended columns changed, the aggregates stay valid
+                    try:
+                        self.statistics_sidecar().rebase(file_size)
+                    except Exception as e:
+                        # Hàng đã được sửa; sidecar sẽ được dựng lại ở lần get_statistics sau
+                        logger.warning(f"Could not update the statistics sidecar: {e}")
+
+                    logger.info(f"Amended row {row_datetime} for {name}: {updates}")
+                    return True
+
+        except Exception as e:
+            logger.error(f"Error amending CSV row: {e}")
+            return False
+
+        logger.warning(f"Row {row_datetime} for {name} not found in the last {search_bytes} bytes")
+        return False
+
+    def read_csv_data(self, fix_corrupted: bool = True, typed: bool = False,
+                      usecols: Optional[List[str]] = None,
+                      chunksize: Optional[int] = None) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
         """
         Read CSV data as pandas DataFrame with error handling
 
         Args:
             fix_corrupted: Whether to attempt fixing corrupted CSV
+            typed: Apply CSV_SCHEMA (float32 measurements, categorical text,
+                parsed datetime); uses a fraction of the memory of an untyped read
+            usecols: Only read these columns
+            chunksize: Return an iterator of DataFrames with this many rows each.
+                Categories may differ between chunks; corrupted files are not
+                repaired while iterating (run fix_csv_file first)
 
         Returns:
-            pandas DataFrame with CSV data
+            pandas DataFrame with CSV data, or an iterator of DataFrames when chunksize is given
         """
+        if usecols is not None:
+            unknown = set(usecols) - set(self.headers)
+            if unknown:
+                raise ValueError(f"Unknown columns: {sorted(unknown)}")
+            usecols = [header for header in self.headers if header in usecols]
+
+        if self.backend is not None:
+            try:
+                df = self.backend.read_all()
+            except Exception as e:
+                logger.error(f"Error reading {self.config['backend']} storage: {e}")
+                df = pd.DataFrame()
+            if usecols is not None and not df.empty:
+                df = df[usecols]
+            if typed:
+                df = apply_csv_schema(df, self.config['date_format'])
+            if chunksize:
+                return (df.iloc[start:start + chunksize] for start in range(0, len(df), chunksize))
+            return df
+
         if not self.file_path.exists():
             logger.warning(f"CSV file not found: {self.file_path}")
-            return pd.DataFrame()
+            return iter(()) if chunksize else pd.DataFrame()
 
         try:
             # First attempt: Normal read
-            df = pd.read_csv(self.file_path, encoding = self.config['encoding'])
-            logger.info(f"Successfully read {len(df)} records from {self.file_path}")
+            df = self._read_file(typed, usecols, chunksize)
+            if chunksize:
+                return df
+            logger.info(f"Successfully read {len(df)} records from {self.file_path} "
+                        f"({memory_footprint(df) / 1e6:.1f} MB in memory)")
             return df
 
         except pd.errors.ParserError as e:
@@ -317,96 +531,200 @@ class CSVDataManager:
 
             if fix_corrupted:
                 logger.info("Attempting to fix corrupted CSV...")
-                return self.fix_csv_file()
+                if not (typed or usecols or chunksize):
+                    return self.fix_csv_file()
+                self.fix_csv_file(streaming = True)
+                return self._read_file(typed, usecols, chunksize)
             else:
-                return pd.DataFrame()
+                return iter(()) if chunksize else pd.DataFrame()
 
         except Exception as e:
             logger.error(f"Error reading CSV: {e}")
-            return pd.DataFrame()
-
-    def fix_csv_file(self) -> pd.DataFrame:
+            return iter(()) if chunksize else pd.DataFrame()
+
+    def _read_file(self, typed: bool, usecols: Optional[List[str]], chunksize: Optional[int]):
+        """pd.read_csv of the CSV file; with typed, text columns are read straight into categoricals"""
+        dtype = None
+        if typed:
+            # Measurements are inferred by the C parser and narrowed afterwards, so a
+            # stray non-numeric value becomes NaN instead of failing the whole read
+            dtype = {header: 'category' for header in CATEGORICAL_COLUMNS}
+            dtype['datetime'] = str
+        reader = pd.read_csv(self.file_path, encoding = self.config['encoding'], usecols = usecols,
+                             dtype = dtype, chunksize = chunksize)
+        if not typed:
+            return reader
+        if chunksize:
+            return (apply_csv_schema(chunk, self.config['date_format']) for chunk in reader)
+        return apply_csv_schema(reader, self.config['date_format'])
+
+    def _iter_csv_rows(self, progress: Optional[Callable[[int, int], Any]] = None,
+                       progress_every: int = 10000) -> Iterator[Tuple[int, List[str]]]:
         """
-        Attempt to fix corrupted CSV file by reading line by line
+        Stream (line_number, row) pairs from the CSV file
 
-        Returns:
-            pandas DataFrame with recoverable data
+        Args:
+            progress: Optional callback receiving (bytes_read, total_bytes)
+            progress_every: Rows between progress callbacks
         """
-        logger.info(f"Attempting to fix corrupted CSV: {self.file_path}")
-
-        try:
-            # Get expected headers
-            expected_headers = list(self.headers.keys())
-            expected_cols = len(expected_headers)
+        total_bytes = self.file_path.stat().st_size
+        with open(self.file_path, 'rb') as raw:
+            text = io.TextIOWrapper(raw, encoding = self.config['encoding'], newline = '')
+            for line_num, row in enumerate(csv.reader(text), 1):
+                if progress is not None and line_num % progress_every == 0:
+                    progress(raw.tell(), total_bytes)
+                yield line_num, row
+        if progress is not None:
+            progress(total_bytes, total_bytes)
+
+    def repair_csv_file(self, progress: Optional[Callable[[int, int], Any]] = None,
+                        max_reported: int = 1000) -> 'CSVRepairResult':
+        """
+        Repair the CSV file in a single streaming pass with bounded memory
 
-            fixed_rows = []
-            corrupted_lines = []
+        Rows with too many fields are truncated, rows with too few are padded
+        and empty rows are dropped. Nothing is written while the file is
+        clean; from the first bad row on, the repaired rows go to a temp file
+        next to the original, which then replaces it atomically (os.replace).
+        The original stays restorable from the incremental backups (see
+        backup_csv_file).
 
-            with open(self.file_path, 'r', encoding = self.config['encoding']) as file:
-                reader = csv.reader(file)
+        The scan and the replace run under the file lock, so rows appended or
+        merged by other writers meanwhile are not lost by the replace.
 
-                for line_num, row in enumerate(reader, 1):
-                    if line_num == 1:
-                        # Header row
-                        if len(row) == expected_cols:
-                            headers = row
-                        else:
-                            logger.warning(f"Header mismatch. Expected {expected_cols}, got {len(row)}")
-                            headers = expected_headers
-                        continue
+        Args:
+            progress: Optional callback receiving (bytes_read, total_bytes)
+            max_reported: Maximum number of corrupted line numbers to keep
 
-                    # Data rows
-                    if len(row) == expected_cols:
-                        fixed_rows.append(row)
-                    elif len(row) > expected_cols:
-                        # Too many columns - truncate
-                        logger.warning(f"Line {line_num}: Too many fields ({len(row)}), truncating to {expected_cols}")
-                        fixed_rows.append(row[:expected_cols])
-                        corrupted_lines.append(line_num)
-                    elif len(row) < expected_cols and len(row) > 0:
-                        # Too few columns - pad with empty strings
-                        logger.warning(f"Line {line_num}: Too few fields ({len(row)}), padding to {expected_cols}")
-                        padded_row = row + [''] * (expected_cols - len(row))
-                        fixed_rows.append(padded_row)
-                        corrupted_lines.append(line_num)
+        Returns:
+            CSVRepairResult; iterate its chunks() to read the repaired data
+        """
+        with FileLock(self.file_path, self.config.get('lock_timeout', 10.0)):
+            return self._repair_csv_file(progress, max_reported)
+
+    def _repair_csv_file(self, progress: Optional[Callable[[int, int], Any]],
+                         max_reported: int) -> 'CSVRepairResult':
+        expected_headers = list(self.headers.keys())
+        expected_cols = len(expected_headers)
+        result = CSVRepairResult(self.file_path, self.config['encoding'], expected_headers)
+
+        temp_path = self.file_path.with_name(f'.{self.file_path.name}.repair.tmp')
+        temp_file = None
+        writer = None
+        try:
+            for line_num, row in self._iter_csv_rows(progress):
+                if line_num == 1:
+                    if len(row) != expected_cols:
+                        logger.warning(f"Header mismatch. Expected {expected_cols}, got {len(row)}")
+                        result.header_replaced = True
+                    elif row != expected_headers:
+                        result.header_replaced = True
+                    continue
+
+                fixed = row
+                if len(row) > expected_cols:
+                    logger.warning(f"Line {line_num}: Too many fields ({len(row)}), truncating to {expected_cols}")
+                    fixed = row[:expected_cols]
+                elif 0 < len(row) < expected_cols:
+                    logger.warning(f"Line {line_num}: Too few fields ({len(row)}), padding to {expected_cols}")
+                    fixed = row + [''] * (expected_cols - len(row))
+                elif not row:
                     # Skip completely empty rows
-
-            if corrupted_lines:
-                logger.info(f"Fixed {len(corrupted_lines)} corrupted lines: {corrupted_lines}")
-
-                # Create backup of original corrupted file
+                    continue
+
+                if fixed is not row:
+                    result.corrupted_count += 1
+                    if len(result.corrupted_lines) < max_reported:
+                        result.corrupted_lines.append(line_num)
+                    if writer is None:
+                        # Dòng hỏng đầu tiên: chép lại các dòng hợp lệ phía trước vào file tạm
+                        temp_file = open(temp_path, 'w', newline = '', encoding = self.config['encoding'])
+                        writer = csv.writer(temp_file)
+                        writer.writerow(expected_headers)
+                        for previous_num, previous in self._iter_csv_rows():
+                            if previous_num >= line_num:
+                                break
+                            if previous_num > 1 and previous:
+                                writer.writerow(previous)
+
+                if writer is not None:
+                    writer.writerow(fixed)
+                result.rows_recovered += 1
+
+            if writer is None:
+                logger.info(f"No corrupted lines in {self.file_path}")
+                return result
+
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+            temp_file.close()
+            temp_file = None
+
+            # The corrupted original stays restorable from the incremental backups
+            backup_path = self.backup_csv_file() or self.latest_backup()
+            if backup_path is None:
                 backup_path = self.file_path.with_suffix(
                     f'.corrupted_backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv')
-                self.file_path.rename(backup_path)
-                logger.info(f"Original corrupted file backed up to: {backup_path}")
+                shutil.copy2(self.file_path, backup_path)
+            os.replace(temp_path, self.file_path)
 
-                # Write fixed data back to original file
-                with open(self.file_path, 'w', newline = '', encoding = self.config['encoding']) as file:
-                    writer = csv.writer(file)
-                    writer.writerow(expected_headers)
-                    writer.writerows(fixed_rows)
+            result.repaired = True
+            result.backup_path = backup_path
+            logger.info(f"Fixed {result.corrupted_count} corrupted lines, {result.rows_recovered} records written; "
+                        f"original backed up to: {backup_path}")
+            return result
 
-                logger.info(f"Fixed CSV file written with {len(fixed_rows)} valid records")
+        finally:
+            if temp_file is not None:
+                temp_file.close()
+            if temp_path.exists():
+                temp_path.unlink()
 
-            # Create DataFrame from fixed data
-            if fixed_rows:
-                df = pd.DataFrame(fixed_rows, columns = expected_headers)
-                logger.info(f"Successfully recovered {len(df)} records")
-                return df
-            else:
-                logger.warning("No valid data found in CSV file")
-                return pd.DataFrame()
+    def fix_csv_file(self, streaming: bool = False,
+                     progress: Optional[Callable[[int, int], Any]] = None) -> Any:
+        """
+        Attempt to fix corrupted CSV file by reading line by line
+
+        Args:
+            streaming: Return a CSVRepairResult (read it with .chunks()) instead of
+                loading every recovered row into one DataFrame
+            progress: Optional callback receiving (bytes_read, total_bytes)
 
+        Returns:
+            pandas DataFrame with recoverable data (all values as strings),
+            or a CSVRepairResult when streaming
+        """
+        logger.info(f"Attempting to fix corrupted CSV: {self.file_path}")
+
+        try:
+            result = self.repair_csv_file(progress)
         except Exception as e:
             logger.error(f"Failed to fix CSV file: {e}")
+            if streaming:
+                return CSVRepairResult(self.file_path, self.config['encoding'], list(self.headers.keys()))
             return pd.DataFrame()
 
-    def validate_csv_structure(self) -> Dict[str, Any]:
+        if streaming:
+            return result
+        if not result.rows_recovered:
+            logger.warning("No valid data found in CSV file")
+            return pd.DataFrame()
+
+        df = pd.concat(result.chunks(dtype = str, keep_default_na = False), ignore_index = True)
+        logger.info(f"Successfully recovered {len(df)} records")
+        return df
+
+    def validate_csv_structure(self, progress: Optional[Callable[[int, int], Any]] = None,
+                               max_reported: int = 1000) -> Dict[str, Any]:
         """
-        Validate CSV file structure and report issues
+        Validate CSV file structure and report issues in a single streaming pass
+
+        Args:
+            progress: Optional callback receiving (bytes_read, total_bytes)
+            max_reported: Maximum number of corrupted lines listed in 'corrupted_lines'
 
         Returns:
-            Dictionary with validation results
+            Dictionary with validation results ('corrupted_count' has the full count)
         """
         result = {
             'is_valid': False,
@@ -414,6 +732,7 @@ class CSVDataManager:
             'total_lines': 0,
             'valid_lines': 0,
             'corrupted_lines': [],
+            'corrupted_count': 0,
             'missing_headers': [],
             'extra_headers': []
         }
@@ -426,34 +745,33 @@ class CSVDataManager:
             expected_headers = list(self.headers.keys())
             expected_cols = len(expected_headers)
 
-            with open(self.file_path, 'r', encoding = self.config['encoding']) as file:
-                reader = csv.reader(file)
-
-                for line_num, row in enumerate(reader, 1):
-                    result['total_lines'] += 1
-
-                    if line_num == 1:
-                        # Check headers
-                        if len(row) != expected_cols:
-                            result['header_mismatch'] = f"Expected {expected_cols} headers, got {len(row)}"
-
-                        missing = set(expected_headers) - set(row)
-                        extra = set(row) - set(expected_headers)
-                        result['missing_headers'] = list(missing)
-                        result['extra_headers'] = list(extra)
-                        continue
-
-                    # Check data rows
-                    if len(row) == expected_cols:
-                        result['valid_lines'] += 1
-                    else:
+            for line_num, row in self._iter_csv_rows(progress):
+                result['total_lines'] += 1
+
+                if line_num == 1:
+                    # Check headers
+                    if len(row) != expected_cols:
+                        result['header_mismatch'] = f"Expected {expected_cols} headers, got {len(row)}"
+
+                    missing = set(expected_headers) - set(row)
+                    extra = set(row) - set(expected_headers)
+                    result['missing_headers'] = list(missing)
+                    result['extra_headers'] = list(extra)
+                    continue
+
+                # Check data rows
+                if len(row) == expected_cols:
+                    result['valid_lines'] += 1
+                else:
+                    result['corrupted_count'] += 1
+                    if len(result['corrupted_lines']) < max_reported:
                         result['corrupted_lines'].append({
                             'line': line_num,
                             'expected': expected_cols,
                             'actual': len(row)
                         })
 
-            result['is_valid'] = (len(result['corrupted_lines']) == 0 and
+            result['is_valid'] = (result['corrupted_count'] == 0 and
                                   len(result['missing_headers']) == 0 and
                                   result['total_lines'] > 0)
 
@@ -473,71 +791,97 @@ class CSVDataManager:
         Returns:
             DataFrame with user's measurement history
         """
-        df = self.read_csv_data()
-
-        if df.empty:
-            return df
-
-        # Filter by user name (case-insensitive)
-        user_data = df[df['name'].str.lower() == name.lower()].copy()
-
-        if not user_data.empty:
-            # Sort by datetime (most recent first)
+        if self.backend is not None:
+            # Indexed lookup, rows come back sorted and limited
+            user_data = self.backend.user_history(name, limit)
             try:
                 user_data['datetime'] = pd.to_datetime(user_data['datetime'], format = self.config['date_format'])
-                user_data = user_data.sort_values('datetime', ascending = False)
             except Exception as e:
                 logger.warning(f"Could not parse datetime column: {e}")
+            logger.info(f"Retrieved {len(user_data)} records for user: {name}")
+            return user_data
 
-            if limit and limit > 0:
-                user_data = user_data.head(limit)
+        # The index only parses rows appended since the previous query
+        index = get_history_index(self.file_path, self.config['encoding'], self.config['date_format'])
+        try:
+            user_data = index.history(name = name, limit = limit)
+        except Exception as e:
+            logger.error(f"Error reading user history: {e}")
+            return pd.DataFrame()
 
         logger.info(f"Retrieved {len(user_data)} records for user: {name}")
         return user_data
 
-    def get_statistics(self) -> Dict[str, Any]:
-        """Get basic statistics about the CSV data"""
-        df = self.read_csv_data()
+    def get_statistics(self, include_users: bool = False) -> Dict[str, Any]:
+        """
+        Get basic statistics about the CSV data
 
-        if df.empty:
-            return {'total_records': 0, 'unique_users': 0, 'date_range': None}
+        The aggregates are maintained incrementally (see stats_sidecar): this
+        only parses the rows appended since the previous call, not the whole
+        history.
 
-        stats = {
-            'total_records': len(df),
-            'unique_users': df['name'].nunique() if 'name' in df.columns else 0,
-            'columns': list(df.columns),
-            'date_range': None
-        }
+        Args:
+            include_users: Add 'users': {name: {'count', 'last_seen'}}
+        """
+        if self.backend is not None:
+            return self.backend.statistics(include_users)
 
-        # Try to get date range
-        if 'datetime' in df.columns:
-            try:
-                df['parsed_datetime'] = pd.to_datetime(df['datetime'], format = self.config['date_format'])
-                stats['date_range'] = {
-                    'earliest': df['parsed_datetime'].min().strftime(self.config['date_format']),
-                    'latest': df['parsed_datetime'].max().strftime(self.config['date_format'])
-                }
-            except Exception as e:
-                logger.warning(f"Could not parse date range: {e}")
+        return self.statistics_sidecar().statistics(include_users)
 
-        return stats
+    def statistics_sidecar(self) -> StatisticsSidecar:
+        return get_sidecar(self.file_path, self.config['encoding'], self.config['date_format'])
 
 
 # Convenience functions for backward compatibility
 def update_csv(user_info: Dict[str, Any], measurements: Dict[str, Any], create_backup: bool = False) -> bool:
     """Convenience function for updating CSV - maintains backward compatibility"""
+    if CSV_CONFIG.get('sharded_writes') and not create_backup:
+        from sharded_writes import get_shared_shard_writer
+
+        success, messages = get_shared_shard_writer().submit(user_info, measurements)
+        if not success:
+            logger.error(f"Could not write row to shard: {messages}")
+        return success
+
+    if CSV_CONFIG.get('write_behind') and not create_backup:
+        from buffered_writer import get_shared_writer
+
+        success, messages = get_shared_writer().submit(user_info, measurements)
+        if not success:
+            logger.error(f"Could not queue row: {messages}")
+        return success
+
     manager = CSVDataManager()
     success, messages = manager.update_csv(user_info, measurements, create_backup)
     return success
 
 
-def read_csv_data(file_path: Optional[str] = None, fix_corrupted: bool = True) -> pd.DataFrame:
+def amend_csv_row(row_datetime: str, name: str, updates: Dict[str, Any]) -> bool:
+    """Convenience function for amending a recently written row"""
+    if CSV_CONFIG.get('write_behind'):
+        from buffered_writer import flush_shared_writer
+
+        # The row may still be waiting in the write-behind queue
+        flush_shared_writer()
+    if CSV_CONFIG.get('sharded_writes'):
+        from sharded_writes import merge_shards
+
+        # The row may still be in a shard
+        merge_shards(config = {'shard_dir': CSV_CONFIG['shard_dir']})
+
+    manager = CSVDataManager()
+    return manager.amend_row(row_datetime, name, updates)
+
+
+def read_csv_data(file_path: Optional[str] = None, fix_corrupted: bool = True, typed: bool = False,
+                  usecols: Optional[List[str]] = None,
+                  chunksize: Optional[int] = None) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
     """Convenience function for reading CSV - maintains backward compatibility"""
     config = CSV_CONFIG.copy()
     if file_path:
         config['file_path'] = file_path
     manager = CSVDataManager(config)
-    return manager.read_csv_data(fix_corrupted)
+    return manager.read_csv_data(fix_corrupted, typed, usecols, chunksize)
 
 
 def get_user_history(name: str, limit: Optional[int] = None) -> pd.DataFrame:
@@ -546,6 +890,31 @@ def get_user_history(name: str, limit: Optional[int] = None) -> pd.DataFrame:
     return manager.get_user_history(name, limit)
 
 
+def read_archive(columns: Optional[List[str]] = None, start: Any = None, end: Any = None,
+                 name: Optional[str] = None, cccd_id: Optional[str] = None,
+                 archive_dir: Optional[str] = None) -> pd.DataFrame:
+    """
+    Read the monthly Parquet archive written by parquet_archive (requires pyarrow)
+
+    Only the requested columns are read, and months/row groups outside
+    [start, end] are skipped.
+
+    Args:
+        columns: Columns to return (default: all CSV headers)
+        start: Earliest datetime (inclusive)
+        end: Latest datetime (inclusive)
+        name: User's name (case-insensitive)
+        cccd_id: CCCD number
+        archive_dir: Archive root directory (default: parquet_archive.ARCHIVE_CONFIG['archive_dir'])
+
+    Returns:
+        DataFrame sorted by datetime
+    """
+    import parquet_archive
+
+    return parquet_archive.read_archive(columns, start, end, name, cccd_id, archive_dir)
+
+
 # Example usage and testing
 if __name__ == "__main__":
     # Configure logging for testing
@@ -593,7 +962,7 @@ if __name__ == "__main__":
     print(f"   File exists: {validation['file_exists']}")
     print(f"   Total lines: {validation['total_lines']}")
     print(f"   Valid lines: {validation['valid_lines']}")
-    print(f"   Corrupted lines: {len(validation['corrupted_lines'])}")
+    print(f"   Corrupted lines: {validation['corrupted_count']}")
     print(f"   Is valid: {validation['is_valid']}")
 
     # Test 2: Update CSV
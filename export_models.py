@@ -0,0 +1,240 @@
+"""
+Export the fitted models in pkl/ to the NumPy-only format read by compiled_models.
+
+Usage:
+    python export_models.py               # export every model in MODELS
+    python export_models.py --check       # export, then compare against the original estimators
+    python export_models.py --benchmark   # export, then report import time and prediction latency
+"""
+import argparse
+import json
+import logging
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import ai_predict as ap
+import compiled_models as cmp
+
+logger = logging.getLogger(__name__)
+
+MODELS = [ap.GENDER_MODEL_PATH, ap.BODY_FAT_MODEL_PATH]
+
+# Input ranges used to generate equivalence-check samples, per feature
+CHECK_RANGES = {'age': (5, 100), 'gender': (0, 1), 'height_cm': (100, 220), 'weight_kg': (20, 200)}
+
+# Features of each kind of model, for estimators fitted without feature names (e.g. the gender SVC)
+MODEL_KIND_FEATURES = {
+    'gender': ('height_cm', 'weight_kg'),
+    'body_fat': ('age', 'gender', 'height_cm', 'weight_kg'),
+}
+
+
+def flatten_estimator(model):
+    """
+    Convert a fitted scikit-learn estimator into a dictionary of plain arrays
+
+    Raises:
+        TypeError: If the estimator type is not supported
+    """
+    name = type(model).__name__
+    arrays = {}
+
+    if hasattr(model, 'tree_'):
+        tree = model.tree_
+        arrays.update({
+            'kind': np.array('tree'),
+            'children_left': tree.children_left.astype(np.intp),
+            'children_right': tree.children_right.astype(np.intp),
+            'feature': np.maximum(tree.feature, 0).astype(np.intp),
+            'threshold': tree.threshold.astype(np.float64),
+            'value': tree.value[:, 0, :].astype(np.float64),
+        })
+        if hasattr(model, 'classes_'):
+            arrays['classes'] = np.asarray(model.classes_).astype(str)
+
+    elif name == 'SVC':
+        if len(model.classes_) != 2:
+            raise TypeError("Only binary SVC models can be exported")
+        arrays.update({
+            'kind': np.array('svc'),
+            'kernel': np.array(model.kernel),
+            'support_vectors': np.asarray(model.support_vectors_, dtype = np.float64),
+            'dual_coef': np.asarray(model.dual_coef_, dtype = np.float64)[0],
+            'intercept': np.asarray(model.intercept_[0], dtype = np.float64),
+            'gamma': np.asarray(model._gamma, dtype = np.float64),
+            'coef0': np.asarray(model.coef0, dtype = np.float64),
+            'degree': np.asarray(model.degree),
+            'classes': np.asarray(model.classes_).astype(str),
+        })
+
+    elif hasattr(model, 'coef_') and hasattr(model, 'intercept_') and not hasattr(model, 'classes_'):
+        arrays.update({
+            'kind': np.array('linear'),
+            'coef': np.asarray(model.coef_, dtype = np.float64).ravel(),
+            'intercept': np.asarray(model.intercept_, dtype = np.float64),
+        })
+
+    else:
+        raise TypeError(f"Unsupported estimator type: {name}")
+
+    if hasattr(model, 'feature_names_in_'):
+        arrays['feature_names'] = np.asarray(model.feature_names_in_).astype(str)
+    arrays['format_version'] = np.array(cmp.FORMAT_VERSION)
+    return arrays
+
+
+def export_model(model_path):
+    """Export one pickled model next to it as .npz and return the output path"""
+    from joblib import load
+
+    arrays = flatten_estimator(load(model_path))
+    arrays['source_sha256'] = np.array(cmp.file_sha256(model_path))
+
+    output_path = cmp.compiled_path_for(model_path)
+    np.savez(output_path, **arrays)
+    logger.info(f"Exported {model_path} -> {output_path}")
+    return output_path
+
+
+def model_features(model):
+    """
+    Feature names of a fitted estimator, in column order
+
+    Estimators fitted without feature names are matched to a MODEL_KIND_FEATURES
+    entry by their number of inputs.
+
+    Raises:
+        ValueError: If the features cannot be determined or have no CHECK_RANGES entry
+    """
+    if hasattr(model, 'feature_names_in_'):
+        names = [str(name) for name in model.feature_names_in_]
+    else:
+        count = getattr(model, 'n_features_in_', None)
+        kinds = [features for features in MODEL_KIND_FEATURES.values() if len(features) == count]
+        if len(kinds) != 1:
+            raise ValueError(f"Cannot tell the features of a {type(model).__name__} with {count} inputs")
+        names = list(kinds[0])
+
+    unknown = [name for name in names if name not in CHECK_RANGES]
+    if unknown:
+        raise ValueError(f"No check range for features {unknown}, add them to CHECK_RANGES")
+    return names
+
+
+def sample_inputs(feature_names, size, seed=0):
+    """Random inputs covering the plausible measurement range of every feature"""
+    rng = np.random.default_rng(seed)
+    columns = []
+    for low, high in (CHECK_RANGES[name] for name in feature_names):
+        if (low, high) == (0, 1):
+            columns.append(rng.integers(0, 2, size).astype(np.float64))
+        else:
+            columns.append(np.round(rng.uniform(low, high, size), 1))
+    return np.column_stack(columns)
+
+
+def _predict_original(model, features, feature_names):
+    if hasattr(model, 'feature_names_in_'):
+        import pandas as pd
+        features = pd.DataFrame(features, columns = feature_names)
+    return model.predict(features)
+
+
+def check_equivalence(model_path, size=100000, tolerance=1e-9):
+    """
+    Compare the compiled model with the original estimator on random inputs
+
+    Returns:
+        Dictionary with the number of samples, mismatches and max absolute error
+    """
+    from joblib import load
+
+    original = load(model_path)
+    compiled = cmp.load_model(cmp.compiled_path_for(model_path))
+    feature_names = model_features(original)
+    features = sample_inputs(feature_names, size)
+
+    expected = _predict_original(original, features, feature_names)
+    actual = compiled.predict(features)
+
+    result = {'model': model_path, 'samples': size}
+    if expected.dtype.kind in 'fc':
+        error = np.abs(expected - actual)
+        result['max_abs_error'] = float(error.max())
+        result['mismatches'] = int(np.count_nonzero(error > tolerance))
+        # Values are published rounded to 2 decimals, so compare those too
+        result['rounded_mismatches'] = int(np.count_nonzero(np.round(expected, 2) != np.round(actual, 2)))
+    else:
+        result['mismatches'] = int(np.count_nonzero(expected.astype(str) != actual))
+    return result
+
+
+def _import_time(statement):
+    """Wall time of `statement` in a fresh interpreter, in milliseconds"""
+    code = f"import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+    output = subprocess.run([sys.executable, '-c', code], capture_output = True, text = True, check = True)
+    return float(output.stdout.strip().splitlines()[-1]) * 1000
+
+
+def _latency(predict, features, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        predict(features)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def benchmark(model_path, repeat=200, batch_size=10000):
+    """Import time and single-row / batch latency (ms) of the original and compiled paths"""
+    from joblib import load
+
+    original = load(model_path)
+    compiled = cmp.load_model(cmp.compiled_path_for(model_path))
+    feature_names = model_features(original)
+    single = sample_inputs(feature_names, 1)
+    batch = sample_inputs(feature_names, batch_size)
+
+    return {
+        'model': model_path,
+        'original': {
+            'single_ms': _latency(lambda x: _predict_original(original, x, feature_names), single, repeat),
+            'batch_ms': _latency(lambda x: _predict_original(original, x, feature_names), batch, 3),
+        },
+        'compiled': {
+            'single_ms': _latency(compiled.predict, single, repeat),
+            'batch_ms': _latency(compiled.predict, batch, 3),
+        },
+        'batch_size': batch_size,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description = "Export pkl models to the NumPy-only compiled format")
+    parser.add_argument('models', nargs = '*', default = MODELS, help = "Model files to export")
+    parser.add_argument('--check', action = 'store_true', help = "Verify equivalence with the original estimators")
+    parser.add_argument('--benchmark', action = 'store_true', help = "Report import time and prediction latency")
+    args = parser.parse_args(argv)
+
+    report = {'exported': [str(export_model(path)) for path in args.models]}
+
+    if args.check:
+        report['check'] = [check_equivalence(path) for path in args.models]
+    if args.benchmark:
+        report['import_ms'] = {
+            'original': _import_time("import joblib, pandas, sklearn.svm, sklearn.linear_model"),
+            'compiled': _import_time("import compiled_models"),
+        }
+        report['benchmark'] = [benchmark(path) for path in args.models]
+
+    print(json.dumps(report, indent = 2))
+
+    failed = [result for result in report.get('check', [])
+              if result.get('rounded_mismatches', result['mismatches'])]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level = logging.INFO, format = '%(levelname)s: %(message)s')
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+Advisory inter-process file locks.
+
+FileLock locks a separate `<path>.lock` file (fcntl.flock on POSIX,
+msvcrt.locking on Windows), so the data file itself can still be renamed or
+replaced while the lock is held. Every open of the lock file is a separate
+lock owner: two threads of one process exclude each other as well.
+"""
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+
+class LockTimeout(TimeoutError):
+    pass
+
+
+class FileLock:
+    """
+    Exclusive lock guarding a file
+
+    Args:
+        path: File to guard; the lock itself is taken on `<path>.lock`
+        timeout: Seconds to wait for the lock (None waits forever, 0 tries once)
+        poll_interval: Seconds between attempts while waiting
+    """
+
+    def __init__(self, path, timeout: Optional[float] = 10.0, poll_interval: float = 0.01):
+        path = Path(path)
+        self.lock_path = path.with_name(f'{path.name}.lock')
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._fd = None
+
+    def _try_lock(self, fd: int) -> bool:
+        try:
+            if os.name == 'nt':
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self) -> 'FileLock':
+        self.lock_path.parent.mkdir(parents = True, exist_ok = True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while not self._try_lock(fd):
+            if deadline is not None and time.monotonic() >= deadline:
+                os.close(fd)
+                raise LockTimeout(f"Could not lock {self.lock_path} within {self.timeout}s")
+            time.sleep(self.poll_interval)
+        self._fd = fd
+        return self
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        try:
+            if os.name == 'nt':
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self) -> 'FileLock':
+        return self.acquire()
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
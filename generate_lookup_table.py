@@ -0,0 +1,215 @@
+"""
+Generate the body-metrics lookup table read by metrics_lookup.
+
+Evaluates the instant metrics of calculate_body_metrics (predicted gender,
+formulas and the body-fat model) over an age x height x weight grid, except
+the piecewise ones metrics_lookup computes live (LIVE_METRICS), writes
+them to a memory-mappable binary file and records the maximum error of the
+interpolated lookup against the live computation in the file header.
+
+Usage:
+    python generate_lookup_table.py [--output pkl/body_metrics.lut]
+                                    [--age 10 90] [--height 120 210] [--weight 30 180 0.1]
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import ai_predict as ap
+import calc_metrics as cm
+import metrics_lookup as ml
+
+logger = logging.getLogger(__name__)
+
+LOOKUP_CONFIG = {
+    # (start, stop, step), stop included
+    'age': (10, 90, 1),
+    'height': (120, 210, 1),
+    'weight': (30, 180, 0.1),
+    'error_samples': 20000,
+}
+
+# name -> (axes, dtype, fixed-point scale); 'hw' tables do not depend on age
+TABLES = {
+    'gender': ('hw', np.uint8, 1),
+    'bmi': ('hw', np.int16, 100),
+    'lbm': ('hw', np.int16, 100),
+    'bm': ('hw', np.int16, 100),
+    'iw': ('hw', np.int16, 100),
+    'bmr': ('ahw', np.float32, 1),
+    'fp': ('ahw', np.int16, 100),
+}
+
+# Every metric of the lookup result, including the ones computed live
+CHECKED_METRICS = [name for name in TABLES if name != 'gender'] + list(ml.LIVE_METRICS)
+
+
+def make_axis(start, stop, step):
+    size = int(round((stop - start) / step)) + 1
+    return {'start': float(start), 'step': float(step), 'size': size}
+
+
+def live_metrics(age, height, weight):
+    """
+    Instant metrics computed exactly like calculate_instant_metrics, for arrays
+
+    BMR is computed with an activity factor of 1, which makes TDEE equal to BMR.
+    """
+    gender = ap.predict_gender_many(height, weight)
+    metrics = cm.get_body_metrics_batch(gender, age, height, weight, np.ones_like(height))
+    metrics['fp'] = ap.predict_body_fat_many(age, gender, height, weight)
+    metrics['gender'] = (gender == 'male').astype(np.uint8)
+    return metrics
+
+
+def _encode(name, values):
+    _, dtype, scale = TABLES[name]
+    values = np.asarray(values, dtype = np.float64) * scale
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        if values.min() < info.min or values.max() > info.max:
+            raise ValueError(f"Values of '{name}' do not fit in {np.dtype(dtype).name} with scale {scale}")
+        values = np.round(values)
+    return values.astype(dtype)
+
+
+def build_layout(axes):
+    """Array descriptors (dtype, shape, offset, scale) for the given axes"""
+    layout = {}
+    offset = 0
+    for name, (table_axes, dtype, scale) in TABLES.items():
+        shape = [axes['height']['size'], axes['weight']['size']]
+        if table_axes == 'ahw':
+            shape.insert(0, axes['age']['size'])
+        layout[name] = {'dtype': np.dtype(dtype).str, 'shape': shape, 'offset': offset, 'scale': scale}
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        offset += -(-size // ml.ALIGNMENT) * ml.ALIGNMENT
+    return layout, offset
+
+
+def fill_tables(arrays, axes):
+    """Evaluate the live metrics over the whole grid into `arrays`"""
+    heights = ml.axis_values(axes['height'])
+    weights = ml.axis_values(axes['weight'])
+    height_grid, weight_grid = (grid.ravel() for grid in np.meshgrid(heights, weights, indexing = 'ij'))
+    shape = (axes['height']['size'], axes['weight']['size'])
+
+    for age_index, age in enumerate(ml.axis_values(axes['age'])):
+        metrics = live_metrics(np.full(height_grid.shape, age), height_grid, weight_grid)
+        for name, (table_axes, _, _) in TABLES.items():
+            values = _encode(name, metrics[name]).reshape(shape)
+            if table_axes == 'ahw':
+                arrays[name][age_index] = values
+            elif age_index == 0:
+                arrays[name][...] = values
+        logger.info(f"Age {age:g}: {age_index + 1}/{axes['age']['size']}")
+
+
+def measure_error(table, axes, samples, seed=0):
+    """
+    Compare table lookups with the live computation on random off-grid measurements
+
+    Returns:
+        Dictionary metric -> {'max', 'p99', 'max_same_gender'} plus 'gender_mismatch_rate'
+    """
+    rng = np.random.default_rng(seed)
+
+    def uniform(axis, decimals):
+        values = ml.axis_values(axes[axis])
+        return np.round(rng.uniform(values[0], values[-1], samples), decimals)
+
+    ages = rng.integers(int(axes['age']['start']), int(ml.axis_values(axes['age'])[-1]) + 1, samples)
+    heights = uniform('height', 1)
+    weights = uniform('weight', 2)
+
+    live = live_metrics(ages.astype(np.float64), heights, weights)
+    looked_up = [table.lookup(int(a), float(h), float(w), 1.0) for a, h, w in zip(ages, heights, weights)]
+
+    # Near the gender boundary the table may predict the other gender, which
+    # switches every gender-dependent formula; report those samples separately
+    predicted = np.array([ml.GENDERS.index(row['gender']) for row in looked_up])
+    same_gender = predicted == live['gender']
+
+    errors = {}
+    for name in CHECKED_METRICS:
+        error = np.abs(np.array([row[name] for row in looked_up]) - live[name])
+        errors[name] = {
+            'max': round(float(error.max()), 4),
+            'p99': round(float(np.percentile(error, 99)), 4),
+            'max_same_gender': round(float(error[same_gender].max()), 4) if same_gender.any() else None,
+        }
+    errors['tdee'] = errors['bmr']
+    errors['gender_mismatch_rate'] = round(float(np.mean(~same_gender)), 6)
+    errors['samples'] = samples
+    return errors
+
+
+def generate(output, age_range, height_range, weight_range, error_samples):
+    """Generate a lookup table file and return its header"""
+    start_time = time.perf_counter()
+    axes = {'age': make_axis(*age_range), 'height': make_axis(*height_range), 'weight': make_axis(*weight_range)}
+    layout, data_size = build_layout(axes)
+    header = {'format': 1, 'axes': axes, 'arrays': layout}
+
+    output = os.fspath(output)
+    output_dir = os.path.dirname(os.path.abspath(output))
+    with tempfile.NamedTemporaryFile(dir = output_dir, suffix = '.data', delete = False) as data_file:
+        data_path = data_file.name
+        data_file.truncate(data_size)
+
+    try:
+        arrays = {name: np.memmap(data_path, dtype = np.dtype(spec['dtype']), mode = 'r+',
+                                  offset = spec['offset'], shape = tuple(spec['shape']))
+                  for name, spec in layout.items()}
+        fill_tables(arrays, axes)
+        for array in arrays.values():
+            array.flush()
+
+        header['max_error'] = measure_error(ml.MetricsLookupTable(header, arrays), axes, error_samples)
+        del arrays
+
+        header_bytes = json.dumps(header).encode('utf-8')
+        prefix = ml.MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes
+        padding = b'\x00' * (-len(prefix) % ml.ALIGNMENT)
+
+        partial_path = output + '.partial'
+        with open(partial_path, 'wb') as dst, open(data_path, 'rb') as src:
+            dst.write(prefix + padding)
+            shutil.copyfileobj(src, dst, 1 << 20)
+        os.replace(partial_path, output)
+    finally:
+        os.unlink(data_path)
+
+    logger.info(f"Lookup table written to {output} ({os.path.getsize(output) / 1e6:.1f} MB) "
+                f"in {time.perf_counter() - start_time:.1f} s")
+    return header
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description = "Precompute body metrics over an age/height/weight grid")
+    parser.add_argument('--output', default = ml.LOOKUP_TABLE_PATH)
+    parser.add_argument('--age', type = float, nargs = 3, default = LOOKUP_CONFIG['age'],
+                        metavar = ('START', 'STOP', 'STEP'))
+    parser.add_argument('--height', type = float, nargs = 3, default = LOOKUP_CONFIG['height'],
+                        metavar = ('START', 'STOP', 'STEP'))
+    parser.add_argument('--weight', type = float, nargs = 3, default = LOOKUP_CONFIG['weight'],
+                        metavar = ('START', 'STOP', 'STEP'))
+    parser.add_argument('--error-samples', type = int, default = LOOKUP_CONFIG['error_samples'])
+    args = parser.parse_args(argv)
+
+    header = generate(args.output, args.age, args.height, args.weight, args.error_samples)
+    print(json.dumps({'axes': header['axes'], 'max_error': header['max_error']}, indent = 2))
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level = logging.INFO, format = '%(levelname)s: %(message)s')
+    sys.exit(main())
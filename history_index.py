@@ -0,0 +1,261 @@
+"""
+In-memory index of the CSV measurement history.
+
+UserHistoryIndex maps normalized names and CCCD numbers to the byte ranges
+of their rows in the CSV file. It remembers how far into the file it has
+read, so a query only parses the rows appended since the previous query and
+then reads the matching rows directly; the whole file is parsed once per
+process instead of on every get_user_history call.
+
+Rows near the end of the file can be rewritten in place (CSVDataManager.amend_row),
+so the index also keeps a fingerprint of the last bytes it consumed. When
+they changed, it re-reads from the start of that window; when the file was
+replaced or truncated, it rebuilds. Either way the rows read again get new
+row numbers, so `generation` is incremented: callers that remember row
+numbers (user_trends) must start over when it changes.
+"""
+import bisect
+import csv
+import hashlib
+import io
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Must cover the region CSVDataManager.amend_row may rewrite
+VERIFY_WINDOW_BYTES = 65536
+
+
+def normalize_name(name) -> str:
+    return str(name).lower()
+
+
+def normalize_cccd(cccd_id) -> str:
+    """CCCD numbers read back as numbers lose their leading zeros (and may gain '.0')"""
+    text = str(cccd_id).strip()
+    if text.endswith('.0'):
+        text = text[:-2]
+    return text.lstrip('0')
+
+
+class UserHistoryIndex:
+    """
+    Tail-following index of one CSV history file
+
+    Args:
+        file_path: CSV file written by CSVDataManager
+        encoding: Encoding of the file (a UTF-8 BOM is skipped)
+        date_format: strftime format of the datetime column
+    """
+
+    def __init__(self, file_path, encoding: str = 'utf-8-sig', date_format: str = "%d/%m/%Y %H:%M"):
+        self.file_path = Path(file_path)
+        self.encoding = 'utf-8' if encoding == 'utf-8-sig' else encoding
+        self.date_format = date_format
+        self._lock = threading.Lock()
+        self.generation = 0  # Incremented whenever row numbers may have been reassigned
+        self._reset()
+
+    def _reset(self):
+        self.generation += 1
+        self.header_line = None
+        self.header = []
+        self.offset = 0  # Bytes consumed (always at a line boundary)
+        self.row_starts = []  # Start offset of every indexed row
+        self.row_ends = []
+        self.by_name: Dict[str, List[int]] = {}
+        self.by_cccd: Dict[str, List[int]] = {}
+        self._file_id = None
+        self._fingerprint = None
+
+    def __len__(self):
+        return len(self.row_starts)
+
+    def _window_start(self) -> int:
+        """Start of the first indexed row within VERIFY_WINDOW_BYTES of the consumed offset"""
+        first = bisect.bisect_left(self.row_starts, self.offset - VERIFY_WINDOW_BYTES)
+        return self.row_starts[first] if first < len(self.row_starts) else self.offset
+
+    def _fingerprint_of(self, file, start: int, end: int) -> bytes:
+        file.seek(start)
+        return hashlib.blake2b(file.read(end - start), digest_size = 16).digest()
+
+    def _rewind(self, position: int):
+        """Forget the rows starting at or after `position` (a row boundary)"""
+        keep = bisect.bisect_left(self.row_starts, position)
+        for positions in (*self.by_name.values(), *self.by_cccd.values()):
+            while positions and positions[-1] >= keep:
+                positions.pop()
+        del self.row_starts[keep:]
+        del self.row_ends[keep:]
+        self.offset = position
+        self.generation += 1
+
+    def refresh(self) -> int:
+        """
+        Index the rows appended since the last call
+
+        Returns:
+            Number of rows added
+        """
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self) -> int:
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            self._reset()
+            return 0
+
+        file_id = (stat.st_dev, stat.st_ino)
+        if file_id != self._file_id or stat.st_size < self.offset:
+            if self._file_id is not None:
+                logger.info(f"{self.file_path} was replaced or truncated, rebuilding history index")
+            self._reset()
+            self._file_id = file_id
+
+        with open(self.file_path, 'rb') as file:
+            if self.offset > 0:
+                window_start = self._window_start()
+                if self._fingerprint_of(file, window_start, self.offset) != self._fingerprint:
+                    # Hàng cuối đã bị sửa tại chỗ (amend_row): đọc lại từ đầu cửa sổ
+                    logger.debug(f"Tail of {self.file_path} changed, re-reading from byte {window_start}")
+                    self._rewind(window_start)
+            if stat.st_size == self.offset:
+                return 0
+
+            file.seek(self.offset)
+            data = file.read(stat.st_size - self.offset)
+
+        # Only consume complete lines; a row being written is picked up next time
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            return 0
+
+        lines = data[:end].split(b'\n')[:-1]
+        position = self.offset
+        if self.header_line is None:
+            header = lines.pop(0)
+            position += len(header) + 1
+            self.header_line = header.decode(self.encoding).lstrip('\ufeff').rstrip('\r')
+            self.header = next(csv.reader([self.header_line]), [])
+        name_column = self.header.index('name') if 'name' in self.header else None
+        cccd_column = self.header.index('cccd_id') if 'cccd_id' in self.header else None
+
+        added = 0
+        consumed = 0
+        reader = csv.reader(line.decode(self.encoding) for line in lines)
+        for row in reader:
+            # A row spanning several lines (unbalanced quote) is corrupted; skip all of them
+            row_lines = lines[consumed:reader.line_num]
+            consumed = reader.line_num
+            line_start = position
+            position += sum(len(line) + 1 for line in row_lines)
+            if len(row_lines) != 1 or len(row) != len(self.header):
+                continue
+
+            row_number = len(self.row_starts)
+            self.row_starts.append(line_start)
+            self.row_ends.append(position)
+            if name_column is not None:
+                self.by_name.setdefault(normalize_name(row[name_column]), []).append(row_number)
+            cccd = normalize_cccd(row[cccd_column]) if cccd_column is not None else ''
+            if cccd:
+                self.by_cccd.setdefault(cccd, []).append(row_number)
+            added += 1
+        # Lines after an unterminated quote were read but not returned as a row
+        position += sum(len(line) + 1 for line in lines[consumed:])
+
+        self.offset = position
+        with open(self.file_path, 'rb') as file:
+            self._fingerprint = self._fingerprint_of(file, self._window_start(), self.offset)
+        return added
+
+    def _rows_frame(self, row_numbers: List[int]) -> pd.DataFrame:
+        """Read the given rows and parse them with pd.read_csv, as read_csv_data does"""
+        if self.header_line is None:
+            return pd.DataFrame()
+
+        lines = [self.header_line]
+        with open(self.file_path, 'rb') as file:
+            for row_number in row_numbers:
+                start = self.row_starts[row_number]
+                file.seek(start)
+                lines.append(file.read(self.row_ends[row_number] - start).decode(self.encoding).rstrip('\r\n'))
+        return pd.read_csv(io.StringIO('\n'.join(lines) + '\n'))
+
+    def history(self, name: Optional[str] = None, cccd_id: Optional[str] = None,
+                limit: Optional[int] = None) -> pd.DataFrame:
+        """
+        Measurement history of a user, most recent first
+
+        Args:
+            name: User's name (case-insensitive)
+            cccd_id: CCCD number (leading zeros optional)
+            limit: Maximum number of records to return (optional)
+
+        Returns:
+            DataFrame with the columns of the CSV file, datetime column parsed
+        """
+        with self._lock:
+            self._refresh()
+            if cccd_id is not None:
+                row_numbers = list(self.by_cccd.get(normalize_cccd(cccd_id), []))
+            else:
+                row_numbers = list(self.by_name.get(normalize_name(name), []))
+            frame = self._rows_frame(row_numbers)
+
+        if not frame.empty:
+            try:
+                frame['datetime'] = pd.to_datetime(frame['datetime'], format = self.date_format)
+                frame = frame.sort_values('datetime', ascending = False)
+            except Exception as e:
+                logger.warning(f"Could not parse datetime column: {e}")
+
+            if limit and limit > 0:
+                frame = frame.head(limit)
+        return frame
+
+    def rows_after(self, name: str, after_row: int = -1) -> Tuple[pd.DataFrame, int, int]:
+        """
+        Rows of a user appended after row number `after_row`, in file order
+
+        Row numbers are only comparable within one generation: when the
+        returned generation differs from the one `after_row` came from, call
+        again with after_row = -1.
+
+        Returns:
+            (DataFrame with the datetime column parsed, number of the user's last row or -1, generation)
+        """
+        with self._lock:
+            self._refresh()
+            row_numbers = self.by_name.get(normalize_name(name), [])
+            new_rows = row_numbers[bisect.bisect_right(row_numbers, after_row):]
+            last_row = row_numbers[-1] if row_numbers else -1
+            generation = self.generation
+            frame = self._rows_frame(new_rows) if new_rows else pd.DataFrame()
+
+        if not frame.empty:
+            frame['datetime'] = pd.to_datetime(frame['datetime'], format = self.date_format, errors = 'coerce')
+        return frame, last_row, generation
+
+
+_indexes: Dict[Tuple[str, str], UserHistoryIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_history_index(file_path, encoding: str = 'utf-8-sig', date_format: str = "%d/%m/%Y %H:%M") -> UserHistoryIndex:
+    """Process-wide index for a CSV file, created on first use"""
+    key = (str(Path(file_path).resolve()), encoding)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = UserHistoryIndex(file_path, encoding, date_format)
+        return index
@@ -4,6 +4,7 @@ class HealthDataManager:
         self.user_info = {}
         self.body_composition = {}
         self.measurements = {}
+        self.trends = {}
 
     # Hàm get user_info
     def get_user_info(self):
@@ -19,4 +20,12 @@ class HealthDataManager:
 
     # Hàm set body_composition
     def set_body_composition(self, new_body_composition):
-        self.body_composition = new_body_composition
\ No newline at end of file
+        self.body_composition = new_body_composition
+
+    # Hàm get trends
+    def get_trends(self):
+        return self.trends
+
+    # Hàm set trends
+    def set_trends(self, new_trends):
+        self.trends = new_trends
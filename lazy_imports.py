@@ -0,0 +1,202 @@
+"""
+Deferred imports and startup profiling.
+
+lazy_import() returns a stand-in that imports the real module on first
+attribute access, so heavy subsystems (OpenCV/MediaPipe, LangChain, bleak,
+pandas, ...) do not delay startup. warm_up() imports them in a background
+thread while the user is busy with the dialog.
+
+StartupProfiler records how long every module takes to import (self time,
+excluding the modules it imports itself) and how long named initialization
+steps take; main.py enables it with --profile-startup.
+"""
+import importlib
+import importlib.abc
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access"""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(self._load(), attribute, value)
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f"<lazy module '{self.__dict__['_name']}' ({state})>"
+
+
+def lazy_import(name):
+    """
+    Return a LazyModule for `name`
+
+    Always a stand-in, even when the module is already in sys.modules: it may
+    still be executing in warm_up()'s thread, and importlib.import_module on
+    first use waits for that import to finish instead of handing out a
+    partially initialized module.
+    """
+    return LazyModule(name)
+
+
+def warm_up(*names, on_done=None):
+    """
+    Import modules in a background daemon thread
+
+    Args:
+        names: Module names to import, in order
+        on_done: Optional callback receiving {name: error or None} when finished
+
+    Returns:
+        The started thread
+    """
+    def run():
+        results = {}
+        for name in names:
+            try:
+                importlib.import_module(name)
+                results[name] = None
+            except Exception as e:
+                results[name] = e
+        if on_done is not None:
+            on_done(results)
+
+    thread = threading.Thread(target = run, name = 'warm-up', daemon = True)
+    thread.start()
+    return thread
+
+
+class _TimingLoader(importlib.abc.Loader):
+    """Wraps a module loader to time module creation and execution"""
+
+    def __init__(self, loader, profiler, name):
+        self._loader = loader
+        self._profiler = profiler
+        self._name = name
+
+    def create_module(self, spec):
+        with self._profiler.timed_import(self._name):
+            return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        with self._profiler.timed_import(self._name):
+            self._loader.exec_module(module)
+
+    def __getattr__(self, attribute):
+        return getattr(self._loader, attribute)
+
+
+class _TimingFinder(importlib.abc.MetaPathFinder):
+    """Meta path finder that wraps the loader found by the remaining finders"""
+
+    def __init__(self, profiler):
+        self._profiler = profiler
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimingLoader(spec.loader, self._profiler, fullname)
+                return spec
+        return None
+
+
+class StartupProfiler:
+    """Collects per-module import times and per-step initialization times"""
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.import_self_time = defaultdict(float)
+        self.sections = []
+        self._finder = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self._finder is not None
+
+    def install(self):
+        """Start timing every import made from now on"""
+        if self._finder is None:
+            self.start_time = time.perf_counter()
+            self._finder = _TimingFinder(self)
+            sys.meta_path.insert(0, self._finder)
+
+    def uninstall(self):
+        if self._finder is not None:
+            sys.meta_path.remove(self._finder)
+            self._finder = None
+
+    @contextmanager
+    def timed_import(self, name):
+        # Mỗi luồng có stack riêng để trừ thời gian của các module con
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            total = time.perf_counter() - start
+            child_time = stack.pop()
+            if stack:
+                stack[-1] += total
+            with self._lock:
+                self.import_self_time[name] += total - child_time
+
+    @contextmanager
+    def section(self, name):
+        """Time an initialization step (no-op bookkeeping when the profiler is not installed)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.enabled:
+                with self._lock:
+                    self.sections.append((name, time.perf_counter() - start))
+
+    def report(self, title="Startup profile", top=25):
+        """Format the collected timings as text"""
+        with self._lock:
+            by_package = defaultdict(float)
+            for name, seconds in self.import_self_time.items():
+                by_package[name.split('.')[0]] += seconds
+            modules = sorted(by_package.items(), key = lambda item: item[1], reverse = True)
+            sections = list(self.sections)
+
+        lines = [f"=== {title}: {(time.perf_counter() - self.start_time) * 1000:.0f} ms since start ==="]
+        lines.append("Imports (self time, grouped by top-level package):")
+        for name, seconds in modules[:top]:
+            lines.append(f"  {seconds * 1000:9.1f} ms  {name}")
+        if len(modules) > top:
+            rest = sum(seconds for _, seconds in modules[top:])
+            lines.append(f"  {rest * 1000:9.1f} ms  ({len(modules) - top} other packages)")
+        lines.append(f"  {sum(by_package.values()) * 1000:9.1f} ms  total")
+        if sections:
+            lines.append("Initialization:")
+            for name, seconds in sections:
+                lines.append(f"  {seconds * 1000:9.1f} ms  {name}")
+        return '\n'.join(lines)
+
+
+profiler = StartupProfiler()
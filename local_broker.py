@@ -0,0 +1,244 @@
+"""
+In-process MQTT broker stand-in for tests and load runs.
+
+LocalBroker implements the part of MQTT 3.1.1 that the kiosk and gateway
+clients use (CONNECT, PUBLISH QoS 0/1, SUBSCRIBE with + and # wildcards,
+PINGREQ, DISCONNECT) on top of the async_mqtt packet helpers. It records
+every PUBLISH it receives and forwards it to matching subscribers, so a
+test can check what reached "the server" and push RPC requests back.
+Telemetry payloads are decoded with telemetry_codec.decode_payload, which
+understands JSON as well as the compact binary encoding.
+
+Usage:
+    python local_broker.py --port 1883
+"""
+import argparse
+import asyncio
+import logging
+import struct
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import telemetry_codec
+from async_mqtt import (CONNACK, CONNECT, DISCONNECT, PINGREQ, PINGRESP, PUBACK, PUBLISH, SUBACK, SUBSCRIBE,
+                        MQTTProtocolError, decode_publish, encode_mid, encode_packet, encode_publish, read_packet)
+
+logger = logging.getLogger(__name__)
+
+BROKER_CONFIG = {
+    'host': '127.0.0.1',
+    'port': 0,  # 0: pick a free port (see LocalBroker.port)
+    'ack_delay': 0.0,  # seconds before each PUBACK, to simulate a slow uplink
+    'keep_messages': True,  # Record every received PUBLISH in LocalBroker.messages
+}
+
+
+class ReceivedMessage:
+    __slots__ = ('client_id', 'topic', 'payload', 'qos', 'received')
+
+    def __init__(self, client_id: str, topic: str, payload: bytes, qos: int, received: float):
+        self.client_id = client_id
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.received = received  # time.monotonic()
+
+    def decode(self) -> Any:
+        """The payload as decoded by the server (JSON or a telemetry_codec schema)"""
+        return telemetry_codec.decode_payload(self.payload)
+
+
+def decode_connect(body: bytes) -> Tuple[str, Optional[str], int]:
+    """Returns (client id, user name, keepalive) of a CONNECT packet body"""
+    def string(position: int) -> Tuple[str, int]:
+        (length,) = struct.unpack_from('!H', body, position)
+        return body[position + 2:position + 2 + length].decode('utf-8'), position + 2 + length
+
+    protocol, position = string(0)
+    if protocol not in ('MQTT', 'MQIsdp'):
+        raise MQTTProtocolError(f"Unknown protocol name {protocol!r}")
+    flags = body[position + 1]
+    (keepalive,) = struct.unpack_from('!H', body, position + 2)
+    client_id, position = string(position + 4)
+    if flags & 0x04:  # will topic and message
+        _, position = string(position)
+        _, position = string(position)
+    username = string(position)[0] if flags & 0x80 else None
+    return client_id, username, keepalive
+
+
+def decode_subscribe(body: bytes) -> Tuple[int, List[Tuple[str, int]]]:
+    """Returns (message id, [(topic filter, qos), ...]) of a SUBSCRIBE packet body"""
+    (mid,) = struct.unpack_from('!H', body)
+    position = 2
+    topics = []
+    while position < len(body):
+        (length,) = struct.unpack_from('!H', body, position)
+        topic = body[position + 2:position + 2 + length].decode('utf-8')
+        position += 2 + length
+        topics.append((topic, body[position]))
+        position += 1
+    return mid, topics
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """MQTT topic filter matching with the + and # wildcards"""
+    parts = topic.split('/')
+    for i, level in enumerate(topic_filter.split('/')):
+        if level == '#':
+            return True
+        if i >= len(parts) or (level != '+' and level != parts[i]):
+            return False
+    return len(parts) == len(topic_filter.split('/'))
+
+
+class LocalBroker:
+    """
+    Minimal MQTT broker on the running event loop
+
+    Args:
+        config: BROKER_CONFIG overrides
+        on_publish: Called with every ReceivedMessage (on the broker's loop)
+    """
+
+    def __init__(self, config: Dict[str, Any] = None, on_publish: Optional[Callable[[ReceivedMessage], Any]] = None):
+        self.config = {**BROKER_CONFIG, **(config or {})}
+        self.on_publish = on_publish
+        self.messages: List[ReceivedMessage] = []
+        self.connections = 0  # CONNECTs accepted since start
+        self.published = 0  # PUBLISH packets received since start
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: Dict[asyncio.StreamWriter, str] = {}  # writer -> client id
+        self._subscriptions: Dict[asyncio.StreamWriter, List[str]] = {}
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    @property
+    def clients(self) -> List[str]:
+        return list(self._writers.values())
+
+    async def start(self) -> 'LocalBroker':
+        self._server = await asyncio.start_server(self._handle, self.config['host'], self.config['port'])
+        logger.info(f"Local MQTT broker listening on {self.config['host']}:{self.port}")
+        return self
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            self.disconnect_all()
+            await self._server.wait_closed()
+            self._server = None
+
+    def disconnect_all(self) -> int:
+        """Drop every client connection (as a network outage would); returns how many were dropped"""
+        writers = list(self._writers)
+        for writer in writers:
+            writer.close()
+        return len(writers)
+
+    async def outage(self, seconds: float) -> None:
+        """Drop every client and refuse connections for `seconds`, then listen on the same port again"""
+        port = self.port
+        await self.stop()
+        await asyncio.sleep(seconds)
+        self.config['port'] = port
+        await self.start()
+
+    def publish(self, topic: str, payload: bytes) -> int:
+        """Send a QoS 0 message to every matching subscriber; returns how many received it"""
+        packet = encode_publish(topic, payload)
+        receivers = 0
+        for writer, filters in list(self._subscriptions.items()):
+            if any(topic_matches(topic_filter, topic) for topic_filter in filters):
+                writer.write(packet)
+                receivers += 1
+        return receivers
+
+    def reset(self) -> None:
+        self.messages.clear()
+        self.published = 0
+
+    def stats(self) -> Dict[str, Any]:
+        topics = {}
+        for message in self.messages:
+            topics[message.topic] = topics.get(message.topic, 0) + 1
+        return {'clients': len(self._writers), 'connections': self.connections,
+                'published': self.published, 'topics': topics}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            packet_type, _, body = await read_packet(reader)
+            if packet_type != CONNECT:
+                raise MQTTProtocolError(f"Expected CONNECT, got packet type {packet_type}")
+            client_id, _, keepalive = decode_connect(body)
+            writer.write(encode_packet(CONNACK, 0, b'\x00\x00'))
+            self._writers[writer] = client_id
+            self._subscriptions[writer] = []
+            self.connections += 1
+            timeout = keepalive * 1.5 if keepalive else None
+
+            while True:
+                packet_type, flags, body = await asyncio.wait_for(read_packet(reader), timeout)
+                if packet_type == PUBLISH:
+                    await self._received(client_id, writer, flags, body)
+                elif packet_type == SUBSCRIBE:
+                    mid, topics = decode_subscribe(body)
+                    self._subscriptions[writer].extend(topic for topic, _ in topics)
+                    granted = bytes(min(qos, 1) for _, qos in topics)
+                    writer.write(encode_packet(SUBACK, 0, struct.pack('!H', mid) + granted))
+                elif packet_type == PINGREQ:
+                    writer.write(encode_packet(PINGRESP, 0, b''))
+                elif packet_type == DISCONNECT:
+                    break
+                await writer.drain()
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, MQTTProtocolError) as e:
+            logger.debug(f"MQTT client connection closed: {e}")
+        finally:
+            self._writers.pop(writer, None)
+            self._subscriptions.pop(writer, None)
+            writer.close()
+
+    async def _received(self, client_id: str, writer: asyncio.StreamWriter, flags: int, body: bytes) -> None:
+        topic, payload, qos, mid = decode_publish(flags, body)
+        message = ReceivedMessage(client_id, topic, payload, qos, time.monotonic())
+        self.published += 1
+        if self.config['keep_messages']:
+            self.messages.append(message)
+        if self.on_publish is not None:
+            self.on_publish(message)
+        self.publish(topic, payload)
+        if qos:
+            if self.config['ack_delay']:
+                await asyncio.sleep(self.config['ack_delay'])
+            writer.write(encode_mid(PUBACK, mid))
+
+
+async def serve(config: Dict[str, Any]) -> None:
+    def show(message: ReceivedMessage):
+        try:
+            print(f"[{message.client_id}] {message.topic}: {message.decode()}")
+        except ValueError as e:
+            print(f"[{message.client_id}] {message.topic}: undecodable payload ({e})")
+
+    broker = await LocalBroker({**config, 'keep_messages': False}, on_publish = show).start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await broker.stop()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description = "Local MQTT broker stand-in")
+    arg_parser.add_argument('--host', default = BROKER_CONFIG['host'])
+    arg_parser.add_argument('--port', type = int, default = 1883)
+    arg_parser.add_argument('--ack-delay', type = float, default = BROKER_CONFIG['ack_delay'],
+                            help = "Seconds before each PUBACK")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level = logging.INFO, format = "%(asctime)-15s %(name)-8s %(levelname)s: %(message)s")
+    try:
+        asyncio.run(serve({'host': args.host, 'port': args.port, 'ack_delay': args.ack_delay}))
+    except KeyboardInterrupt:
+        pass
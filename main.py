@@ -1,24 +1,31 @@
+import sys
+
+# The profiler must be installed before anything else is imported
+from lazy_imports import lazy_import, profiler, warm_up
+
+if '--profile-startup' in sys.argv:
+    profiler.install()
+
+import argparse
 import asyncio
 import logging
+import signal
 import threading
-import sys
-import tkinter as tk
-from tkinter import ttk, simpledialog, messagebox
 import random
 
-import calc_metrics as cm
-import csv_update as cu
-import pandas as pd
 import calc_body_composition as cbc
 import info_user as iu
-import ai_recommendations as ai_rcm
 import data_parser as parser
-import oneleg_standing_timer as ast
-from mqtt_client_handler import MQTTClient
-from ai_voice import read_recommend_vietnamese
-from bleak import BleakClient, BleakScanner
-from bleak.backends.characteristic import BleakGATTCharacteristic
-from qr_scaner import scan_cccd_qr
+from async_mqtt import AsyncMQTTClient
+from measurement_pipeline import MeasurementPipeline
+
+# Heavy subsystems are imported on first use (or warmed up in the background)
+cu = lazy_import('csv_update')
+ai_rcm = lazy_import('ai_recommendations')
+ai_voice = lazy_import('ai_voice')
+bleak = lazy_import('bleak')
+user_profiles = lazy_import('user_profiles')
+user_trends = lazy_import('user_trends')
 
 # ==============================================================================
 # CONFIGURATION
@@ -39,7 +46,16 @@ MQTT_CONFIG = {
     'username': "smart-scale",
     'password': "smart-scale",
     'client_id': "smart-scale",
-    'topic': "v1/devices/me/telemetry"
+    'topic': "v1/devices/me/telemetry",
+    'encoding': 'json',  # 'binary': compact telemetry_codec payloads (the broker side must decode them)
+    'gateway_username': "smart-scale-gateway"  # Access token of the gateway device (--gateway mode)
+}
+
+# Runtime Configuration
+RUNTIME_CONFIG = {
+    'exit_after_measurement': True,  # GUI mode stops measuring after the first valid weigh-in
+    'drain_timeout': 10.0,  # seconds to wait for queued MQTT messages before stopping after a weigh-in
+    'balance_test': True,  # One-leg balance test needs a camera and a display
 }
 
 # Testing Configuration
@@ -63,169 +79,90 @@ ACTIVITY_LEVELS = {
 # ==============================================================================
 
 logger = logging.getLogger(__name__)
-root = tk.Tk()
-root.withdraw()
+root = None  # Tk root window, only created in GUI mode
+measurement_done = None  # asyncio.Event set by process_weight_data when measuring should stop
+finished_measurement = None
 health_data = iu.HealthDataManager()
 
+# Modules warmed up in the background while the user fills in the dialog,
+# in the order they are needed
+WARM_UP_MODULES = ['qr_scaner', 'csv_update', 'bleak', 'oneleg_timer', 'ai_recommendations']
+# Headless mode has no dialog or camera
+HEADLESS_WARM_UP_MODULES = ['csv_update', 'bleak', 'ai_recommendations', 'user_trends']
+
 # ==============================================================================
-# USER INTERFACE
+# WEIGHT PROCESSING
 # ==============================================================================
 
-class UserInfoDialog(simpledialog.Dialog):
-    """Dialog for user information input with CCCD QR scanner"""
-
-    def __init__(self, parent):
-        self.cccd_data = None
-        super().__init__(parent)
-
-    def body(self, master):
-        """Create dialog body"""
-        self.title("Nhập thông tin cá nhân")
-
-        # CCCD QR Scanner section
-        qr_frame = tk.Frame(master)
-        qr_frame.grid(row = 0, column = 0, columnspan = 2, pady = 10)
-
-        tk.Label(qr_frame, text = "1. Quét mã QR trên CCCD:", font = ("Arial", 10, "bold")).pack()
-        self.scan_button = tk.Button(qr_frame, text = "Quét CCCD", command = self.scan_cccd,
-                                     bg = "#4CAF50", fg = "white", font = ("Arial", 9))
-        self.scan_button.pack(pady = 5)
-
-        # Status label for CCCD scan
-        self.cccd_status = tk.Label(qr_frame, text = "Chưa quét CCCD", fg = "red")
-        self.cccd_status.pack()
-
-        # User info display (read-only)
-        info_frame = tk.Frame(master)
-        info_frame.grid(row = 1, column = 0, columnspan = 2, pady = 10)
-
-        tk.Label(info_frame, text = "Thông tin từ CCCD:", font = ("Arial", 10, "bold")).grid(row = 0, column = 0,
-                                                                                             columnspan = 2)
-
-        tk.Label(info_frame, text = "Họ tên:").grid(row = 1, column = 0, sticky = "w")
-        self.name_label = tk.Label(info_frame, text = "", bg = "lightgray", width = 30, anchor = "w")
-        self.name_label.grid(row = 1, column = 1, padx = 5)
-
-        tk.Label(info_frame, text = "Ngày sinh:").grid(row = 2, column = 0, sticky = "w")
-        self.dob_label = tk.Label(info_frame, text = "", bg = "lightgray", width = 30, anchor = "w")
-        self.dob_label.grid(row = 2, column = 1, padx = 5)
-
-        tk.Label(info_frame, text = "Giới tính:").grid(row = 3, column = 0, sticky = "w")
-        self.gender_label = tk.Label(info_frame, text = "", bg = "lightgray", width = 30, anchor = "w")
-        self.gender_label.grid(row = 3, column = 1, padx = 5)
-
-        # Manual input section
-        input_frame = tk.Frame(master)
-        input_frame.grid(row = 2, column = 0, columnspan = 2, pady = 10)
-
-        tk.Label(input_frame, text = "2. Nhập thông tin bổ sung:", font = ("Arial", 10, "bold")).grid(row = 0,
-                                                                                                      column = 0,
-                                                                                                      columnspan = 2)
-
-        # Height input
-        tk.Label(input_frame, text = "Chiều cao (cm):").grid(row = 1, column = 0, sticky = "w")
-        self.height_entry = tk.Entry(input_frame, width = 30)
-        self.height_entry.grid(row = 1, column = 1, padx = 5)
-
-        # Activity level dropdown
-        tk.Label(input_frame, text = "Hệ số hoạt động:").grid(row = 2, column = 0, sticky = "w")
-        self.activity_var = tk.StringVar()
-        self.activity_var.set("Ít vận động")
-        self.activity_menu = ttk.OptionMenu(
-            input_frame, self.activity_var, "Ít vận động", *ACTIVITY_LEVELS.keys()
-        )
-        self.activity_menu.grid(row = 2, column = 1, sticky = "w", padx = 5)
-
-        # Add note about weight measurement
-        note_frame = tk.Frame(master)
-        note_frame.grid(row = 3, column = 0, columnspan = 2, pady = 10)
-
-        note_text = "Lưu ý: Cân nặng sẽ được đo tự động từ thiết bị cân thông minh"
-        tk.Label(note_frame, text = note_text, font = ("Arial", 9, "italic"), fg = "blue").pack()
-
-        return self.scan_button
-
-    def scan_cccd(self):
-        """Handle CCCD QR code scanning"""
-        try:
-            # Call the QR scanner function
-            self.cccd_data = scan_cccd_qr()
-
-            if self.cccd_data:
-                # Update the display labels
-                self.name_label.config(text = self.cccd_data.get('name', ''))
-                self.dob_label.config(text = self.cccd_data.get('dob', ''))
-                self.gender_label.config(text = self.cccd_data.get('gender', ''))
-
-                # Update status
-                self.cccd_status.config(text = "✓ Đã quét CCCD thành công", fg = "green")
-
-                # Enable input fields
-                self.height_entry.config(state = "normal")
-
-                messagebox.showinfo("Thành công", "Đã quét CCCD thành công!\nVui lòng nhập chiều cao.")
-            else:
-                messagebox.showerror("Lỗi", "Không thể quét mã QR CCCD. Vui lòng thử lại.")
+def generate_fake_weight():
+    """Generate a random fake weight within the specified range"""
+    min_weight, max_weight = TESTING_CONFIG['weight_range']
+    return round(random.uniform(min_weight, max_weight), 2)
 
-        except Exception as e:
-            messagebox.showerror("Lỗi", f"Lỗi khi quét CCCD: {str(e)}")
 
-    def validate(self):
-        """Validate input before applying"""
-        if not self.cccd_data:
-            messagebox.showerror("Lỗi", "Vui lòng quét CCCD trước!")
-            return False
+def persist_measurement(measurement):
+    """Save the instant metrics of a measurement to CSV"""
+    timestamp = measurement.timestamp.strftime(cu.CSV_CONFIG['date_format'])
+    cu.update_csv(measurement.user_info, {**measurement.snapshot(), 'datetime': timestamp})
 
-        if not self.height_entry.get().strip():
-            messagebox.showerror("Lỗi", "Vui lòng nhập chiều cao!")
-            return False
 
-        try:
-            height = float(self.height_entry.get())
-
-            if height <= 0 or height > 300:
-                messagebox.showerror("Lỗi", "Chiều cao không hợp lệ (1-300 cm)!")
-                return False
-
-        except ValueError:
-            messagebox.showerror("Lỗi", "Vui lòng nhập số hợp lệ cho chiều cao!")
-            return False
-
-        return True
-
-    def apply(self):
-        """Apply user input"""
-        if self.cccd_data:
-            # Calculate age from date of birth
-            age = cm.calculate_age(self.cccd_data['dob'])
-
-            self.result = {
-                "name": self.cccd_data['name'],
-                "dob": self.cccd_data['dob'],
-                "gender": self.cccd_data['gender'],
-                "cccd_id": self.cccd_data['cccd_id'],
-                "address": self.cccd_data.get('address', ''),
-                "height": float(self.height_entry.get()),
-                "weight": None,  # Weight will be set later from scale data
-                "age": age,
-                "activity_factor": ACTIVITY_LEVELS[self.activity_var.get()]
-            }
-        else:
-            self.result = None
+def amend_measurement(measurement, results):
+    """Store follow-up results (e.g. one-leg standing time) in the measurement's CSV row"""
+    timestamp = measurement.timestamp.strftime(cu.CSV_CONFIG['date_format'])
+    columns = {key: header for header, key in cu.CSV_HEADERS.items() if key}
+    cu.amend_csv_row(timestamp, measurement.user_info['name'],
+                     {columns[key]: value for key, value in results.items()})
 
 
-# ==============================================================================
-# WEIGHT PROCESSING
-# ==============================================================================
+def recommend(measurements):
+    """Get and print AI recommendations for a set of measurements"""
+    ai_recommend = ai_rcm.ai_health_recommendations(measurements)
+    print(ai_recommend)
 
-def generate_fake_weight():
-    """Generate a random fake weight within the specified range"""
-    min_weight, max_weight = TESTING_CONFIG['weight_range']
-    return round(random.uniform(min_weight, max_weight), 2)
+    # Optional: Voice recommendations (commented out)
+    # ai_voice.read_recommend_vietnamese(user_info, ai_recommend)
+
+    return ai_recommend
+
+
+def measurement_trends(measurement):
+    """Show the user's weight trends, including this weigh-in"""
+    if cu.CSV_CONFIG.get('write_behind'):
+        from buffered_writer import flush_shared_writer
+
+        # Hàng vừa cân có thể vẫn nằm trong hàng đợi ghi
+        flush_shared_writer()
+    if cu.CSV_CONFIG.get('sharded_writes'):
+        from sharded_writes import merge_shards
+
+        # ... hoặc trong shard của tiến trình này, như amend_csv_row
+        merge_shards(config = {'shard_dir': cu.CSV_CONFIG['shard_dir']})
+    trends = user_trends.get_user_trends(measurement.user_info['name'])
+    for days, metrics in trends['windows'].items():
+        weight = metrics['weight']
+        if weight['mean'] is None:
+            continue
+        slope = f", {weight['slope_per_day'] * 7:+.2f} kg/tuần" if weight['slope_per_day'] is not None else ""
+        print(f"Xu hướng {days} ngày: cân nặng trung bình {weight['mean']} kg{slope} ({weight['count']} lần cân)")
+    health_data.set_trends(trends)
+    return trends
+
+
+def create_measurement_pipeline():
+    """Create the staged measurement pipeline: instant metrics first, then balance test, AI and trends"""
+    return MeasurementPipeline(
+        publish = lambda metrics: mqtt_client.publish(MQTT_CONFIG['topic'], metrics),
+        persist = persist_measurement,
+        amend = amend_measurement,
+        balance_test = cbc.measure_one_leg_balance if RUNTIME_CONFIG['balance_test'] else None,
+        recommend = recommend,
+        trends = measurement_trends
+    )
 
 
 def process_weight_data(weight, is_fake=False):
     """Process weight data and perform calculations"""
+    global finished_measurement
     if not cbc.is_meaningful_weight(user_info, weight):
         return
 
@@ -233,27 +170,15 @@ def process_weight_data(weight, is_fake=False):
     weight_source = "(FAKE DATA)" if is_fake else ""
     print(f"Cân nặng: {weight} kg {weight_source}")
 
-    # Calculate body composition
-    body_composition = cbc.calculate_body_metrics(user_info)
-    health_data.set_body_composition(body_composition)
-
-    # Optional: One-leg standing timer (commented out)
-    # oneleg_standing_timer = ast.one_leg_balance_detection()
-    # print("=== KẾT QUẢ ĐO ===")
-    # print(f"Thời gian đứng 1 chân: {oneleg_standing_timer['session_duration']:.1f} giây")
-    # print(f"Độ lệch trung tâm trung bình: {oneleg_standing_timer['avg_offset']:.1f} pixels")
-
-    # Save data and get recommendations
-    mqtt_client.publish(MQTT_CONFIG['topic'], health_data.get_body_composition())
-    cu.update_csv(user_info, health_data.get_body_composition())
-
-    ai_recommend = ai_rcm.ai_health_recommendations(health_data.get_body_composition())
-    print(ai_recommend)
-
-    # Optional: Voice recommendations (commented out)
-    # read_recommend_vietnamese(user_info, ai_recommend)
+    # Instant metrics are published and saved right away; the one-leg balance
+    # test and AI recommendations run as follow-up stages of the same measurement
+    measurement = measurement_pipeline.submit(user_info)
+    health_data.set_body_composition(measurement.metrics)
 
-    sys.exit(0)
+    if RUNTIME_CONFIG['exit_after_measurement']:
+        # Không thoát ngay trong callback: main() chờ các bước tiếp theo và hàng đợi MQTT rồi mới dừng
+        finished_measurement = measurement
+        measurement_done.set()
 
 
 # ==============================================================================
@@ -262,10 +187,10 @@ def process_weight_data(weight, is_fake=False):
 
 async def find_scale_device():
     """Find the scale device by name"""
-    return await BleakScanner().find_device_by_name(DEVICE_NAME)
+    return await bleak.BleakScanner().find_device_by_name(DEVICE_NAME)
 
 
-def notification_handler(characteristic: BleakGATTCharacteristic, data: bytearray):
+def notification_handler(characteristic: 'bleak.backends.characteristic.BleakGATTCharacteristic', data: bytearray):
     """Handle notifications from the scale device"""
     weight = parser.data_parser(data, DEVICE_NAME)
     process_weight_data(weight, is_fake = False)
@@ -275,7 +200,7 @@ async def connect_and_measure():
     """Connect to scale and start measurements"""
     disconnected_event = asyncio.Event()
 
-    def disconnected_callback(_bleak_client: BleakClient):
+    def disconnected_callback(_bleak_client: 'bleak.BleakClient'):
         logger.info("Scale disconnected")
         disconnected_event.set()
 
@@ -286,7 +211,7 @@ async def connect_and_measure():
 
     logger.info(f"Found device: {device.name}")
 
-    client = BleakClient(device, disconnected_callback = disconnected_callback)
+    client = bleak.BleakClient(device, disconnected_callback = disconnected_callback)
 
     async with client:
         await client.start_notify(BODY_COMPOSITION_MEASUREMENT_UUID, notification_handler)
@@ -316,7 +241,9 @@ async def fake_weight_testing():
 
 def get_user_info():
     """Get user information through dialog"""
-    dialog = UserInfoDialog(root)
+    from user_info_dialog import UserInfoDialog
+
+    dialog = UserInfoDialog(root, ACTIVITY_LEVELS)
     if dialog.result is None:
         logger.error("No user information provided")
         sys.exit(1)
@@ -324,20 +251,19 @@ def get_user_info():
 
 
 def initialize_mqtt():
-    """Initialize and connect MQTT client"""
-    mqtt_client = MQTTClient(
+    """Create the MQTT client; it connects once main() starts it on the BLE event loop"""
+    return AsyncMQTTClient(
         MQTT_CONFIG['broker'],
         MQTT_CONFIG['port'],
         MQTT_CONFIG['username'],
         MQTT_CONFIG['password'],
-        client_id = MQTT_CONFIG['client_id']
+        client_id = MQTT_CONFIG['client_id'],
+        config = {'wire_encoding': MQTT_CONFIG['encoding']}
     )
-    mqtt_client.connect()
-    return mqtt_client
 
 
-async def main():
-    """Main application loop"""
+async def measure():
+    """Take weigh-ins from the scale (or fake ones) until cancelled"""
     if TESTING_CONFIG['enable_fake_weight']:
         await fake_weight_testing()
     else:
@@ -347,26 +273,174 @@ async def main():
             logger.info("Restarting scale scan...")
 
 
+async def finish_measurement(measurement):
+    """Wait for the follow-up stages of the last weigh-in and for its MQTT messages, then stop MQTT"""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, measurement.wait)
+    deadline = loop.time() + RUNTIME_CONFIG['drain_timeout']
+    while mqtt_client.queue.pending() and loop.time() < deadline:
+        await asyncio.sleep(0.05)
+    if mqtt_client.queue.pending():
+        logger.warning(f"{mqtt_client.queue.pending()} MQTT messages not sent yet, "
+                       f"they stay queued until the next start")
+    await mqtt_client.aclose()
+
+
+async def main():
+    """Main application loop; returns after the first weigh-in when exit_after_measurement is set"""
+    global measurement_done
+    measurement_done = asyncio.Event()
+    # MQTT chạy chung vòng lặp sự kiện với BLE, không cần luồng mạng riêng
+    await mqtt_client.start()
+
+    measuring = asyncio.ensure_future(measure())
+    stopping = asyncio.ensure_future(measurement_done.wait())
+    try:
+        done, _ = await asyncio.wait({measuring, stopping}, return_when = asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (measuring, stopping):
+            task.cancel()
+    if measuring in done:
+        measuring.result()
+    else:
+        await finish_measurement(finished_measurement)
+
+
 def run_async_main():
-    """Run the async main function in a new event loop"""
+    """Run the async main function in a new event loop, then close the Tk window"""
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    loop.run_until_complete(main())
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
+        # Đo xong thì dừng vòng lặp Tk để run_gui dọn dẹp và thoát
+        root.after(0, root.quit)
 
 
 # ==============================================================================
-# APPLICATION ENTRY POINT
+# RUN MODES
 # ==============================================================================
 
-if __name__ == "__main__":
-    # Configure logging
-    logging.basicConfig(
-        level = logging.INFO,
-        format = "%(asctime)-15s %(name)-8s %(levelname)s: %(message)s",
-    )
+def get_headless_user_info(args):
+    """Get user information from the history store or a profile source, without any UI"""
+    try:
+        if args.profile:
+            return user_profiles.profile_from_source(args.profile)
+        return user_profiles.profile_from_history(args.user)
+    except Exception as e:
+        logger.error(f"Could not load user profile: {e}")
+        sys.exit(1)
+
+
+def start_services():
+    """Create the MQTT client and the measurement pipeline"""
+    global mqtt_client, measurement_pipeline
+    with profiler.section("MQTT client"):
+        mqtt_client = initialize_mqtt()
+    with profiler.section("Measurement pipeline"):
+        measurement_pipeline = create_measurement_pipeline()
+
+
+async def run_until_signal(coroutine):
+    """Run a coroutine until it ends or SIGINT/SIGTERM is received"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows event loops do not support signal handlers
+            pass
+
+    measuring = asyncio.create_task(coroutine)
+    stopping = asyncio.create_task(stop_event.wait())
+    done, _ = await asyncio.wait({measuring, stopping}, return_when = asyncio.FIRST_COMPLETED)
+    for task in (measuring, stopping):
+        task.cancel()
+    if measuring in done and not measuring.cancelled() and measuring.exception():
+        raise measuring.exception()
+
+
+async def headless_main():
+    """Run the measurement loop until it ends or SIGINT/SIGTERM is received"""
+    try:
+        await run_until_signal(main())
+    finally:
+        await mqtt_client.aclose()
+
+
+def run_headless(args):
+    """Headless service mode: no Tk, profile from history/API, measure until stopped"""
+    global user_info
+    RUNTIME_CONFIG['exit_after_measurement'] = False
+    RUNTIME_CONFIG['balance_test'] = args.balance_test
+
+    start_services()
+    # Hồ sơ được nạp trước khi warm_up import các module trong luồng nền
+    health_data.set_user_info(get_headless_user_info(args))
+    user_info = health_data.get_user_info()
+    warm_up(*HEADLESS_WARM_UP_MODULES)
+    if profiler.enabled:
+        print(profiler.report("Startup profile before measuring"))
+
+    try:
+        asyncio.run(headless_main())
+    finally:
+        logger.info("Cleaning up resources")
+        measurement_pipeline.shutdown()
+        mqtt_client.close()
+
+
+def run_gateway(args):
+    """Gateway mode: every scale of the scales file, telemetry over one pool of gateway connections"""
+    import scale_gateway
+
+    mqtt_config = {**MQTT_CONFIG, 'username': MQTT_CONFIG['gateway_username'],
+                   'client_id': f"{MQTT_CONFIG['client_id']}-gateway"}
+    gateway = scale_gateway.create_gateway(args.gateway, mqtt_config, persist = persist_measurement,
+                                           config = {'pool_size': args.gateway_connections})
+    warm_up(*HEADLESS_WARM_UP_MODULES)
+    if profiler.enabled:
+        print(profiler.report("Startup profile before measuring"))
+
+    async def gateway_main():
+        try:
+            await run_until_signal(gateway.run())
+        finally:
+            await gateway.pool.aclose()
+
+    try:
+        asyncio.run(gateway_main())
+    finally:
+        logger.info("Cleaning up resources")
+        for session in gateway.sessions:
+            session.pipeline.shutdown()
+        gateway.pool.close()
+
+
+def run_gui():
+    """Interactive mode: Tk dialog for the user profile, then measure once"""
+    global root, user_info
+    import tkinter as tk
+
+    with profiler.section("Tk root"):
+        root = tk.Tk()
+        root.withdraw()
+
+    start_services()
+
+    def report_warm_up(results):
+        for name, error in results.items():
+            if error is not None:
+                logger.warning(f"Background import of {name} failed: {error}")
+        if profiler.enabled:
+            print(profiler.report("Startup profile after background warm-up"))
+
+    warm_up(*WARM_UP_MODULES, on_done = report_warm_up)
+    if profiler.enabled:
+        print(profiler.report("Startup profile before user dialog"))
 
-    # Initialize components
-    mqtt_client = initialize_mqtt()
     health_data.set_user_info(get_user_info())
     user_info = health_data.get_user_info()
 
@@ -379,4 +453,48 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         logger.info("Application terminated by user")
     finally:
-        logger.info("Cleaning up resources")
\ No newline at end of file
+        logger.info("Cleaning up resources")
+        measurement_pipeline.shutdown()
+        mqtt_client.close()
+
+
+def parse_args(argv=None):
+    arg_parser = argparse.ArgumentParser(description = "Smart scale body-composition service")
+    arg_parser.add_argument('--headless', action = 'store_true',
+                            help = "Run as a service without Tk; the user profile comes from --user or --profile")
+    profile = arg_parser.add_mutually_exclusive_group()
+    profile.add_argument('--user', help = "Name or CCCD number of the user to load from the measurement history")
+    profile.add_argument('--profile', help = "JSON profile file or http(s) URL of a local profile API")
+    arg_parser.add_argument('--gateway', metavar = 'SCALES_JSON',
+                            help = "Serve every scale listed in the file, publishing through the MQTT gateway API")
+    arg_parser.add_argument('--gateway-connections', type = int, default = 1,
+                            help = "MQTT connections shared by the scales in --gateway mode")
+    arg_parser.add_argument('--balance-test', action = 'store_true',
+                            help = "Run the camera one-leg balance test in headless mode")
+    arg_parser.add_argument('--profile-startup', action = 'store_true',
+                            help = "Report import and initialization time per module")
+    args = arg_parser.parse_args(argv)
+    if args.headless and not (args.user or args.profile):
+        arg_parser.error("--headless requires --user or --profile")
+    return args
+
+
+# ==============================================================================
+# APPLICATION ENTRY POINT
+# ==============================================================================
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # Configure logging
+    logging.basicConfig(
+        level = logging.INFO,
+        format = "%(asctime)-15s %(name)-8s %(levelname)s: %(message)s",
+    )
+
+    if args.gateway:
+        run_gateway(args)
+    elif args.headless:
+        run_headless(args)
+    else:
+        run_gui()
@@ -0,0 +1,133 @@
+"""
+Staged processing of one weigh-in.
+
+Stage 1 (instant) computes every formula/model metric in a few milliseconds,
+then publishes and persists it right away. The one-leg balance test (camera,
+up to a minute or more), the LLM recommendation and the user's trends then
+run concurrently as follow-up stages; each attaches its result to the same
+Measurement when it finishes.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+import calc_body_composition as cbc
+
+logger = logging.getLogger(__name__)
+
+
+class Measurement:
+    """One weigh-in and the results attached to it by each pipeline stage"""
+
+    def __init__(self, user_info: Dict[str, Any], metrics: Dict[str, Any], timestamp: datetime):
+        self.user_info = user_info
+        self.metrics = metrics
+        self.timestamp = timestamp
+        self.recommendation = None
+        self.trends = None
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def attach(self, **results) -> Dict[str, Any]:
+        """Attach follow-up results to the metrics and return a snapshot of them"""
+        with self._lock:
+            self.metrics.update(results)
+            return dict(self.metrics)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.metrics)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for every follow-up stage; returns True if all of them finished"""
+        done, not_done = wait(list(self.stages.values()), timeout = timeout)
+        return not not_done
+
+
+class MeasurementPipeline:
+    """
+    Runs the measurement stages.
+
+    Args:
+        publish: Called with a dictionary of (partial) metrics to send
+        persist: Called once with the Measurement holding the instant metrics
+        amend: Called with (measurement, results) when a follow-up result should be stored
+        balance_test: Returns the one-leg standing time in seconds (None to skip)
+        recommend: Returns a recommendation text for a metrics dictionary (None to skip)
+        trends: Returns the trends of the measurement's user, after it was persisted (None to skip)
+        max_workers: Threads available to the follow-up stages
+    """
+
+    def __init__(self, publish: Callable[[Dict[str, Any]], Any],
+                 persist: Callable[['Measurement'], Any],
+                 amend: Optional[Callable[['Measurement', Dict[str, Any]], Any]] = None,
+                 balance_test: Optional[Callable[[], float]] = cbc.measure_one_leg_balance,
+                 recommend: Optional[Callable[[Dict[str, Any]], str]] = None,
+                 trends: Optional[Callable[['Measurement'], Dict[str, Any]]] = None,
+                 max_workers: int = 3):
+        self.publish = publish
+        self.persist = persist
+        self.amend = amend
+        self.balance_test = balance_test
+        self.recommend = recommend
+        self.trends = trends
+        self.executor = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = 'measurement')
+
+    def submit(self, user_info: Dict[str, Any]) -> Measurement:
+        """
+        Process a weigh-in: instant metrics are published and persisted before
+        this returns, follow-up stages are scheduled in the background
+        """
+        timestamp = datetime.now()
+        timings = {}
+        metrics = cbc.calculate_instant_metrics(user_info, timings)
+        measurement = Measurement(dict(user_info), metrics, timestamp)
+        logger.info(f"Instant metrics ready in {sum(timings.values()) * 1000:.1f} ms")
+
+        self._run_stage('publish', self.publish, measurement.snapshot())
+        self._run_stage('persist', self.persist, measurement)
+
+        if self.balance_test is not None:
+            measurement.stages['balance'] = self.executor.submit(self._balance_stage, measurement)
+        if self.recommend is not None:
+            measurement.stages['recommendation'] = self.executor.submit(self._recommendation_stage, measurement)
+        if self.trends is not None:
+            measurement.stages['trends'] = self.executor.submit(self._trends_stage, measurement)
+        for name, future in measurement.stages.items():
+            future.add_done_callback(lambda f, stage = name: self._log_failure(stage, f))
+        return measurement
+
+    def _balance_stage(self, measurement: Measurement) -> float:
+        ols = self.balance_test()
+        measurement.attach(ols = ols)
+        self._run_stage('publish balance', self.publish, {'ols': ols})
+        if self.amend is not None:
+            self._run_stage('amend balance', self.amend, measurement, {'ols': ols})
+        return ols
+
+    def _recommendation_stage(self, measurement: Measurement) -> str:
+        measurement.recommendation = self.recommend(measurement.snapshot())
+        return measurement.recommendation
+
+    def _trends_stage(self, measurement: Measurement) -> Dict[str, Any]:
+        measurement.trends = self.trends(measurement)
+        return measurement.trends
+
+    @staticmethod
+    def _run_stage(name: str, func: Callable, *args):
+        # Lỗi ở một bước (MQTT, CSV, ...) không được chặn các bước còn lại
+        try:
+            return func(*args)
+        except Exception as e:
+            logger.error(f"Measurement stage '{name}' failed: {e}")
+            return None
+
+    @staticmethod
+    def _log_failure(name: str, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Measurement stage '{name}' failed: {future.exception()}")
+
+    def shutdown(self, wait_for_stages: bool = True):
+        self.executor.shutdown(wait = wait_for_stages)
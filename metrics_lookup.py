@@ -0,0 +1,186 @@
+"""
+Constant-time body-metric lookup from a precomputed grid.
+
+generate_lookup_table.py evaluates the instant metrics of
+calculate_body_metrics (formulas and both models) over a quantized
+age x height x weight grid and stores them in one memory-mapped binary file.
+Looking a measurement up then costs a few array reads instead of the formula
+chain and two model predictions.
+
+Gender is not an axis: calculate_body_metrics always uses the gender predicted
+from height and weight, so it is stored as a (height, weight) table itself.
+
+Heights and weights between grid points are interpolated bilinearly from the
+surrounding grid points that share the predicted gender of the nearest one,
+so values are never blended across the gender boundary. Age is rounded to the
+nearest whole year (calculate_age always returns whole years).
+
+Water, muscle and protein percentage and visceral fat are not stored: their
+formulas branch on weight thresholds and caps, so interpolating them gave
+errors of several units next to each branch. They are computed live from the
+predicted gender and the interpolated lbm/bm with the calc_metrics formulas,
+which costs a few arithmetic operations. The maximum error of every metric
+against the live computation is measured when the table is generated and
+stored in its header (see `max_error`). Next to the gender boundary the table
+can predict the other gender, which switches every gender-dependent formula;
+`max_same_gender` excludes those measurements.
+
+File layout:
+    8 bytes    magic b'BMLUT\\x00\\x00\\x01'
+    8 bytes    little-endian header length
+    header     UTF-8 JSON: axes, array descriptors, max_error
+    padding    to a 64-byte boundary, then every array at its recorded offset
+"""
+import json
+import struct
+
+import numpy as np
+
+import calc_metrics as cm
+
+MAGIC = b'BMLUT\x00\x00\x01'
+ALIGNMENT = 64
+
+LOOKUP_TABLE_PATH = 'pkl/body_metrics.lut'
+
+# Predicted gender is stored as an index into this tuple
+GENDERS = ('female', 'male')
+
+# Piecewise metrics computed live in lookup(), never read from the table
+LIVE_METRICS = ('wp', 'ms', 'pp', 'vf')
+
+
+class LookupRangeError(ValueError):
+    """Raised when a measurement falls outside the grid of the lookup table"""
+
+
+def axis_values(axis):
+    """Grid values of an axis descriptor {'start', 'step', 'size'}"""
+    return axis['start'] + axis['step'] * np.arange(axis['size'])
+
+
+def read_header(path):
+    """Return (header, data_offset) of a lookup table file"""
+    with open(path, 'rb') as file:
+        magic = file.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError(f"Not a body-metrics lookup table: {path}")
+        (header_length,) = struct.unpack('<Q', file.read(8))
+        header = json.loads(file.read(header_length).decode('utf-8'))
+    data_offset = -(-(len(MAGIC) + 8 + header_length) // ALIGNMENT) * ALIGNMENT
+    return header, data_offset
+
+
+class MetricsLookupTable:
+    """
+    Memory-mapped grid of body metrics
+
+    Args:
+        header: Parsed header (axes, arrays, max_error)
+        arrays: Dictionary name -> array with the raw (possibly fixed-point) values
+    """
+
+    def __init__(self, header, arrays):
+        self.header = header
+        self.arrays = arrays
+        self.axes = header['axes']
+        self.scales = {name: spec.get('scale', 1) for name, spec in header['arrays'].items()}
+        self.max_error = header.get('max_error', {})
+
+    @classmethod
+    def open(cls, path=LOOKUP_TABLE_PATH):
+        """Memory-map a lookup table file written by generate_lookup_table.py"""
+        header, data_offset = read_header(path)
+        arrays = {
+            name: np.memmap(path, dtype = np.dtype(spec['dtype']), mode = 'r',
+                            offset = data_offset + spec['offset'], shape = tuple(spec['shape']))
+            for name, spec in header['arrays'].items()
+        }
+        return cls(header, arrays)
+
+    def _position(self, axis_name, value):
+        axis = self.axes[axis_name]
+        position = (value - axis['start']) / axis['step']
+        if not (0 <= position <= axis['size'] - 1):
+            raise LookupRangeError(f"{axis_name}={value} is outside the lookup table range "
+                                   f"[{axis['start']}, {axis['start'] + axis['step'] * (axis['size'] - 1)}]")
+        return position
+
+    def _value(self, name, index):
+        return float(self.arrays[name][index]) / self.scales[name]
+
+    def lookup(self, age, height, weight, activity_factor):
+        """
+        Look up the instant metrics of one measurement
+
+        Returns:
+            Dictionary with the same keys as calc_body_composition.calculate_instant_metrics
+
+        Raises:
+            LookupRangeError: If the measurement is outside the grid
+        """
+        age_index = int(round(self._position('age', age)))
+        h = self._position('height', height)
+        w = self._position('weight', weight)
+
+        h0, w0 = int(np.floor(h)), int(np.floor(w))
+        h1 = min(h0 + 1, self.axes['height']['size'] - 1)
+        w1 = min(w0 + 1, self.axes['weight']['size'] - 1)
+        dh, dw = h - h0, w - w0
+
+        corners = [((h0, w0), (1 - dh) * (1 - dw)), ((h0, w1), (1 - dh) * dw),
+                   ((h1, w0), dh * (1 - dw)), ((h1, w1), dh * dw)]
+        nearest = (h1 if dh >= 0.5 else h0, w1 if dw >= 0.5 else w0)
+        gender_index = int(self.arrays['gender'][nearest])
+
+        # Only blend grid points on the same side of the gender boundary
+        corners = [(corner, share) for corner, share in corners
+                   if int(self.arrays['gender'][corner]) == gender_index]
+        total = sum(share for _, share in corners)
+        if total <= 0:
+            corners, total = [(nearest, 1.0)], 1.0
+
+        result = {'gender': GENDERS[gender_index], 'weight': weight, 'age': age}
+        for name, spec in self.header['arrays'].items():
+            if name == 'gender' or name in LIVE_METRICS:
+                continue
+            prefix = (age_index,) if len(spec['shape']) == 3 else ()
+            value = sum(self._value(name, prefix + corner) * share for corner, share in corners) / total
+            result[name] = value
+
+        # TDEE = BMR * hệ số hoạt động nên bảng chỉ cần lưu BMR
+        result['tdee'] = round(result['bmr'] * activity_factor, 2)
+        for name in self.header['arrays']:
+            if name in result and name != 'gender':
+                result[name] = round(result[name], 2)
+
+        # Các chỉ số có rẽ nhánh được tính trực tiếp như calculate_instant_metrics
+        gender = result['gender']
+        fat_formula = cm.get_fat_percentage(gender, age, weight, height, result['lbm'])
+        result['wp'] = cm.get_water_percentage(gender, age, weight, height, fat_formula)
+        result['ms'] = cm.get_muscle_mass(gender, age, weight, height, fat_formula, result['bm'])
+        result['pp'] = cm.get_protein_percentage(gender, age, weight, height, True,
+                                                 fat_percentage = fat_formula,
+                                                 water_percentage = result['wp'],
+                                                 bone_mass = result['bm'],
+                                                 muscle_mass = result['ms'])
+        result['vf'] = cm.get_visceral_fat(height, weight, age)
+        return {key: result[key] for key in ('gender', 'weight', 'age', 'bmi', 'bmr', 'tdee', 'lbm', 'fp', 'wp',
+                                             'bm', 'ms', 'pp', 'vf', 'iw')}
+
+
+_open_tables = {}
+
+
+def lookup_instant_metrics(user_info, path=LOOKUP_TABLE_PATH):
+    """
+    Look up the instant metrics for a user_info dictionary, opening the table on first use
+
+    Raises:
+        FileNotFoundError: If the lookup table has not been generated
+        LookupRangeError: If the measurement is outside the grid
+    """
+    table = _open_tables.get(path)
+    if table is None:
+        table = _open_tables[path] = MetricsLookupTable.open(path)
+    return table.lookup(user_info['age'], user_info['height'], user_info['weight'], user_info['activity_factor'])
@@ -1,14 +1,27 @@
 import paho.mqtt.client as mqtt
 import json
+import logging
+
+from telemetry_queue import QUEUE_CONFIG, QueueDrainer, TelemetryQueue
+
+logger = logging.getLogger(__name__)
 
 class MQTTClient:
-    def __init__(self, broker_address, port, username, password, client_id="client"):
+    def __init__(self, broker_address, port, username, password, client_id="client", queue_dir=None, config=None):
         self.client = mqtt.Client(client_id)
         self.client.username_pw_set(username, password)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        self.client.on_publish = self.on_publish
+        self.client.on_disconnect = self.on_disconnect
+        self.config = {**QUEUE_CONFIG, **(config or {})}
+        self.client.max_inflight_messages_set(self.config['max_inflight'])
         self.broker_address = broker_address
         self.port = port
+
+        # Hàng đợi trên đĩa: dữ liệu vẫn được giữ lại khi mất mạng hoặc tắt chương trình
+        self.queue = TelemetryQueue(queue_dir, self.config)
+        self.drainer = QueueDrainer(self.queue, self.client, self.config).start()
         self.client.loop_start()
 
     def on_connect(self, client, userdata, flags, rc):
@@ -16,9 +29,21 @@ class MQTTClient:
             print("Kết nối với MQTT Broker thành công!")
             # Nếu cần subscribe topic nào, bạn có thể đặt ở đây
             client.subscribe("v1/devices/me/rpc/request/+")
+            self.drainer.on_connect()
+            pending = self.queue.pending()
+            if pending:
+                logger.info(f"Sending {pending} queued MQTT messages")
         else:
             print("Kết nối bị lỗi với mã:", rc)
 
+    def on_disconnect(self, client, userdata, rc):
+        if rc != 0:
+            print("Mất kết nối với MQTT Broker, dữ liệu sẽ được gửi lại khi kết nối lại")
+        self.drainer.on_disconnect()
+
+    def on_publish(self, client, userdata, mid):
+        self.drainer.on_publish(mid)
+
     def on_message(self, client, userdata, message):
         payload = message.payload.decode("utf-8")
         print("Received:", payload)
@@ -31,12 +56,30 @@ class MQTTClient:
             print("Đã xảy ra lỗi trong quá trình phản hồi MQTT Broker:", e)
 
     def connect(self):
-        self.client.connect(self.broker_address, self.port)
+        try:
+            self.client.connect(self.broker_address, self.port)
+        except OSError as e:
+            # Vòng lặp mạng của paho sẽ tự kết nối lại; dữ liệu chờ trong hàng đợi
+            print("Chưa kết nối được MQTT Broker, sẽ thử lại:", e)
 
     def publish(self, topic, payload, qos=1):
-        """Hàm publish có thể gọi từ bên ngoài"""
+        """
+        Hàm publish có thể gọi từ bên ngoài: ghi vào hàng đợi, luồng nền sẽ gửi lên Broker
+
+        Returns:
+            Sequence number of the message in the outbound queue, or None if it could not be queued
+        """
         try:
-            self.client.publish(topic, json.dumps(payload), qos)
-            print('Đã publish thành công lên MQTT Broker !')
+            seq = self.queue.append(topic, json.dumps(payload), qos)
+            print('Đã đưa dữ liệu vào hàng đợi gửi MQTT Broker !')
+            return seq
         except Exception as e:
-            print("Đã xảy ra lỗi trong quá trình publish lên MQTT Broker:", e)
\ No newline at end of file
+            print("Đã xảy ra lỗi trong quá trình publish lên MQTT Broker:", e)
+            return None
+
+    def close(self, timeout=5.0):
+        """Dừng luồng gửi, lưu vị trí hàng đợi và ngắt kết nối"""
+        self.drainer.stop(timeout)
+        self.client.disconnect()
+        self.client.loop_stop()
+        self.queue.close()
@@ -0,0 +1,354 @@
+"""
+MQTT load generator and latency harness.
+
+Drives an MQTT client at a fixed rate from `concurrency` publishers against
+a LocalBroker in the same process, so no network access or real broker is
+needed. The client is mqtt_client_handler.MQTTClient (paho, the default) or
+async_mqtt.AsyncMQTTClient, each with its disk-backed TelemetryQueue.
+
+Reported:
+    connect_seconds   time until the client's first connection is up; the
+                      publishers start after it
+    throughput        acknowledged entries per second
+    latency_ms        publish() call to broker acknowledgement per entry
+                      (p50/p95/p99/max), queueing and coalescing included
+    reconnect         with --outage-at: the broker drops every connection and
+                      refuses new ones for --outage-seconds; reconnect_seconds
+                      is the time from the broker coming back to the client's
+                      CONNECT, recovery_seconds until the backlog queued up to
+                      that moment is acknowledged
+
+Usage:
+    python mqtt_load_test.py --rate 500 --concurrency 8 --duration 10
+    python mqtt_load_test.py --client async --outage-at 3 --outage-seconds 2
+    python mqtt_load_test.py --output load.json --compare baseline.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from local_broker import LocalBroker
+
+logger = logging.getLogger(__name__)
+
+LOAD_TEST_CONFIG = {
+    'client': 'paho',  # 'paho' (MQTTClient) or 'async' (AsyncMQTTClient)
+    'rate': 200.0,  # Publishes per second over all publishers; 0 = as fast as possible
+    'concurrency': 4,  # Publisher threads (paho) or tasks (async)
+    'duration': 10.0,  # seconds of publishing
+    'outage_at': None,  # seconds after the start to take the broker down (None: no outage)
+    'outage_seconds': 2.0,
+    'ack_delay': 0.0,  # Broker delay before each PUBACK, to simulate a slow uplink
+    'encoding': 'json',  # QUEUE_CONFIG['wire_encoding']
+    'fsync': True,  # QUEUE_CONFIG['fsync']
+    'drain_timeout': 30.0,  # seconds to wait for the remaining acknowledgements after publishing
+    'topic': 'v1/devices/me/telemetry',
+    'threshold': 0.2,  # Relative change that counts as a regression in --compare
+}
+
+PAYLOAD = {
+    'gender': 'male', 'weight': 65.5, 'age': 25, 'bmi': 22.66, 'bmr': 1620.5, 'tdee': 2511.78, 'lbm': 52.31,
+    'fp': 20.14, 'wp': 55.2, 'bm': 2.71, 'ms': 49.6, 'pp': 18.3, 'vf': 6.5, 'iw': 63.72, 'ols': 30.0,
+}
+
+
+class LatencyRecorder:
+    """Publish and acknowledgement times per queue sequence number"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent: Dict[int, float] = {}
+        self.early_acks: Dict[int, float] = {}  # Acks that arrived before record_sent() for their seq
+        self.latencies: List[float] = []
+        self.last_ack = None
+
+    def record_sent(self, seq: int, sent: float) -> None:
+        with self.lock:
+            acked = self.early_acks.pop(seq, None)
+            if acked is not None:
+                self.latencies.append(acked - sent)
+            else:
+                self.sent[seq] = sent
+
+    def on_ack(self, seqs: List[int]) -> None:
+        now = time.perf_counter()
+        with self.lock:
+            for seq in seqs:
+                sent = self.sent.pop(seq, None)
+                if sent is not None:
+                    self.latencies.append(now - sent)
+                else:
+                    # Xác nhận đến trước khi luồng publish kịp ghi thời điểm gửi
+                    self.early_acks[seq] = now
+            self.last_ack = now
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        latencies = sorted(self.latencies)
+        if len(latencies) < 2:
+            return {'p50': None, 'p95': None, 'p99': None, 'max': None, 'mean': None}
+        cuts = statistics.quantiles(latencies, n = 100)
+        return {'p50': round(cuts[49] * 1000, 3), 'p95': round(cuts[94] * 1000, 3),
+                'p99': round(cuts[98] * 1000, 3), 'max': round(latencies[-1] * 1000, 3),
+                'mean': round(statistics.fmean(latencies) * 1000, 3)}
+
+
+class Publisher:
+    """Publishes through the client under test and records each entry's send time"""
+
+    def __init__(self, client, recorder: LatencyRecorder, topic: str):
+        self.client = client
+        self.recorder = recorder
+        self.topic = topic
+        self.published = 0
+        client.queue.on_ack = recorder.on_ack
+
+    def publish(self) -> None:
+        # Không giữ khoá của recorder khi publish: append (có fsync) sẽ tuần tự hoá các luồng và chặn on_ack
+        sent = time.perf_counter()
+        result = self.client.publish(self.topic, PAYLOAD)
+        if isinstance(result, Future):
+            # AsyncMQTTClient: publish_task runs on the client's loop, so no other append happened in between
+            seq = None if result.done() else self.client.queue.next_seq - 1
+        else:
+            seq = result
+        with self.recorder.lock:
+            self.published += 1
+        if seq is not None:
+            self.recorder.record_sent(seq, sent)
+
+
+def schedule(rate: float, concurrency: int, worker: int, start: float):
+    """Send times of one publisher: an open-loop schedule that catches up when it falls behind"""
+    if not rate:
+        while True:
+            yield time.perf_counter()
+    interval = concurrency / rate
+    next_time = start + worker * interval / concurrency
+    while True:
+        yield next_time
+        next_time += interval
+
+
+def publish_thread(publisher: Publisher, config: Dict[str, Any], worker: int, start: float) -> None:
+    end = start + config['duration']
+    for send_time in schedule(config['rate'], config['concurrency'], worker, start):
+        if send_time >= end:
+            return
+        delay = send_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        publisher.publish()
+
+
+async def publish_task(publisher: Publisher, config: Dict[str, Any], worker: int, start: float) -> None:
+    end = start + config['duration']
+    for send_time in schedule(config['rate'], config['concurrency'], worker, start):
+        if send_time >= end:
+            return
+        # sleep(0) khi không giới hạn tốc độ để các task khác và việc gửi vẫn chạy được
+        await asyncio.sleep(max(0.0, send_time - time.perf_counter()))
+        publisher.publish()
+
+
+def is_connected(client) -> bool:
+    # MQTTClient bọc paho client, AsyncMQTTClient tự theo dõi trạng thái
+    return client.client.is_connected() if hasattr(client, 'client') else client.connected
+
+
+async def measure_outage(broker: LocalBroker, client, config: Dict[str, Any], start: float) -> Dict[str, Any]:
+    await asyncio.sleep(max(0.0, start + config['outage_at'] - time.perf_counter()))
+    connections = broker.connections
+    await broker.outage(config['outage_seconds'])
+    back = time.perf_counter()
+    backlog_seq = client.queue.next_seq - 1
+    backlog = client.queue.pending()
+
+    reconnected = recovered = None
+    deadline = back + config['drain_timeout']
+    while time.perf_counter() < deadline and recovered is None:
+        if reconnected is None and broker.connections > connections:
+            reconnected = time.perf_counter()
+        if reconnected is not None and client.queue.acked_through >= backlog_seq:
+            recovered = time.perf_counter()
+        await asyncio.sleep(0.005)
+    return {
+        'outage_seconds': config['outage_seconds'],
+        'backlog': backlog,
+        'reconnect_seconds': round(reconnected - back, 3) if reconnected is not None else None,
+        'recovery_seconds': round(recovered - back, 3) if recovered is not None else None,
+    }
+
+
+async def run_async(config: Dict[str, Any], queue_dir: str) -> Dict[str, Any]:
+    from async_mqtt import AsyncMQTTClient
+    from mqtt_client_handler import MQTTClient
+
+    broker = await LocalBroker({'ack_delay': config['ack_delay']}).start()
+    client_config = {'wire_encoding': config['encoding'], 'fsync': config['fsync']}
+    if config['client'] == 'async':
+        client = AsyncMQTTClient('127.0.0.1', broker.port, 'load-test', None, client_id = 'load-test',
+                                 queue_dir = queue_dir, config = client_config)
+        await client.start()
+    else:
+        client = MQTTClient('127.0.0.1', broker.port, 'load-test', None, client_id = 'load-test',
+                            queue_dir = queue_dir, config = client_config)
+        client.connect()
+
+    # Thời gian kết nối lần đầu được báo cáo riêng, không tính vào độ trễ
+    connecting = time.perf_counter()
+    while not is_connected(client) and time.perf_counter() - connecting < config['drain_timeout']:
+        await asyncio.sleep(0.005)
+    connect_seconds = time.perf_counter() - connecting
+
+    recorder = LatencyRecorder()
+    publisher = Publisher(client, recorder, config['topic'])
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    outage = None
+    if config['outage_at'] is not None:
+        outage = asyncio.ensure_future(measure_outage(broker, client, config, start))
+
+    if config['client'] == 'async':
+        await asyncio.gather(*(publish_task(publisher, config, worker, start)
+                               for worker in range(config['concurrency'])))
+    else:
+        with ThreadPoolExecutor(max_workers = config['concurrency']) as executor:
+            await asyncio.gather(*(loop.run_in_executor(executor, publish_thread, publisher, config, worker, start)
+                                   for worker in range(config['concurrency'])))
+    published_seconds = time.perf_counter() - start
+
+    deadline = time.perf_counter() + config['drain_timeout']
+    while client.queue.pending() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    reconnect = await outage if outage is not None else None
+
+    if config['client'] == 'async':
+        await client.aclose()
+    else:
+        await loop.run_in_executor(None, client.close)
+    await broker.stop()
+
+    acknowledged = len(recorder.latencies)
+    elapsed = (recorder.last_ack or time.perf_counter()) - start
+    return {
+        'connect_seconds': round(connect_seconds, 3),
+        'published': publisher.published,
+        'acknowledged': acknowledged,
+        'unacknowledged': publisher.published - acknowledged,
+        'publish_seconds': round(published_seconds, 3),
+        'elapsed_seconds': round(elapsed, 3),
+        'offered_rate': round(publisher.published / published_seconds, 1) if published_seconds else None,
+        'throughput': round(acknowledged / elapsed, 1) if elapsed > 0 else None,
+        'latency_ms': recorder.summary(),
+        'mqtt_messages': broker.published,
+        'payload_bytes': sum(len(message.payload) for message in broker.messages),
+        'reconnect': reconnect,
+    }
+
+
+def run(config: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Run one load test and return the JSON-serializable report"""
+    config = {**LOAD_TEST_CONFIG, **(config or {})}
+    report = {
+        'created': datetime.now().isoformat(timespec = 'seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {key: value for key, value in config.items() if key != 'threshold'},
+    }
+    with tempfile.TemporaryDirectory() as queue_dir:
+        # Mỗi lần publish đều in thông báo; giữ đầu ra của bài test gọn
+        with contextlib.redirect_stdout(io.StringIO()):
+            report.update(asyncio.run(run_async(config, queue_dir)))
+    return report
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = None) -> List[Dict[str, Any]]:
+    """
+    Compare throughput, latency percentiles and recovery time of two reports
+
+    Returns:
+        List of regressions, each a dictionary with the metric name, both
+        values and the relative change (positive = worse)
+    """
+    threshold = LOAD_TEST_CONFIG['threshold'] if threshold is None else threshold
+
+    def metrics(report):
+        values = {'throughput': report.get('throughput')}
+        values.update({f"latency_ms.{key}": report.get('latency_ms', {}).get(key) for key in ('p50', 'p95', 'p99')})
+        values['reconnect.recovery_seconds'] = (report.get('reconnect') or {}).get('recovery_seconds')
+        return values
+
+    regressions = []
+    previous_values = metrics(baseline)
+    for name, value in metrics(current).items():
+        previous = previous_values.get(name)
+        if value is None or not previous:
+            continue
+        # Throughput giảm là xấu đi; các chỉ số thời gian tăng là xấu đi
+        change = previous / value - 1 if name == 'throughput' else value / previous - 1
+        if change > threshold:
+            regressions.append({'name': name, 'baseline': previous, 'current': value, 'change': round(change, 4)})
+    return regressions
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description = "MQTT load and latency test against a local broker stand-in")
+    arg_parser.add_argument('--client', choices = ('paho', 'async'), default = LOAD_TEST_CONFIG['client'])
+    arg_parser.add_argument('--rate', type = float, default = LOAD_TEST_CONFIG['rate'],
+                            help = "Publishes per second over all publishers (0 = unthrottled)")
+    arg_parser.add_argument('--concurrency', type = int, default = LOAD_TEST_CONFIG['concurrency'],
+                            help = "Concurrent publishers")
+    arg_parser.add_argument('--duration', type = float, default = LOAD_TEST_CONFIG['duration'],
+                            help = "Seconds of publishing")
+    arg_parser.add_argument('--outage-at', type = float, default = LOAD_TEST_CONFIG['outage_at'],
+                            help = "Take the broker down this many seconds after the start")
+    arg_parser.add_argument('--outage-seconds', type = float, default = LOAD_TEST_CONFIG['outage_seconds'])
+    arg_parser.add_argument('--ack-delay', type = float, default = LOAD_TEST_CONFIG['ack_delay'],
+                            help = "Broker delay in seconds before each PUBACK")
+    arg_parser.add_argument('--encoding', choices = ('json', 'binary'), default = LOAD_TEST_CONFIG['encoding'])
+    arg_parser.add_argument('--no-fsync', action = 'store_true', help = "Do not fsync each queued message")
+    arg_parser.add_argument('--output', help = "Write the JSON report to this file")
+    arg_parser.add_argument('--compare', help = "Baseline JSON report to compare against")
+    arg_parser.add_argument('--threshold', type = float, default = LOAD_TEST_CONFIG['threshold'],
+                            help = "Relative change that counts as a regression (default: 0.2 = 20%%)")
+    args = arg_parser.parse_args(argv)
+
+    report = run({
+        'client': args.client, 'rate': args.rate, 'concurrency': args.concurrency, 'duration': args.duration,
+        'outage_at': args.outage_at, 'outage_seconds': args.outage_seconds, 'ack_delay': args.ack_delay,
+        'encoding': args.encoding, 'fsync': not args.no_fsync,
+    })
+
+    if args.compare:
+        with open(args.compare, 'r', encoding = 'utf-8') as file:
+            baseline = json.load(file)
+        report['regressions'] = compare(report, baseline, args.threshold)
+
+    text = json.dumps(report, indent = 2)
+    if args.output:
+        Path(args.output).write_text(text, encoding = 'utf-8')
+    else:
+        print(text)
+
+    for regression in report.get('regressions', []):
+        logger.error(f"REGRESSION {regression['name']}: {regression['baseline']} -> {regression['current']} "
+                     f"(+{regression['change']:.0%})")
+    return 1 if report.get('regressions') else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level = logging.WARNING, format = '%(levelname)s: %(message)s')
+    sys.exit(main())
@@ -0,0 +1,351 @@
+"""
+Columnar archive of the measurement history.
+
+archive_csv() copies the rows appended to user_data.csv since the last run
+into Parquet files partitioned by month (hive layout, month=YYYY-MM), with
+the column schema of CSV_HEADERS: text columns as strings (cccd_id keeps its
+leading zeros), measurements as float64 and datetime as a timestamp.
+read_archive() reads only the requested columns and skips months, row groups
+and rows that do not match the date/user predicates, so reading one column
+for a year does not parse a single address string. compact_archive() merges
+the small files that incremental runs leave in each month.
+
+The last `settle_bytes` of the CSV are left for the next run, because
+CSVDataManager.amend_row and shard merges (sharded_writes, up to its
+`rewrite_window`) may still rewrite the most recent rows.
+
+Requires pyarrow.
+
+Usage:
+    python parquet_archive.py archive [--csv user_data/user_data.csv] [--archive-dir user_data/archive]
+    python parquet_archive.py compact
+    python parquet_archive.py schedule [--interval 3600]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from csv_update import CSV_CONFIG, CSV_HEADERS
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_CONFIG = {
+    'archive_dir': 'user_data/archive',
+    'chunk_bytes': 64 * 1024 * 1024,  # CSV bytes converted per step
+    'settle_bytes': 65536,  # Tail left for amend_row and shard merges (>= SHARD_CONFIG['rewrite_window'])
+    'row_group_size': 65536,
+    'small_file_bytes': 16 * 1024 * 1024,  # Files below this size are merged by compact_archive
+    'compression': 'zstd',
+    'interval_seconds': 3600,
+}
+
+STATE_FILE = '_archive_state.json'
+COMPACTION_JOURNAL = '_compaction.json'
+UNKNOWN_MONTH = 'unknown'
+
+# Columns kept as text; every other column of CSV_HEADERS is a float64 measurement
+TEXT_COLUMNS = ('name', 'gender', 'dob', 'cccd_id', 'address')
+
+ARCHIVE_SCHEMA = pa.schema([
+    (header, pa.timestamp('s') if header == 'datetime' else pa.string() if header in TEXT_COLUMNS else pa.float64())
+    for header in CSV_HEADERS
+])
+
+
+def _fingerprint(path: Path, offset: int, size: int = 4096) -> str:
+    """Hash of the bytes just before `offset`, to detect a rewritten source file"""
+    with open(path, 'rb') as file:
+        file.seek(max(0, offset - size))
+        return hashlib.sha256(file.read(offset - max(0, offset - size))).hexdigest()
+
+
+def _to_float(column: pa.Array) -> pa.Array:
+    try:
+        return pc.cast(column, pa.float64())
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        # Giá trị hỏng (không phải số) được ghi thành null như pd.to_numeric(errors='coerce')
+        return pa.array(pd.to_numeric(column.to_pandas(), errors = 'coerce'), type = pa.float64())
+
+
+def convert_rows(csv_bytes: bytes, date_format: str = CSV_CONFIG['date_format']) -> pa.Table:
+    """
+    Parse CSV text (header line included) into a table with ARCHIVE_SCHEMA plus a `month` column
+
+    Rows with the wrong number of fields are skipped.
+    """
+    table = pa_csv.read_csv(
+        pa.py_buffer(csv_bytes),
+        read_options = pa_csv.ReadOptions(use_threads = True),
+        parse_options = pa_csv.ParseOptions(invalid_row_handler = lambda row: 'skip'),
+        convert_options = pa_csv.ConvertOptions(
+            column_types = {header: pa.string() for header in CSV_HEADERS},
+            strings_can_be_null = True,
+            include_columns = list(CSV_HEADERS),
+            include_missing_columns = True,
+        ),
+    )
+
+    columns = []
+    for field in ARCHIVE_SCHEMA:
+        column = table.column(field.name).combine_chunks()
+        if field.name == 'datetime':
+            column = pc.strptime(column, format = date_format, unit = 's', error_is_null = True)
+        elif field.type == pa.float64():
+            column = _to_float(column)
+        columns.append(column)
+
+    months = pc.fill_null(pc.strftime(columns[0], format = '%Y-%m'), UNKNOWN_MONTH)
+    return pa.Table.from_arrays(columns + [months], schema = ARCHIVE_SCHEMA.append(pa.field('month', pa.string())))
+
+
+def _write_partitions(table: pa.Table, archive_dir: Path, file_stem: str, config: Dict[str, Any]) -> int:
+    """Write one file per month; the same stem overwrites the files of an interrupted run"""
+    written = 0
+    for month in pc.unique(table.column('month')).to_pylist():
+        rows = table.filter(pc.equal(table.column('month'), month)).drop_columns(['month'])
+        rows = rows.sort_by([('datetime', 'ascending')])
+        partition = archive_dir / f'month={month}'
+        partition.mkdir(parents = True, exist_ok = True)
+
+        target = partition / f'{file_stem}.parquet'
+        temp = partition / f'.{file_stem}.parquet.tmp'
+        pq.write_table(rows, temp, row_group_size = config['row_group_size'], compression = config['compression'])
+        os.replace(temp, target)
+        written += rows.num_rows
+    return written
+
+
+def _load_state(archive_dir: Path) -> Dict[str, Any]:
+    path = archive_dir / STATE_FILE
+    if path.exists():
+        with open(path, 'r', encoding = 'utf-8') as file:
+            return json.load(file)
+    return {}
+
+
+def _save_state(archive_dir: Path, state: Dict[str, Any]) -> None:
+    temp = archive_dir / f'.{STATE_FILE}.tmp'
+    with open(temp, 'w', encoding = 'utf-8') as file:
+        json.dump(state, file, indent = 2)
+    os.replace(temp, archive_dir / STATE_FILE)
+
+
+def archive_csv(csv_path=None, archive_dir=None, config: Dict[str, Any] = None) -> int:
+    """
+    Archive the CSV rows appended since the previous run
+
+    Args:
+        csv_path: Source CSV file (default: CSV_CONFIG['file_path'])
+        archive_dir: Archive root directory (default: ARCHIVE_CONFIG['archive_dir'])
+        config: ARCHIVE_CONFIG overrides
+
+    Returns:
+        Number of rows archived
+
+    Raises:
+        RuntimeError: If the part of the CSV that was already archived has been rewritten
+    """
+    config = {**ARCHIVE_CONFIG, **(config or {})}
+    csv_path = Path(csv_path or CSV_CONFIG['file_path'])
+    archive_dir = Path(archive_dir or config['archive_dir'])
+    archive_dir.mkdir(parents = True, exist_ok = True)
+    if not csv_path.exists():
+        return 0
+
+    state = _load_state(archive_dir)
+    offset = state.get('offset', 0)
+    if offset and (csv_path.stat().st_size < offset or _fingerprint(csv_path, offset) != state.get('fingerprint')):
+        raise RuntimeError(f"{csv_path} was rewritten after byte {offset} had been archived; "
+                           f"move {archive_dir} away to rebuild the archive")
+
+    with open(csv_path, 'rb') as file:
+        header_line = file.readline()
+        if not header_line.endswith(b'\n'):
+            return 0
+        header_line = header_line.removeprefix(b'\xef\xbb\xbf')
+        offset = max(offset, file.tell())
+
+        archive_end = file.seek(0, os.SEEK_END) - config['settle_bytes']
+        archived = 0
+        while offset < archive_end:
+            file.seek(offset)
+            data = file.read(min(config['chunk_bytes'], archive_end - offset))
+            end = data.rfind(b'\n') + 1
+            if end == 0:
+                break
+
+            table = convert_rows(header_line + data[:end], CSV_CONFIG['date_format'])
+            archived += _write_partitions(table, archive_dir, f'part-{offset:015d}', config)
+            offset += end
+            _save_state(archive_dir, {
+                'source': str(csv_path.resolve()),
+                'offset': offset,
+                'fingerprint': _fingerprint(csv_path, offset),
+                'updated': datetime.now().isoformat(timespec = 'seconds'),
+            })
+
+    if archived:
+        logger.info(f"Archived {archived} rows from {csv_path} to {archive_dir}")
+    return archived
+
+
+def _finish_compaction(archive_dir: Path) -> None:
+    """Complete a compaction interrupted after its merged file was written"""
+    journal_path = archive_dir / COMPACTION_JOURNAL
+    if not journal_path.exists():
+        return
+    with open(journal_path, 'r', encoding = 'utf-8') as file:
+        journal = json.load(file)
+    if (archive_dir / journal['merged']).exists():
+        for name in journal['sources']:
+            (archive_dir / name).unlink(missing_ok = True)
+    journal_path.unlink()
+
+
+def compact_archive(archive_dir=None, config: Dict[str, Any] = None) -> int:
+    """
+    Merge the small Parquet files of every month into one file
+
+    Returns:
+        Number of files removed
+    """
+    config = {**ARCHIVE_CONFIG, **(config or {})}
+    archive_dir = Path(archive_dir or config['archive_dir'])
+    if not archive_dir.exists():
+        return 0
+    _finish_compaction(archive_dir)
+
+    removed = 0
+    for partition in sorted(archive_dir.glob('month=*')):
+        small = sorted(path for path in partition.glob('*.parquet')
+                       if path.stat().st_size < config['small_file_bytes'])
+        if len(small) < 2:
+            continue
+
+        merged = pa.concat_tables([pq.read_table(path, schema = ARCHIVE_SCHEMA) for path in small])
+        merged = merged.sort_by([('datetime', 'ascending')])
+        target = partition / f'compacted-{uuid.uuid4().hex[:12]}.parquet'
+        temp = partition / f'.{target.name}.tmp'
+        pq.write_table(merged, temp, row_group_size = config['row_group_size'], compression = config['compression'])
+
+        # Nhật ký giúp hoàn tất việc xoá file cũ nếu tiến trình dừng giữa chừng
+        journal = {'merged': str(target.relative_to(archive_dir)),
+                   'sources': [str(path.relative_to(archive_dir)) for path in small]}
+        with open(archive_dir / COMPACTION_JOURNAL, 'w', encoding = 'utf-8') as file:
+            json.dump(journal, file)
+        os.replace(temp, target)
+        _finish_compaction(archive_dir)
+
+        removed += len(small)
+        logger.info(f"Compacted {len(small)} files ({merged.num_rows} rows) in {partition.name}")
+    return removed
+
+
+def _month(value) -> str:
+    return pd.Timestamp(value).strftime('%Y-%m')
+
+
+def read_archive(columns: Optional[Sequence[str]] = None, start=None, end=None,
+                 name: Optional[str] = None, cccd_id: Optional[str] = None,
+                 archive_dir=None) -> pd.DataFrame:
+    """
+    Read archived rows with column projection and date/user predicates
+
+    Months outside [start, end] are not opened, and row groups whose datetime
+    statistics fall outside the range are skipped.
+
+    Args:
+        columns: Columns to return (default: all of CSV_HEADERS)
+        start: Earliest datetime (inclusive), anything pd.Timestamp accepts
+        end: Latest datetime (inclusive)
+        name: User's name (case-insensitive)
+        cccd_id: CCCD number (exact, leading zeros included)
+        archive_dir: Archive root directory (default: ARCHIVE_CONFIG['archive_dir'])
+
+    Returns:
+        DataFrame sorted by datetime
+    """
+    archive_dir = Path(archive_dir or ARCHIVE_CONFIG['archive_dir'])
+    columns = list(columns or CSV_HEADERS)
+    unknown = set(columns) - set(CSV_HEADERS)
+    if unknown:
+        raise ValueError(f"Unknown columns: {sorted(unknown)}")
+    if not archive_dir.exists():
+        return pd.DataFrame(columns = columns)
+
+    _finish_compaction(archive_dir)
+    dataset = ds.dataset(archive_dir, schema = ARCHIVE_SCHEMA.append(pa.field('month', pa.string())),
+                         format = 'parquet', partitioning = 'hive')
+
+    conditions = []
+    if start is not None:
+        conditions += [ds.field('month') >= _month(start), ds.field('datetime') >= pd.Timestamp(start).to_pydatetime()]
+    if end is not None:
+        conditions += [ds.field('month') <= _month(end), ds.field('datetime') <= pd.Timestamp(end).to_pydatetime()]
+    if start is not None or end is not None:
+        conditions.append(ds.field('month') != UNKNOWN_MONTH)
+    if cccd_id is not None:
+        conditions.append(ds.field('cccd_id') == str(cccd_id))
+    if name is not None:
+        conditions.append(pc.utf8_lower(ds.field('name')) == name.lower())
+
+    condition = None
+    for expression in conditions:
+        condition = expression if condition is None else condition & expression
+
+    read_columns = columns if 'datetime' in columns else columns + ['datetime']
+    table = dataset.to_table(columns = read_columns, filter = condition)
+    df = table.sort_by([('datetime', 'ascending')]).to_pandas()
+    return df[columns]
+
+
+def run_scheduled(csv_path=None, archive_dir=None, interval: Optional[float] = None) -> None:
+    """Archive and compact every `interval` seconds until interrupted"""
+    interval = interval or ARCHIVE_CONFIG['interval_seconds']
+    while True:
+        try:
+            archive_csv(csv_path, archive_dir)
+            compact_archive(archive_dir)
+        except Exception as e:
+            logger.error(f"Archive run failed: {e}")
+        time.sleep(interval)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description = "Monthly Parquet archive of the measurement history")
+    parser.add_argument('command', choices = ['archive', 'compact', 'schedule'])
+    parser.add_argument('--csv', default = CSV_CONFIG['file_path'])
+    parser.add_argument('--archive-dir', default = ARCHIVE_CONFIG['archive_dir'])
+    parser.add_argument('--interval', type = float, default = ARCHIVE_CONFIG['interval_seconds'])
+    args = parser.parse_args(argv)
+
+    if args.command == 'archive':
+        print(f"Archived {archive_csv(args.csv, args.archive_dir)} rows")
+    elif args.command == 'compact':
+        print(f"Merged {compact_archive(args.archive_dir)} files")
+    else:
+        try:
+            run_scheduled(args.csv, args.archive_dir, args.interval)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level = logging.INFO, format = '%(levelname)s: %(message)s')
+    sys.exit(main())
@@ -0,0 +1,388 @@
+"""
+Multi-scale gateway: one process, many scales, a small pool of MQTT connections.
+
+main.py serves one scale (DEVICE_NAME) and publishes as one ThingsBoard
+device. In gateway mode every configured scale is a ScaleSession with its own
+user profile and telemetry identity, and all of them share a GatewayPool of
+`pool_size` MQTT connections speaking the ThingsBoard gateway API:
+
+    v1/gateway/connect     {"device": "<name>", "type": "<type>"}
+    v1/gateway/disconnect  {"device": "<name>"}
+    v1/gateway/telemetry   {"<name>": [{"ts": ..., "values": {...}}], ...}
+    v1/gateway/rpc         requests {"device", "data": {"id", "method", "params"}},
+                           replies {"device", "id", "data"}
+
+Each device is pinned to one connection (crc32 of its name), so its messages
+stay in order, and each connection has its own disk-backed TelemetryQueue;
+consecutive telemetry of different devices is coalesced into one gateway
+message. One BLE scanner feeds every session, and each scale is connected
+as soon as it is seen.
+
+Scales file (JSON):
+    {"scales": [{"device": "Kiosk 1", "name": "Crenot Gofit S2",
+                 "address": "AA:BB:CC:DD:EE:FF", "user": "084099010894"}, ...]}
+`name` is the BLE name (and selects the data_parser format), `address` is
+required when several scales share a name, and the profile comes from
+`user` (history) or `profile` (file/URL) as in headless mode.
+
+Usage:
+    python main.py --gateway scales.json
+    python scale_gateway.py --load-test 300 --measurements 3 --pool-size 2
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import random
+import tempfile
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import calc_body_composition as cbc
+import data_parser as parser
+from async_mqtt import AsyncMQTTClient
+from lazy_imports import lazy_import
+from measurement_pipeline import MeasurementPipeline
+
+bleak = lazy_import('bleak')
+user_profiles = lazy_import('user_profiles')
+
+logger = logging.getLogger(__name__)
+
+GATEWAY_CONFIG = {
+    'pool_size': 1,  # MQTT connections shared by all scales
+    'queue_dir': 'user_data/mqtt_queue/gateway',  # One sub-directory per connection
+    'device_type': 'smart-scale',
+    'connect_topic': 'v1/gateway/connect',
+    'disconnect_topic': 'v1/gateway/disconnect',
+    'telemetry_topic': 'v1/gateway/telemetry',
+    'attributes_topic': 'v1/gateway/attributes',
+    'rpc_topic': 'v1/gateway/rpc',
+    'retry_delay': 5.0,  # seconds before reconnecting a scale after a BLE error
+    'measurement_uuid': '0000FFB2-0000-1000-8000-00805F9B34FB',
+}
+
+
+class GatewayMQTTClient(AsyncMQTTClient):
+    """One pooled gateway connection; handles the RPC requests of the devices assigned to it"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.devices = set()
+
+    def on_message(self, topic: str, payload: bytes) -> None:
+        try:
+            request = json.loads(payload.decode("utf-8"))
+            device = request.get('device')
+            if device not in self.devices:
+                return  # Thiết bị thuộc kết nối khác trong pool
+            data = request.get('data') or {}
+            if 'method' not in data:
+                return  # Phản hồi RPC của chính gateway, không phải yêu cầu
+            print(f"[{device}] Received:", data)
+            if data.get('method') == "setValue":
+                self.publish(self.config['attributes_topic'], {device: {'value': data.get('params')}})
+            self.publish(self.config['rpc_topic'], {'device': device, 'id': data.get('id'), 'data': {'success': True}})
+        except Exception as e:
+            print("Đã xảy ra lỗi trong quá trình phản hồi MQTT Broker:", e)
+
+
+class GatewayPool:
+    """
+    Multiplexes the telemetry of many devices over `pool_size` gateway connections
+
+    Args:
+        broker_address: Broker host
+        port: Broker port
+        username: Gateway access token
+        password: Password
+        client_id: Base MQTT client id; connection i uses "<client_id>-<i>"
+        config: GATEWAY_CONFIG overrides (ASYNC_MQTT_CONFIG / QUEUE_CONFIG keys are passed to the clients)
+    """
+
+    def __init__(self, broker_address, port, username, password, client_id="gateway",
+                 config: Dict[str, Any] = None):
+        self.config = {**GATEWAY_CONFIG, **(config or {})}
+        queue_dir = Path(self.config['queue_dir'])
+        self.clients = [
+            GatewayMQTTClient(broker_address, port, username, password, client_id = f"{client_id}-{i}",
+                              queue_dir = queue_dir / f"conn-{i}", config = self.config)
+            for i in range(self.config['pool_size'])
+        ]
+
+    def client_for(self, device: str) -> GatewayMQTTClient:
+        """The connection a device is pinned to"""
+        return self.clients[zlib.crc32(device.encode('utf-8')) % len(self.clients)]
+
+    def connect_device(self, device: str, device_type: Optional[str] = None):
+        client = self.client_for(device)
+        client.devices.add(device)
+        return client.publish(self.config['connect_topic'],
+                              {'device': device, 'type': device_type or self.config['device_type']})
+
+    def disconnect_device(self, device: str):
+        return self.client_for(device).publish(self.config['disconnect_topic'], {'device': device})
+
+    def publish_telemetry(self, device: str, values: Dict[str, Any]):
+        """Queue telemetry of one device; returns a future completed on the broker's acknowledgement"""
+        return self.client_for(device).publish(self.config['telemetry_topic'], {device: values})
+
+    async def start(self) -> None:
+        for client in self.clients:
+            await client.start()
+
+    async def aclose(self) -> None:
+        await asyncio.gather(*(client.aclose() for client in self.clients))
+
+    def close(self, timeout: float = 5.0) -> None:
+        for client in self.clients:
+            client.close(timeout)
+
+    def pending(self) -> int:
+        return sum(client.queue.pending() for client in self.clients)
+
+    def metrics(self) -> List[Dict[str, Any]]:
+        return [client.metrics() for client in self.clients]
+
+
+class ScaleSession:
+    """
+    One scale: its BLE identity, the user standing on it and its measurement pipeline
+
+    Args:
+        spec: Entry of the scales file (device, name, address, model)
+        user_info: Profile of the scale's user (complete_profile format)
+        pool: GatewayPool the telemetry is sent through
+        persist: Stores a Measurement (see MeasurementPipeline)
+        recommend: Optional recommendation stage
+    """
+
+    def __init__(self, spec: Dict[str, Any], user_info: Dict[str, Any], pool: GatewayPool,
+                 persist: Callable, recommend: Optional[Callable] = None):
+        self.device = spec['device']
+        self.name = spec.get('name')
+        self.address = (spec.get('address') or '').upper() or None
+        self.model = spec.get('model') or self.name
+        self.user_info = user_info
+        self.pool = pool
+        self.pipeline = MeasurementPipeline(
+            publish = lambda metrics: pool.publish_telemetry(self.device, metrics),
+            persist = persist,
+            balance_test = None,  # Gateway không có camera cho từng cân
+            recommend = recommend
+        )
+        self.ble_device = None
+        self.found = asyncio.Event()
+        self.measurements = 0
+
+    def matches(self, ble_device) -> bool:
+        if self.address is not None:
+            return ble_device.address.upper() == self.address
+        return ble_device.name == self.name
+
+    def handle_weight(self, weight: float):
+        """Process one weight reading of this scale; returns the Measurement or None"""
+        if not cbc.is_meaningful_weight(self.user_info, weight):
+            return None
+        self.user_info['weight'] = weight
+        print(f"[{self.device}] Cân nặng: {weight} kg")
+        self.measurements += 1
+        return self.pipeline.submit(self.user_info)
+
+    def notification_handler(self, characteristic, data: bytearray):
+        self.handle_weight(parser.data_parser(data, self.model))
+
+
+def load_scales(path) -> List[Dict[str, Any]]:
+    """
+    Read and check the scales file
+
+    Raises:
+        ValueError: Missing device names, duplicate devices or ambiguous BLE names
+    """
+    with open(path, encoding = 'utf-8') as f:
+        scales = json.load(f)['scales']
+    devices, names = set(), {}
+    for spec in scales:
+        if not spec.get('device') or not (spec.get('name') or spec.get('address')):
+            raise ValueError(f"Scale entry needs 'device' and 'name' or 'address': {spec}")
+        if spec['device'] in devices:
+            raise ValueError(f"Duplicate device {spec['device']!r}")
+        devices.add(spec['device'])
+        if not spec.get('address'):
+            names[spec['name']] = names.get(spec['name'], 0) + 1
+    ambiguous = [name for name, count in names.items() if count > 1]
+    if ambiguous:
+        raise ValueError(f"Scales sharing a BLE name need an 'address': {ambiguous}")
+    return scales
+
+
+def load_profile(spec: Dict[str, Any]) -> Dict[str, Any]:
+    if spec.get('profile'):
+        return user_profiles.profile_from_source(spec['profile'])
+    return user_profiles.profile_from_history(spec['user'])
+
+
+class Gateway:
+    """Runs every ScaleSession on the event loop: one shared scanner, one BLE connection per scale"""
+
+    def __init__(self, sessions: List[ScaleSession], pool: GatewayPool):
+        self.sessions = sessions
+        self.pool = pool
+        self.config = pool.config
+
+    async def run(self) -> None:
+        await self.pool.start()
+        tasks = [asyncio.ensure_future(self._scan())]
+        tasks += [asyncio.ensure_future(self._scale_loop(session)) for session in self.sessions]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions = True)
+
+    async def _scan(self) -> None:
+        def detected(ble_device, advertisement_data):
+            for session in self.sessions:
+                if session.matches(ble_device):
+                    session.ble_device = ble_device
+                    session.found.set()
+                    return
+
+        async with bleak.BleakScanner(detection_callback = detected):
+            await asyncio.Event().wait()
+
+    async def _scale_loop(self, session: ScaleSession) -> None:
+        while True:
+            await session.found.wait()
+            session.found.clear()
+            try:
+                await self._measure(session)
+            except (bleak.exc.BleakError, asyncio.TimeoutError, OSError) as e:
+                logger.warning(f"[{session.device}] BLE error: {e}")
+                await asyncio.sleep(self.config['retry_delay'])
+
+    async def _measure(self, session: ScaleSession) -> None:
+        disconnected_event = asyncio.Event()
+        client = bleak.BleakClient(session.ble_device, disconnected_callback = lambda _: disconnected_event.set())
+        async with client:
+            logger.info(f"[{session.device}] Scale connected ({session.ble_device.address})")
+            self.pool.connect_device(session.device)
+            try:
+                await client.start_notify(self.config['measurement_uuid'], session.notification_handler)
+                await disconnected_event.wait()
+            finally:
+                self.pool.disconnect_device(session.device)
+                logger.info(f"[{session.device}] Scale disconnected")
+
+
+def create_gateway(scales_file, mqtt_config: Dict[str, Any], persist: Callable,
+                   recommend: Optional[Callable] = None, config: Dict[str, Any] = None) -> Gateway:
+    """Build the pool and a session per configured scale (scales without a loadable profile are skipped)"""
+    pool = GatewayPool(mqtt_config['broker'], mqtt_config['port'], mqtt_config['username'],
+                       mqtt_config['password'], client_id = mqtt_config['client_id'], config = config)
+    sessions = []
+    for spec in load_scales(scales_file):
+        try:
+            user_info = load_profile(spec)
+        except Exception as e:
+            logger.error(f"[{spec['device']}] Could not load user profile: {e}")
+            continue
+        sessions.append(ScaleSession(spec, user_info, pool, persist, recommend))
+    logger.info(f"Gateway serving {len(sessions)} scales over {len(pool.clients)} MQTT connections")
+    return Gateway(sessions, pool)
+
+
+# ==============================================================================
+# LOAD TEST
+# ==============================================================================
+
+def simulated_profile(i: int) -> Dict[str, Any]:
+    return {
+        'name': f"Sim user {i}", 'dob': '01/01/1990', 'gender': random.choice(['Nam', 'Nữ']),
+        'cccd_id': f"{i:012d}", 'address': '', 'height': random.uniform(150, 185), 'weight': None,
+        'age': random.randint(18, 70), 'activity_factor': 1.2,
+    }
+
+
+async def load_test(devices: int = 300, measurements: int = 3, pool_size: int = 2, interval: float = 1.0,
+                    timeout: float = 60.0) -> Dict[str, Any]:
+    """
+    Simulate `devices` scales against a LocalBroker and check every measurement arrived
+
+    Each simulated scale produces `measurements` weigh-ins at random times within
+    `interval` seconds of each other, through the real ScaleSession pipeline.
+    """
+    from local_broker import LocalBroker
+
+    broker = await LocalBroker().start()
+    with tempfile.TemporaryDirectory() as queue_dir:
+        pool = GatewayPool('127.0.0.1', broker.port, 'gateway-token', None,
+                           config = {'pool_size': pool_size, 'queue_dir': queue_dir, 'fsync': False})
+        sessions = [ScaleSession({'device': f"sim-scale-{i:04d}", 'name': 'MI SCALE2'}, simulated_profile(i),
+                                 pool, persist = lambda measurement: None)
+                    for i in range(devices)]
+
+        async def simulate(session: ScaleSession):
+            pool.connect_device(session.device)
+            for _ in range(measurements):
+                await asyncio.sleep(random.uniform(0, interval))
+                session.handle_weight(round(random.uniform(45, 95), 2))
+
+        start = time.perf_counter()
+        # Mỗi lần publish đều in thông báo; giữ đầu ra của bài test gọn
+        with contextlib.redirect_stdout(io.StringIO()):
+            await pool.start()
+            await asyncio.gather(*(simulate(session) for session in sessions))
+            produced = time.perf_counter() - start
+            while pool.pending() and time.perf_counter() - start < timeout:
+                await asyncio.sleep(0.01)
+            elapsed = time.perf_counter() - start
+            metrics = pool.metrics()
+            await pool.aclose()
+        await broker.stop()
+
+    received = {}
+    payload_bytes = 0
+    for message in broker.messages:
+        payload_bytes += len(message.payload)
+        if message.topic == GATEWAY_CONFIG['telemetry_topic']:
+            for device, entries in message.decode().items():
+                received[device] = received.get(device, 0) + len(entries)
+    expected = {session.device: session.measurements for session in sessions}
+    missing = {device: count - received.get(device, 0) for device, count in expected.items()
+               if received.get(device, 0) < count}
+    total = sum(expected.values())
+    return {
+        'devices': devices,
+        'connections': broker.connections,
+        'measurements': total,
+        'delivered': sum(min(received.get(device, 0), count) for device, count in expected.items()),
+        'missing_devices': len(missing),
+        'mqtt_messages': broker.published,
+        'payload_bytes': payload_bytes,
+        'produce_seconds': round(produced, 3),
+        'elapsed_seconds': round(elapsed, 3),
+        'measurements_per_second': round(total / elapsed, 1) if elapsed else None,
+        'pending': sum(m['pending'] for m in metrics),
+    }
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description = "Multi-scale gateway load test against a local broker")
+    arg_parser.add_argument('--load-test', type = int, default = 300, metavar = 'DEVICES',
+                            help = "Number of simulated scales")
+    arg_parser.add_argument('--measurements', type = int, default = 3, help = "Weigh-ins per simulated scale")
+    arg_parser.add_argument('--pool-size', type = int, default = 2, help = "Gateway MQTT connections")
+    arg_parser.add_argument('--interval', type = float, default = 1.0,
+                            help = "Max seconds between the weigh-ins of one scale")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level = logging.WARNING, format = "%(asctime)-15s %(name)-8s %(levelname)s: %(message)s")
+    report = asyncio.run(load_test(args.load_test, args.measurements, args.pool_size, args.interval))
+    print(json.dumps(report, indent = 2))
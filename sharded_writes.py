@@ -0,0 +1,404 @@
+"""
+Per-process shard files for the measurement history, merged in the background.
+
+Several kiosk processes appending to user_data.csv at once can interleave
+their rows. With sharded writes every process appends to its own shard,
+`<shard_dir>/<csv stem>-<host>-<pid>.csv`, guarded by a file lock that only
+the merger ever competes for. merge_shards() then, holding the lock of the
+canonical CSV:
+
+    1. renames each non-empty shard to `*.merging` (under the shard's lock),
+       so writers start a fresh shard and nothing is read twice;
+    2. drops incomplete rows, sorts the new rows by datetime;
+    3. appends them to the canonical CSV, or, when some are older than rows
+       already there, rewrites the tail from the first later row (within the
+       last 64 KB, like CSVDataManager.amend_row).
+
+Rows older than every row of that window are appended at the end, out of
+datetime order, instead of rewriting the whole file: readers sort by
+datetime anyway, and the bytes before the window never change, which
+parquet_archive.archive_csv relies on (its `settle_bytes` must be at least
+`rewrite_window`).
+
+The new bytes are written to a side file and journaled in `_merge.json`
+before the canonical file is touched, so an interrupted merge is rolled
+forward by the next one and the `*.merging` files are only deleted once
+their rows are in the canonical file.
+
+Usage:
+    python sharded_writes.py merge
+    python sharded_writes.py schedule [--interval 30]
+"""
+import argparse
+import atexit
+import csv
+import io
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from csv_update import CSV_CONFIG, CSVDataManager
+from file_lock import FileLock, LockTimeout
+
+logger = logging.getLogger(__name__)
+
+SHARD_CONFIG = {
+    'shard_dir': 'user_data/shards',
+    'merge_interval': 30.0,  # seconds
+    'lock_timeout': 10.0,  # seconds
+    'fsync': True,  # fsync the shard after every row
+    'rewrite_window': 65536,  # Tail bytes a merge may rewrite in place (see CSVDataManager.amend_row)
+}
+
+MERGE_JOURNAL = '_merge.json'
+MERGE_TAIL = '.merge-tail'
+MERGE_TEMP = '.merge-full.tmp'
+
+
+def _text_encoding(encoding: str) -> str:
+    # Shards and rewritten tails never start the file, so they get no BOM
+    return 'utf-8' if encoding == 'utf-8-sig' else encoding
+
+
+def shard_path(shard_dir, csv_path) -> Path:
+    """Shard file of the current process"""
+    return Path(shard_dir) / f'{Path(csv_path).stem}-{socket.gethostname()}-{os.getpid()}.csv'
+
+
+class ShardWriter:
+    """
+    Appends validated rows to the shard file of this process
+
+    Args:
+        manager: CSVDataManager of the canonical CSV file
+        config: SHARD_CONFIG overrides
+    """
+
+    def __init__(self, manager: Optional[CSVDataManager] = None, config: Dict[str, Any] = None):
+        self.manager = manager or CSVDataManager()
+        self.config = {**SHARD_CONFIG, **(config or {})}
+        self.path = shard_path(self.config['shard_dir'], self.manager.file_path)
+
+    def submit(self, user_info: Dict[str, Any], measurements: Dict[str, Any]) -> Tuple[bool, List[str]]:
+        """
+        Validate a record and append it to the shard
+
+        Returns:
+            Tuple of (success, list_of_messages), like CSVDataManager.update_csv
+        """
+        if self.manager.backend is not None:
+            # Database backends handle concurrent writers themselves
+            return self.manager.update_csv(user_info, measurements)
+
+        is_valid, errors = self.manager.validate_data(user_info, measurements)
+        if not is_valid:
+            return False, errors
+        row = self.manager.prepare_csv_row(user_info, measurements)
+
+        try:
+            self.path.parent.mkdir(parents = True, exist_ok = True)
+            with FileLock(self.path, self.config['lock_timeout']):
+                with open(self.path, mode = 'a', newline = '',
+                          encoding = _text_encoding(self.manager.config['encoding'])) as file:
+                    csv.writer(file).writerow(row)
+                    file.flush()
+                    if self.config['fsync']:
+                        os.fsync(file.fileno())
+        except (OSError, LockTimeout) as e:
+            logger.error(f"Error writing shard {self.path}: {e}")
+            return False, [f"Error writing shard: {e}"]
+        return True, [f"Data saved to shard {self.path.name}"]
+
+
+class ShardMerger:
+    """
+    Merges the shards of one canonical CSV file
+
+    Args:
+        manager: CSVDataManager of the canonical CSV file
+        config: SHARD_CONFIG overrides
+    """
+
+    def __init__(self, manager: Optional[CSVDataManager] = None, config: Dict[str, Any] = None):
+        self.manager = manager or CSVDataManager()
+        self.config = {**SHARD_CONFIG, **(config or {})}
+        self.shard_dir = Path(self.config['shard_dir'])
+        self.canonical = self.manager.file_path
+        self.headers = list(self.manager.headers.keys())
+        self.datetime_column = self.headers.index('datetime')
+        self.text_encoding = _text_encoding(self.manager.config['encoding'])
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _key(self, row: List[str]) -> Optional[datetime]:
+        try:
+            return datetime.strptime(row[self.datetime_column], self.manager.config['date_format'])
+        except (ValueError, IndexError):
+            return None
+
+    def _encode(self, rows: List[List[str]]) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode(self.text_encoding)
+
+    def _claim_shards(self) -> List[Path]:
+        """Rename the non-empty shards to *.merging; returns every file waiting to be merged"""
+        stem = self.canonical.stem
+        for shard in sorted(self.shard_dir.glob(f'{stem}-*.csv')):
+            try:
+                with FileLock(shard, self.config['lock_timeout']):
+                    if shard.exists() and shard.stat().st_size > 0:
+                        os.replace(shard, shard.with_name(f'{shard.name}.{time.time_ns()}.merging'))
+            except (OSError, LockTimeout) as e:
+                logger.warning(f"Skipping shard {shard.name} this round: {e}")
+        return sorted(self.shard_dir.glob(f'{stem}-*.merging'))
+
+    def _read_pending(self, pending: List[Path]) -> List[List[str]]:
+        rows, dropped = [], 0
+        for path in pending:
+            with open(path, 'r', newline = '', encoding = self.text_encoding, errors = 'replace') as file:
+                for row in csv.reader(file):
+                    # Một tiến trình bị dừng giữa lúc ghi có thể để lại hàng dở dang
+                    if len(row) == len(self.headers):
+                        rows.append(row)
+                    elif row:
+                        dropped += 1
+        if dropped:
+            logger.warning(f"Dropped {dropped} incomplete rows from shards")
+        return rows
+
+    def _save_journal(self, journal: Dict[str, Any]) -> None:
+        temp = self.shard_dir / f'.{MERGE_JOURNAL}.tmp'
+        with open(temp, 'w', encoding = 'utf-8') as file:
+            json.dump(journal, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, self.shard_dir / MERGE_JOURNAL)
+
+    def _finish(self, journal: Dict[str, Any]) -> None:
+        """Delete the merged shards, then the journal and its side files"""
+        for name in journal['pending']:
+            (self.shard_dir / name).unlink(missing_ok = True)
+        for name in (MERGE_TAIL, MERGE_TEMP, MERGE_JOURNAL):
+            (self.shard_dir / name).unlink(missing_ok = True)
+
+    def _apply_tail(self, journal: Dict[str, Any]) -> None:
+        with open(self.shard_dir / MERGE_TAIL, 'rb') as file:
+            tail = file.read()
+        with open(self.canonical, 'r+b') as file:
+            file.seek(journal['offset'])
+            file.write(tail)
+            file.truncate()
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _recover(self) -> None:
+        """Roll forward a merge interrupted after its journal was written"""
+        journal_path = self.shard_dir / MERGE_JOURNAL
+        if not journal_path.exists():
+            return
+        with open(journal_path, 'r', encoding = 'utf-8') as file:
+            journal = json.load(file)
+
+        if journal['mode'] == 'full':
+            # Written by earlier versions, which rewrote the whole file for late rows
+            temp = self.shard_dir / MERGE_TEMP
+            if temp.exists():
+                os.replace(temp, self.canonical)
+        elif journal['mode'] == 'tail':
+            with open(self.shard_dir / MERGE_TAIL, 'rb') as file:
+                tail = file.read()
+            with open(self.canonical, 'rb') as file:
+                size = file.seek(0, os.SEEK_END)
+                file.seek(journal['offset'])
+                current = file.read(len(tail))
+            if current != tail:
+                if size == journal['old_size'] or size < journal['offset'] + len(tail):
+                    self._apply_tail(journal)
+                else:
+                    logger.error(f"{self.canonical} changed after an interrupted merge; "
+                                 f"its shards will be merged again")
+                    journal['pending'] = []
+        logger.info(f"Recovered interrupted shard merge into {self.canonical}")
+        self._finish(journal)
+
+    def _merge_sorted(self, existing, new_rows: List[List[str]]):
+        """Yield the existing (sorted) rows with the sorted new rows interleaved by datetime"""
+        index = 0
+        for row in existing:
+            key = self._key(row)
+            if key is not None:
+                while index < len(new_rows) and (self._key(new_rows[index]) or datetime.max) < key:
+                    yield new_rows[index]
+                    index += 1
+            yield row
+        yield from new_rows[index:]
+
+    def _write(self, rows: List[List[str]], pending: List[Path]) -> str:
+        rows.sort(key = lambda row: self._key(row) or datetime.max)
+        names = [path.name for path in pending]
+
+        if not self.manager.file_exists_and_has_content():
+            self.manager.ensure_directory_exists()
+            with open(self.canonical, mode = 'w', newline = '', encoding = self.manager.config['encoding']) as file:
+                writer = csv.writer(file)
+                writer.writerow(self.headers)
+                writer.writerows(rows)
+                file.flush()
+                os.fsync(file.fileno())
+            return 'new'
+
+        with open(self.canonical, 'rb') as file:
+            size = file.seek(0, os.SEEK_END)
+            window_start = max(0, size - self.config['rewrite_window'])
+            file.seek(window_start)
+            data = file.read()
+
+        # Dòng đầu của cửa sổ là tiêu đề hoặc một phần hàng phía trước nên bỏ qua
+        first_row = data.find(b'\n') + 1
+        window_rows = []
+        position = first_row
+        while 0 < position < len(data):
+            end = data.find(b'\n', position)
+            end = len(data) if end < 0 else end
+            row = next(csv.reader([data[position:end].decode(self.text_encoding, errors = 'replace')]), [])
+            window_rows.append((window_start + position, self._key(row)))
+            position = end + 1
+
+        # Rows older than the whole window cannot be put in order without rewriting
+        # bytes before it: they go to the end of the file
+        late = []
+        window_keys = [key for _, key in window_rows if key is not None]
+        if window_start > 0 and window_keys:
+            late = [row for row in rows if (self._key(row) or datetime.max) < window_keys[0]]
+            rows = rows[len(late):]
+            if late:
+                logger.info(f"Appending {len(late)} rows older than the last {self.config['rewrite_window']} "
+                            f"bytes of {self.canonical} out of datetime order")
+
+        # Tìm hàng đầu tiên trong phần đuôi có thời gian sau hàng mới sớm nhất
+        earliest = self._key(rows[0]) if rows else None
+        insert_at = next((offset for offset, key in window_rows
+                          if key is not None and earliest is not None and key > earliest), None)
+
+        if insert_at is None:
+            # Trường hợp thường gặp: mọi hàng mới đều muộn hơn, phần đuôi chỉ là các hàng mới
+            tail = (b'' if data.endswith(b'\n') else b'\n') + self._encode(rows + late)
+            insert_at = size
+        else:
+            with open(self.canonical, 'rb') as file:
+                file.seek(insert_at)
+                text = file.read().decode(self.text_encoding, errors = 'replace')
+            existing = [row for row in csv.reader(io.StringIO(text, newline = '')) if row]
+            tail = self._encode(list(self._merge_sorted(existing, rows)) + late)
+        with open(self.shard_dir / MERGE_TAIL, 'wb') as file:
+            file.write(tail)
+            file.flush()
+            os.fsync(file.fileno())
+        journal = {'mode': 'tail', 'pending': names, 'offset': insert_at, 'old_size': size}
+        self._save_journal(journal)
+        self._apply_tail(journal)
+        return 'append' if insert_at == size else 'tail'
+
+    def merge(self) -> int:
+        """
+        Move the rows of every shard into the canonical CSV, in datetime order
+
+        Returns:
+            Number of rows merged
+        """
+        if not self.shard_dir.exists():
+            return 0
+        with FileLock(self.canonical, self.config['lock_timeout']):
+            self._recover()
+            pending = self._claim_shards()
+            if not pending:
+                return 0
+            rows = self._read_pending(pending)
+            mode = self._write(rows, pending) if rows else None
+            self._finish({'pending': [path.name for path in pending]})
+
+        if rows:
+            logger.info(f"Merged {len(rows)} rows from {len(pending)} shards into {self.canonical} ({mode})")
+        return len(rows)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.config['merge_interval']):
+            try:
+                self.merge()
+            except Exception as e:
+                logger.error(f"Shard merge failed: {e}")
+
+    def start(self) -> 'ShardMerger':
+        """Merge every `merge_interval` seconds in a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target = self._run, name = 'shard-merger', daemon = True)
+            self._thread.start()
+        return self
+
+    def stop(self, final_merge: bool = True) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if final_merge:
+            try:
+                self.merge()
+            except Exception as e:
+                logger.error(f"Final shard merge failed: {e}")
+
+
+def merge_shards(manager: Optional[CSVDataManager] = None, config: Dict[str, Any] = None) -> int:
+    """Merge the shards of a CSV file once (default: the standard history file)"""
+    return ShardMerger(manager, config).merge()
+
+
+_shared_writer = None
+_shared_merger = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_shard_writer() -> ShardWriter:
+    """Process-wide shard writer, with a background merger that also runs at exit"""
+    global _shared_writer, _shared_merger
+    with _shared_lock:
+        if _shared_writer is None:
+            config = {'shard_dir': CSV_CONFIG.get('shard_dir', SHARD_CONFIG['shard_dir'])}
+            _shared_writer = ShardWriter(config = config)
+            _shared_merger = ShardMerger(config = config).start()
+            atexit.register(_shared_merger.stop)
+        return _shared_writer
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description = "Merge per-process CSV shards into the history file")
+    parser.add_argument('command', choices = ['merge', 'schedule'])
+    parser.add_argument('--csv', default = CSV_CONFIG['file_path'])
+    parser.add_argument('--shard-dir', default = CSV_CONFIG.get('shard_dir', SHARD_CONFIG['shard_dir']))
+    parser.add_argument('--interval', type = float, default = SHARD_CONFIG['merge_interval'])
+    args = parser.parse_args(argv)
+
+    manager = CSVDataManager({**CSV_CONFIG, 'file_path': args.csv})
+    merger = ShardMerger(manager, {'shard_dir': args.shard_dir, 'merge_interval': args.interval})
+    if args.command == 'merge':
+        print(f"Merged {merger.merge()} rows")
+    else:
+        merger.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            merger.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level = logging.INFO, format = '%(levelname)s: %(message)s')
+    sys.exit(main())
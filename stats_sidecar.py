@@ -0,0 +1,239 @@
+"""
+Aggregate statistics of the CSV history kept in a small sidecar file.
+
+get_statistics used to parse the whole CSV for a row count, the number of
+users and the date range. StatisticsSidecar keeps those aggregates, plus
+per-user counts and last-seen times, in `<csv>.stats.json` together with
+the byte offset of the CSV they cover. Writers do not touch the sidecar:
+get_statistics brings it up to date by parsing only the rows appended after
+that offset, so a poll that finds nothing new just stats the file and reads
+the sidecar.
+
+A fingerprint of the last bytes covered detects a CSV that was rewritten
+(fix_csv_file, a restore, another process amending rows); the sidecar is
+then rebuilt with one streaming pass that reads `chunk_bytes` at a time.
+Rows whose datetime cannot be parsed are counted but do not affect the date
+range.
+"""
+import csv
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+SIDECAR_VERSION = 1
+FINGERPRINT_BYTES = 4096
+CHUNK_BYTES = 1 << 20  # Bytes of CSV parsed at a time
+
+
+def sidecar_path_for(csv_path) -> Path:
+    csv_path = Path(csv_path)
+    return csv_path.with_name(f'{csv_path.stem}.stats.json')
+
+
+class StatisticsSidecar:
+    """
+    Incrementally maintained aggregates of one CSV history file
+
+    Args:
+        csv_path: CSV file written by CSVDataManager
+        encoding: Encoding of the CSV file
+        date_format: strftime format of the datetime column
+        chunk_bytes: Bytes of CSV read and parsed at a time
+    """
+
+    def __init__(self, csv_path, encoding: str = 'utf-8-sig', date_format: str = "%d/%m/%Y %H:%M",
+                 chunk_bytes: int = CHUNK_BYTES):
+        self.csv_path = Path(csv_path)
+        self.path = sidecar_path_for(csv_path)
+        self.encoding = 'utf-8' if encoding == 'utf-8-sig' else encoding
+        self.date_format = date_format
+        self.chunk_bytes = chunk_bytes
+        self._lock = threading.Lock()
+        self.state = None
+
+    def _empty_state(self) -> Dict[str, Any]:
+        return {'version': SIDECAR_VERSION, 'offset': 0, 'fingerprint': None, 'columns': None,
+                'total_records': 0, 'unparsed_datetimes': 0, 'earliest': None, 'latest': None, 'users': {}}
+
+    def _fingerprint(self, file, offset: int) -> str:
+        start = max(0, offset - FINGERPRINT_BYTES)
+        file.seek(start)
+        return hashlib.sha256(file.read(offset - start)).hexdigest()
+
+    def _load(self) -> Dict[str, Any]:
+        if self.state is None and self.path.exists():
+            try:
+                with open(self.path, 'r', encoding = 'utf-8') as file:
+                    state = json.load(file)
+                if state.get('version') == SIDECAR_VERSION:
+                    self.state = state
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable statistics sidecar {self.path}: {e}")
+        if self.state is None:
+            self.state = self._empty_state()
+        return self.state
+
+    def _save(self) -> None:
+        temp = self.path.with_name(f'.{self.path.name}.tmp')
+        with open(temp, 'w', encoding = 'utf-8') as file:
+            json.dump(self.state, file, ensure_ascii = False)
+        os.replace(temp, self.path)
+
+    def _consume(self, file, state: Dict[str, Any], end: int) -> int:
+        """
+        Add the complete rows between state['offset'] and `end` to the aggregates
+
+        The file is read `chunk_bytes` at a time; a line cut by the chunk end is
+        carried over to the next chunk. The offset and fingerprint advance after
+        every chunk, so the state stays consistent if a later chunk fails.
+        """
+        added = 0
+        position = state['offset']
+        carry = b''
+        file.seek(position)
+        while position < end:
+            data = file.read(min(self.chunk_bytes, end - position))
+            if not data:
+                break
+            position += len(data)
+            data = carry + data
+            complete = data.rfind(b'\n') + 1
+            carry = data[complete:]
+            if complete == 0:
+                continue
+
+            added += self._add_lines(state, data[:complete].decode(self.encoding).split('\n')[:-1])
+            state['offset'] += complete
+            state['fingerprint'] = self._fingerprint(file, state['offset'])
+            file.seek(position)
+        return added
+
+    def _add_lines(self, state: Dict[str, Any], lines) -> int:
+        if state['columns'] is None:
+            state['columns'] = next(csv.reader([lines.pop(0).lstrip('\ufeff')]), [])
+        name_column = state['columns'].index('name') if 'name' in state['columns'] else None
+        datetime_column = state['columns'].index('datetime') if 'datetime' in state['columns'] else None
+
+        added = 0
+        users = state['users']
+        for row in csv.reader(lines):
+            if not row:
+                continue
+            added += 1
+            measured_at = None
+            if datetime_column is not None and datetime_column < len(row):
+                try:
+                    measured_at = datetime.strptime(row[datetime_column], self.date_format).isoformat()
+                except ValueError:
+                    pass
+            if measured_at is None:
+                state['unparsed_datetimes'] += 1
+            else:
+                # Chuỗi ISO so sánh được trực tiếp theo thời gian
+                state['earliest'] = min(state['earliest'] or measured_at, measured_at)
+                state['latest'] = max(state['latest'] or measured_at, measured_at)
+
+            name = row[name_column] if name_column is not None and name_column < len(row) else ''
+            if name:
+                user = users.setdefault(name, {'count': 0, 'last_seen': None})
+                user['count'] += 1
+                if measured_at is not None:
+                    user['last_seen'] = max(user['last_seen'] or measured_at, measured_at)
+
+        state['total_records'] += added
+        return added
+
+    def refresh(self) -> Dict[str, Any]:
+        """Bring the aggregates up to date with the CSV file and return them"""
+        with self._lock:
+            state = self._load()
+            if not self.csv_path.exists():
+                if state['offset']:
+                    self.state = self._empty_state()
+                    self._save()
+                return self.state
+
+            with open(self.csv_path, 'rb') as file:
+                size = file.seek(0, os.SEEK_END)
+                if state['offset'] and (size < state['offset'] or
+                                        self._fingerprint(file, state['offset']) != state['fingerprint']):
+                    logger.info(f"{self.csv_path} changed outside the sidecar, rebuilding statistics")
+                    state = self.state = self._empty_state()
+                if size == state['offset']:
+                    return state
+
+                try:
+                    self._consume(file, state, size)
+                finally:
+                    # Lưu phần đã đọc xong kể cả khi một khối sau bị lỗi
+                    self._save()
+            return state
+
+    def rebase(self, old_size: int) -> None:
+        """
+        Accept an in-place rewrite of rows already counted (CSVDataManager.amend_row)
+
+        Only call this when the rewrite left every counted datetime and name
+        unchanged. If the sidecar covered exactly `old_size` bytes it moves to
+        the new end of the file; otherwise the next refresh rebuilds.
+        """
+        with self._lock:
+            state = self._load()
+            if state['offset'] != old_size or not self.csv_path.exists():
+                return
+            with open(self.csv_path, 'rb') as file:
+                state['offset'] = file.seek(0, os.SEEK_END)
+                state['fingerprint'] = self._fingerprint(file, state['offset'])
+            self._save()
+
+    def statistics(self, include_users: bool = False) -> Dict[str, Any]:
+        """
+        Statistics in the format of CSVDataManager.get_statistics
+
+        Args:
+            include_users: Add 'users': {name: {'count', 'last_seen'}}
+        """
+        state = self.refresh()
+        if not state['total_records']:
+            return {'total_records': 0, 'unique_users': 0, 'date_range': None}
+
+        stats = {
+            'total_records': state['total_records'],
+            'unique_users': len(state['users']),
+            'columns': list(state['columns']),
+            'date_range': None
+        }
+        if state['earliest']:
+            stats['date_range'] = {
+                'earliest': datetime.fromisoformat(state['earliest']).strftime(self.date_format),
+                'latest': datetime.fromisoformat(state['latest']).strftime(self.date_format)
+            }
+        if include_users:
+            stats['users'] = {
+                name: {'count': user['count'],
+                       'last_seen': datetime.fromisoformat(user['last_seen']).strftime(self.date_format)
+                       if user['last_seen'] else None}
+                for name, user in state['users'].items()
+            }
+        return stats
+
+
+_sidecars: Dict[str, StatisticsSidecar] = {}
+_sidecars_lock = threading.Lock()
+
+
+def get_sidecar(csv_path, encoding: str = 'utf-8-sig', date_format: str = "%d/%m/%Y %H:%M") -> StatisticsSidecar:
+    """Process-wide sidecar for a CSV file"""
+    key = str(Path(csv_path).resolve())
+    with _sidecars_lock:
+        sidecar = _sidecars.get(key)
+        if sidecar is None:
+            sidecar = _sidecars[key] = StatisticsSidecar(csv_path, encoding, date_format)
+        return sidecar
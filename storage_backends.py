@@ -0,0 +1,377 @@
+"""
+Storage backends for CSVDataManager.
+
+The CSV file stays the default store and is handled by CSVDataManager itself.
+A backend configured with CSV_CONFIG['backend'] takes over appending,
+amending and reading rows while CSVDataManager keeps its public methods:
+
+    'sqlite'  SQLite database in WAL mode, indexed on cccd_id, name and datetime,
+              so per-user history lookups do not scan the whole history.
+
+The first time the SQLite backend is used next to an existing CSV file, the
+CSV history is migrated into the database once (see migrate_from_csv).
+
+create_backend keeps one backend per database file for the whole process, so
+every CSVDataManager shares its connections and the schema is created once;
+they are closed at exit (see close_backends).
+"""
+import abc
+import atexit
+import csv
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+SQLITE_CONFIG = {
+    'table': 'measurements',
+    'migration_batch_size': 10000,
+    'busy_timeout_ms': 5000,
+}
+
+# CSV columns stored as text; every other column gets NUMERIC affinity
+TEXT_COLUMNS = ('datetime', 'name', 'gender', 'dob', 'cccd_id', 'address')
+
+
+class StorageBackend(abc.ABC):
+    """
+    Interface of a measurement store
+
+    Rows are lists of CSV cell strings in the order of `headers`, exactly as
+    produced by CSVDataManager.prepare_csv_row.
+    """
+
+    def __init__(self, headers: List[str], date_format: str):
+        self.headers = list(headers)
+        self.date_format = date_format
+
+    @abc.abstractmethod
+    def append_row(self, row: List[Any]) -> None:
+        raise NotImplementedError
+
+    def append_rows(self, rows: List[List[Any]]) -> None:
+        for row in rows:
+            self.append_row(row)
+
+    @abc.abstractmethod
+    def amend_row(self, row_datetime: str, name: str, updates: Dict[str, Any]) -> bool:
+        """Update columns of the most recent row with this datetime and name"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def read_all(self) -> pd.DataFrame:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def user_history(self, name: str, limit: Optional[int] = None) -> pd.DataFrame:
+        """Rows of a user (case-insensitive name), most recent first"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def user_rows_after(self, name: str, after_id: int = 0) -> Tuple[pd.DataFrame, int]:
+        """
+        Rows of a user stored after row id `after_id`, in insertion order
+
+        Returns:
+            (DataFrame, id of the user's last row or `after_id` if there is none)
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def statistics(self, include_users: bool = False) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def has_content(self) -> bool:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def backup(self) -> Optional[Path]:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Release the connections or files held by the backend"""
+
+
+class SQLiteStorageBackend(StorageBackend):
+    """
+    SQLite measurement store
+
+    Besides the CSV columns every row stores `name_key` (lower-cased name,
+    SQLite's NOCASE only folds ASCII) and `measured_at` (ISO datetime, which
+    sorts correctly unlike dd/mm/YYYY). Each thread gets its own connection;
+    close() closes all of them.
+
+    Args:
+        db_path: Database file
+        headers: CSV headers, in column order
+        date_format: strftime format of the datetime column
+        config: SQLITE_CONFIG overrides
+    """
+
+    def __init__(self, db_path, headers: List[str], date_format: str, config: Dict[str, Any] = None):
+        super().__init__(headers, date_format)
+        self.db_path = Path(db_path)
+        self.config = {**SQLITE_CONFIG, **(config or {})}
+        self.table = self.config['table']
+        self._name_index = self.headers.index('name')
+        self._datetime_index = self.headers.index('datetime')
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._create_schema()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            self.db_path.parent.mkdir(parents = True, exist_ok = True)
+            # Mỗi kết nối chỉ được luồng tạo ra nó dùng; check_same_thread=False để close() đóng được từ luồng khác
+            connection = sqlite3.connect(self.db_path, timeout = self.config['busy_timeout_ms'] / 1000,
+                                         check_same_thread = False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # Với WAL, NORMAL vẫn an toàn khi mất điện (chỉ có thể mất giao dịch cuối)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def close(self) -> None:
+        """Close the connections of every thread; a thread that uses the backend again reconnects"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+            # Luồng khác sẽ thấy kết nối đã đóng qua _local, nên dùng một _local mới
+            self._local = threading.local()
+        for connection in connections:
+            connection.close()
+
+    def _create_schema(self) -> None:
+        columns = ', '.join(f'"{header}" {"TEXT" if header in TEXT_COLUMNS else "NUMERIC"}'
+                            for header in self.headers)
+        connection = self._connection()
+        with connection:
+            connection.execute(f'CREATE TABLE IF NOT EXISTS {self.table} ('
+                               f'id INTEGER PRIMARY KEY, {columns}, name_key TEXT, measured_at TEXT)')
+            connection.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_name '
+                               f'ON {self.table} (name_key, measured_at)')
+            connection.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_cccd '
+                               f'ON {self.table} (cccd_id, measured_at)')
+            connection.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_datetime '
+                               f'ON {self.table} (measured_at)')
+            connection.execute('CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT)')
+
+    def _iso_datetime(self, value: str) -> Optional[str]:
+        try:
+            return datetime.strptime(value, self.date_format).strftime('%Y-%m-%d %H:%M:%S')
+        except (TypeError, ValueError):
+            return None
+
+    def _record(self, row: List[Any]) -> List[Any]:
+        # Ô trống trong CSV tương ứng với NULL
+        values = [None if value == '' else value for value in row]
+        return values + [str(row[self._name_index]).lower(), self._iso_datetime(row[self._datetime_index])]
+
+    def _insert_sql(self) -> str:
+        columns = ', '.join(f'"{header}"' for header in self.headers)
+        placeholders = ', '.join('?' * (len(self.headers) + 2))
+        return f'INSERT INTO {self.table} ({columns}, name_key, measured_at) VALUES ({placeholders})'
+
+    def append_row(self, row: List[Any]) -> None:
+        connection = self._connection()
+        with connection:
+            connection.execute(self._insert_sql(), self._record(row))
+
+    def append_rows(self, rows: List[List[Any]]) -> None:
+        connection = self._connection()
+        with connection:
+            connection.executemany(self._insert_sql(), [self._record(row) for row in rows])
+
+    def amend_row(self, row_datetime: str, name: str, updates: Dict[str, Any]) -> bool:
+        unknown = set(updates) - set(self.headers)
+        if unknown:
+            logger.error(f"Cannot amend unknown columns: {sorted(unknown)}")
+            return False
+
+        assignments = ', '.join(f'"{header}" = ?' for header in updates)
+        values = [round(value, 2) if isinstance(value, float) else value for value in updates.values()]
+        connection = self._connection()
+        with connection:
+            cursor = connection.execute(
+                f'UPDATE {self.table} SET {assignments} WHERE id = ('
+                f'SELECT id FROM {self.table} WHERE name_key = ? AND "datetime" = ? AND name = ? '
+                f'ORDER BY id DESC LIMIT 1)',
+                values + [name.lower(), row_datetime, name])
+        return cursor.rowcount > 0
+
+    def _query(self, where: str = '', params: tuple = (), order: str = 'id', limit: Optional[int] = None) -> pd.DataFrame:
+        columns = ', '.join(f'"{header}"' for header in self.headers)
+        sql = f'SELECT {columns} FROM {self.table} {where} ORDER BY {order}'
+        if limit and limit > 0:
+            sql += f' LIMIT {int(limit)}'
+        return self._frame(self._connection().execute(sql, params).fetchall())
+
+    def _frame(self, rows: List[tuple]) -> pd.DataFrame:
+        df = pd.DataFrame.from_records(rows, columns = self.headers)
+        # NULL -> NaN in numeric columns, like pd.read_csv
+        for header in self.headers:
+            if header not in TEXT_COLUMNS:
+                df[header] = pd.to_numeric(df[header])
+        return df
+
+    def read_all(self) -> pd.DataFrame:
+        if not self.has_content():
+            return pd.DataFrame()
+        return self._query()
+
+    def user_history(self, name: str, limit: Optional[int] = None) -> pd.DataFrame:
+        return self._query('WHERE name_key = ?', (name.lower(),), 'measured_at DESC, id DESC', limit)
+
+    def user_rows_after(self, name: str, after_id: int = 0) -> Tuple[pd.DataFrame, int]:
+        columns = ', '.join(f'"{header}"' for header in self.headers)
+        rows = self._connection().execute(
+            f'SELECT id, {columns} FROM {self.table} WHERE name_key = ? AND id > ? ORDER BY id',
+            (name.lower(), after_id)).fetchall()
+        if not rows:
+            return pd.DataFrame(columns = self.headers), after_id
+        df = self._frame([row[1:] for row in rows])
+        return df, rows[-1][0]
+
+    def cccd_history(self, cccd_id: str, limit: Optional[int] = None) -> pd.DataFrame:
+        """Rows of a CCCD number, most recent first"""
+        return self._query('WHERE cccd_id = ?', (str(cccd_id),), 'measured_at DESC, id DESC', limit)
+
+    def statistics(self, include_users: bool = False) -> Dict[str, Any]:
+        total, users, earliest, latest = self._connection().execute(
+            f'SELECT COUNT(*), COUNT(DISTINCT name), MIN(measured_at), MAX(measured_at) FROM {self.table}'
+        ).fetchone()
+        stats = {'total_records': total, 'unique_users': users, 'date_range': None}
+        if total:
+            stats['columns'] = list(self.headers)
+        if earliest:
+            stats['date_range'] = {
+                'earliest': datetime.fromisoformat(earliest).strftime(self.date_format),
+                'latest': datetime.fromisoformat(latest).strftime(self.date_format),
+            }
+        if include_users:
+            rows = self._connection().execute(
+                f'SELECT name, COUNT(*), MAX(measured_at) FROM {self.table} WHERE name IS NOT NULL GROUP BY name')
+            stats['users'] = {
+                name: {'count': count,
+                       'last_seen': datetime.fromisoformat(last_seen).strftime(self.date_format) if last_seen else None}
+                for name, count, last_seen in rows
+            }
+        return stats
+
+    def has_content(self) -> bool:
+        return self._connection().execute(f'SELECT 1 FROM {self.table} LIMIT 1').fetchone() is not None
+
+    def backup(self) -> Optional[Path]:
+        """Consistent copy of the database made with the SQLite online backup API"""
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        backup_path = self.db_path.with_suffix(f'.backup_{timestamp}.db')
+        destination = sqlite3.connect(backup_path)
+        try:
+            self._connection().backup(destination)
+        finally:
+            destination.close()
+        logger.info(f"Backup created: {backup_path}")
+        return backup_path
+
+    def migrate_from_csv(self, csv_path, encoding: str = 'utf-8-sig') -> int:
+        """
+        Copy the rows of a CSV history file into the database, once
+
+        The migration is recorded in the metadata table and skipped on later
+        calls. Columns are matched by header name; rows with the wrong number
+        of cells are skipped.
+
+        Returns:
+            Number of rows migrated (0 if already migrated or no CSV)
+        """
+        csv_path = Path(csv_path)
+        connection = self._connection()
+        key = f'migrated:{csv_path.resolve()}'
+        if connection.execute('SELECT 1 FROM metadata WHERE key = ?', (key,)).fetchone():
+            return 0
+        if not csv_path.exists() or csv_path.stat().st_size == 0:
+            return 0
+
+        insert_sql = self._insert_sql()
+        migrated = skipped = 0
+        with open(csv_path, 'r', encoding = encoding, newline = '') as file, connection:
+            reader = csv.reader(file)
+            file_headers = next(reader, [])
+            positions = [file_headers.index(header) if header in file_headers else None
+                         for header in self.headers]
+
+            batch = []
+            for row in reader:
+                if not row:
+                    continue
+                if len(row) != len(file_headers):
+                    skipped += 1
+                    continue
+                batch.append(self._record([row[i] if i is not None else '' for i in positions]))
+                if len(batch) >= self.config['migration_batch_size']:
+                    connection.executemany(insert_sql, batch)
+                    migrated += len(batch)
+                    batch = []
+            connection.executemany(insert_sql, batch)
+            migrated += len(batch)
+
+            connection.execute('INSERT INTO metadata (key, value) VALUES (?, ?)',
+                               (key, f'{migrated} rows at {datetime.now().isoformat(timespec = "seconds")}'))
+
+        logger.info(f"Migrated {migrated} rows from {csv_path} to {self.db_path} ({skipped} malformed rows skipped)")
+        return migrated
+
+
+BACKENDS = {
+    'sqlite': SQLiteStorageBackend,
+}
+
+
+_backends: Dict[tuple, StorageBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def create_backend(config: Dict[str, Any], headers: List[str]) -> Optional[StorageBackend]:
+    """
+    Return the backend selected by config['backend'] ('csv' means none)
+
+    Backends are shared per database file: the first call creates the backend
+    (and its schema), later calls for the same file return it. The SQLite
+    backend migrates the CSV file at config['file_path'] on first use.
+    """
+    name = config.get('backend', 'csv')
+    if name == 'csv':
+        return None
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown storage backend: {name}")
+
+    key = (name, str(Path(config['database_path']).resolve()), tuple(headers), config['date_format'])
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            backend = BACKENDS[name](config['database_path'], headers, config['date_format'])
+            if not _backends:
+                atexit.register(close_backends)
+            _backends[key] = backend
+        # Đã di chuyển thì chỉ tốn một truy vấn vào bảng metadata
+        backend.migrate_from_csv(config['file_path'], config['encoding'])
+        return backend
+
+
+def close_backends() -> None:
+    """Close every shared backend (registered to run at exit)"""
+    with _backends_lock:
+        backends = list(_backends.values())
+        _backends.clear()
+    for backend in backends:
+        backend.close()
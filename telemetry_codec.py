@@ -0,0 +1,174 @@
+"""
+Compact binary encoding of body-composition telemetry.
+
+A measurement published as JSON (calculate_body_metrics) takes about 200
+bytes; the same values as scaled integers in a fixed struct layout take 35.
+Every binary payload starts with a schema byte, so the layout can change
+without breaking decoders of older kiosks. JSON payloads start with '{' or
+'[', which no schema byte uses, so decode_payload() accepts both.
+
+Single measurement (schema 1):
+    B      schema version
+    H      presence bitmap: bit i set = FIELDS[1][i] follows; bit 15 = extras follow
+    ...    the present fields in FIELDS order, each its struct format, value * scale
+    H + n  (extras) UTF-8 JSON object of every key that has no field or does not fit
+
+Batch of measurements (the coalesced catch-up message of the outbound queue):
+    B      0x80 | schema version
+    Q      timestamp of the first entry (ms since the epoch)
+    H      number of entries
+    then per entry: I milliseconds after the first entry, followed by a
+    measurement without its schema byte
+
+decode_payload() returns the dict, or for a batch the ThingsBoard list
+[{"ts": ..., "values": {...}}] that the JSON encoding would have produced.
+"""
+import json
+import math
+import struct
+from typing import Any, Dict, List, Tuple, Union
+
+SCHEMA_VERSION = 1
+BATCH_FLAG = 0x80
+EXTRAS_BIT = 1 << 15
+
+# (key, struct format, scale) per schema; values are rounded to 2 decimals by calc_body_composition
+FIELDS = {
+    1: [
+        ('gender', 'B', None),
+        ('weight', 'H', 100),
+        ('age', 'B', 1),
+        ('bmi', 'H', 100),
+        ('bmr', 'I', 100),
+        ('tdee', 'I', 100),
+        ('lbm', 'H', 100),
+        ('fp', 'H', 100),
+        ('wp', 'H', 100),
+        ('bm', 'H', 100),
+        ('ms', 'H', 100),
+        ('pp', 'H', 100),
+        ('vf', 'H', 100),
+        ('iw', 'H', 100),
+        ('ols', 'H', 10),
+    ],
+}
+
+GENDER_CODES = {'male': 0, 'nam': 0, 'm': 0, 'female': 1, 'nữ': 1, 'f': 1}
+GENDER_NAMES = {0: 'male', 1: 'female'}
+
+BATCH_HEADER = struct.Struct('<BQH')
+ENTRY_OFFSET = struct.Struct('<I')
+LENGTH = struct.Struct('<H')
+
+# Compiled (key, Struct, scale) per schema version
+_LAYOUTS = {version: [(key, struct.Struct('<' + fmt), scale) for key, fmt, scale in fields]
+            for version, fields in FIELDS.items()}
+
+
+def _pack_value(value: Any, packer: struct.Struct, scale) -> bytes:
+    """Packed field value, or None when the value cannot be represented exactly"""
+    if scale is None:
+        code = GENDER_CODES.get(value.lower()) if isinstance(value, str) else None
+        return None if code is None else packer.pack(code)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        return None
+    scaled = round(value * scale)
+    # Chỉ mã hoá khi giải mã lại đúng giá trị ban đầu (làm tròn 2 chữ số)
+    if abs(scaled / scale - value) > 1e-9 * max(1.0, abs(value)):
+        return None
+    try:
+        return packer.pack(scaled)
+    except struct.error:
+        return None
+
+
+def _encode_body(values: Dict[str, Any], version: int) -> bytes:
+    bitmap = 0
+    parts = []
+    extras = dict(values)
+    for bit, (key, packer, scale) in enumerate(_LAYOUTS[version]):
+        value = values.get(key)
+        if value is None:
+            continue
+        packed = _pack_value(value, packer, scale)
+        if packed is not None:
+            bitmap |= 1 << bit
+            parts.append(packed)
+            del extras[key]
+    if extras:
+        text = json.dumps(extras, ensure_ascii = False, separators = (',', ':')).encode('utf-8')
+        bitmap |= EXTRAS_BIT
+        parts.append(LENGTH.pack(len(text)) + text)
+    return LENGTH.pack(bitmap) + b''.join(parts)
+
+
+def _decode_body(data: bytes, position: int, version: int) -> Tuple[Dict[str, Any], int]:
+    (bitmap,), position = LENGTH.unpack_from(data, position), position + LENGTH.size
+    values = {}
+    for bit, (key, unpacker, scale) in enumerate(_LAYOUTS[version]):
+        if not bitmap & (1 << bit):
+            continue
+        (raw,) = unpacker.unpack_from(data, position)
+        position += unpacker.size
+        if scale is None:
+            values[key] = GENDER_NAMES[raw]
+        elif scale == 1:
+            values[key] = raw
+        else:
+            values[key] = round(raw / scale, 2)
+    if bitmap & EXTRAS_BIT:
+        (length,) = LENGTH.unpack_from(data, position)
+        position += LENGTH.size
+        values.update(json.loads(data[position:position + length].decode('utf-8')))
+        position += length
+    return values, position
+
+
+def encode_measurement(values: Dict[str, Any], version: int = SCHEMA_VERSION) -> bytes:
+    """Binary payload of one (possibly partial) metrics dictionary"""
+    return bytes([version]) + _encode_body(values, version)
+
+
+def encode_batch(entries: List[Tuple[int, Dict[str, Any]]], version: int = SCHEMA_VERSION) -> bytes:
+    """Binary payload of [(timestamp ms, values), ...], oldest first"""
+    base = entries[0][0]
+    parts = [BATCH_HEADER.pack(BATCH_FLAG | version, base, len(entries))]
+    for ts, values in entries:
+        if not 0 <= ts - base <= 0xFFFFFFFF:
+            raise ValueError("Batch entries must be in time order and span less than 49 days")
+        parts.append(ENTRY_OFFSET.pack(ts - base) + _encode_body(values, version))
+    return b''.join(parts)
+
+
+def decode_payload(data: Union[bytes, str]) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Decode a telemetry payload in any supported encoding (JSON or a binary schema)
+
+    Raises:
+        ValueError: Unknown schema version or truncated payload
+    """
+    if isinstance(data, str):
+        return json.loads(data)
+    if data[:1] in (b'{', b'['):
+        return json.loads(data.decode('utf-8'))
+    if not data:
+        raise ValueError("Empty telemetry payload")
+
+    version = data[0] & ~BATCH_FLAG
+    if version not in FIELDS:
+        raise ValueError(f"Unknown telemetry schema version {version}")
+    try:
+        if not data[0] & BATCH_FLAG:
+            values, _ = _decode_body(data, 1, version)
+            return values
+
+        _, base, count = BATCH_HEADER.unpack_from(data)
+        position = BATCH_HEADER.size
+        entries = []
+        for _ in range(count):
+            (offset,) = ENTRY_OFFSET.unpack_from(data, position)
+            values, position = _decode_body(data, position + ENTRY_OFFSET.size, version)
+            entries.append({'ts': base + offset, 'values': values})
+        return entries
+    except struct.error as e:
+        raise ValueError(f"Truncated telemetry payload: {e}") from e
@@ -0,0 +1,436 @@
+"""
+Disk-backed outbound queue for MQTT telemetry.
+
+MQTTClient.publish appends every message to an append-only segment log
+(`<queue_dir>/seg-<first seq>.log`) and returns; QueueDrainer sends the log
+to the broker from a background thread and an entry only counts as sent
+once the broker acknowledged it (PUBACK for QoS 1/2, written to the socket
+for QoS 0). Nothing is lost when the uplink is down or the process dies:
+on restart the drainer resumes after the last acknowledged entry, so a
+message may be delivered twice but never dropped.
+
+Records are framed as <length><crc32><json>, so a record torn by a crash is
+detected and cut off when the log is reopened. `cursor.json` holds the
+highest sequence number up to which everything was acknowledged; segments
+entirely below it are deleted.
+
+When catching up, the drainer reads `batch_size` entries at a time and keeps
+at most `max_inflight` messages unacknowledged. Entries of the same
+ThingsBoard telemetry topic (`coalesce_topics`) are combined into one
+message, `[{"ts": ..., "values": {...}}, ...]`, which also keeps the time
+each measurement was taken instead of the time it reached the server.
+Entries of a gateway telemetry topic (`gateway_topics`, payload
+`{"<device>": {...}}`) are merged across devices the same way, into
+`{"<device>": [{"ts": ..., "values": {...}}, ...], ...}`.
+"""
+import bisect
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+QUEUE_CONFIG = {
+    'queue_dir': 'user_data/mqtt_queue',
+    'segment_bytes': 1 << 20,
+    'fsync': True,  # fsync each appended message
+    'batch_size': 50,  # Entries read from the log per step
+    'max_inflight': 20,  # Unacknowledged messages on the wire
+    'coalesce_topics': ('v1/devices/me/telemetry',),
+    'gateway_topics': ('v1/gateway/telemetry',),
+    'wire_encoding': 'json',  # 'json' or 'binary' (telemetry_codec) for the coalesce_topics
+    'live_seconds': 5.0,  # A lone entry younger than this is sent in its original format
+    'cursor_interval': 1.0,  # seconds between cursor saves while acknowledgements arrive
+    'retry_interval': 2.0,  # seconds between checks while the broker is unreachable
+}
+
+HEADER = struct.Struct('<II')  # body length, crc32 of body
+CURSOR_FILE = 'cursor.json'
+
+# paho.mqtt return codes (kept here so the queue itself does not need paho)
+MQTT_ERR_SUCCESS = 0
+MQTT_ERR_NO_CONN = 4
+
+
+class QueueEntry:
+    __slots__ = ('seq', 'ts', 'topic', 'payload', 'qos')
+
+    def __init__(self, seq: int, ts: int, topic: str, payload: str, qos: int):
+        self.seq = seq
+        self.ts = ts  # milliseconds since the epoch, when the entry was queued
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+
+
+class TelemetryQueue:
+    """
+    Append-only segment log of outbound messages
+
+    Args:
+        queue_dir: Directory of the segment files
+        config: QUEUE_CONFIG overrides
+    """
+
+    def __init__(self, queue_dir=None, config: Dict[str, Any] = None):
+        self.config = {**QUEUE_CONFIG, **(config or {})}
+        self.queue_dir = Path(queue_dir or self.config['queue_dir'])
+        self.queue_dir.mkdir(parents = True, exist_ok = True)
+        self._lock = threading.Lock()
+        self.new_entries = threading.Condition(self._lock)
+
+        self._acked = set()  # Acknowledged sequence numbers above acked_through
+        self.on_ack: Optional[Callable[[List[int]], Any]] = None  # Called with the seqs of every ack()
+        self._cursor_saved = 0.0
+        self.acked_through = self._load_cursor()
+        self.segments: List[int] = sorted(int(path.stem[4:]) for path in self.queue_dir.glob('seg-*.log'))
+        self.next_seq = self._recover_tail()
+        self.acked_through = max(self.acked_through, self.segments[0] - 1 if self.segments else self.next_seq - 1)
+        self._file = None
+        self._positions: Dict[int, Tuple[int, int]] = {}  # seq -> (segment, byte offset) of the last read
+
+    def _segment_path(self, first_seq: int) -> Path:
+        return self.queue_dir / f'seg-{first_seq:012d}.log'
+
+    def _load_cursor(self) -> int:
+        try:
+            with open(self.queue_dir / CURSOR_FILE, 'r', encoding = 'utf-8') as file:
+                return int(json.load(file)['acked_through'])
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def _save_cursor(self) -> None:
+        temp = self.queue_dir / f'.{CURSOR_FILE}.tmp'
+        with open(temp, 'w', encoding = 'utf-8') as file:
+            json.dump({'acked_through': self.acked_through}, file)
+        os.replace(temp, self.queue_dir / CURSOR_FILE)
+        self._cursor_saved = time.monotonic()
+
+    def _scan(self, file, offset: int, seq: int):
+        """Yield (offset, end, seq, body) of the intact records of a segment file from `offset` on"""
+        file.seek(offset)
+        while True:
+            header = file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            length, crc = HEADER.unpack(header)
+            body = file.read(length)
+            if len(body) < length or zlib.crc32(body) != crc:
+                return
+            end = offset + HEADER.size + length
+            yield offset, end, seq, body
+            offset, seq = end, seq + 1
+
+    def _recover_tail(self) -> int:
+        """Cut a record torn by a crash off the last segment; returns the next sequence number"""
+        if not self.segments:
+            return self.acked_through + 1
+        first_seq = self.segments[-1]
+        path = self._segment_path(first_seq)
+        end, next_seq = 0, first_seq
+        with open(path, 'rb') as file:
+            for _, end, seq, _ in self._scan(file, 0, first_seq):
+                next_seq = seq + 1
+        if end < path.stat().st_size:
+            logger.warning(f"Truncating torn record at byte {end} of {path.name}")
+            with open(path, 'r+b') as file:
+                file.truncate(end)
+        return next_seq
+
+    def append(self, topic: str, payload: str, qos: int = 1) -> int:
+        """Add a message to the log; returns its sequence number"""
+        with self._lock:
+            seq = self.next_seq
+            body = json.dumps({'ts': int(time.time() * 1000), 'topic': topic, 'payload': payload, 'qos': qos},
+                              ensure_ascii = False).encode('utf-8')
+            if self._file is None or self._file.tell() >= self.config['segment_bytes']:
+                self._rotate(seq)
+            self._file.write(HEADER.pack(len(body), zlib.crc32(body)) + body)
+            self._file.flush()
+            if self.config['fsync']:
+                os.fsync(self._file.fileno())
+            self.next_seq = seq + 1
+            self.new_entries.notify_all()
+            return seq
+
+    def _rotate(self, seq: int) -> None:
+        if self._file is not None:
+            self._file.close()
+        # Nối tiếp segment cuối nếu còn chỗ, nếu không thì mở segment mới
+        if self.segments and self._segment_path(self.segments[-1]).stat().st_size < self.config['segment_bytes']:
+            path = self._segment_path(self.segments[-1])
+        else:
+            self.segments.append(seq)
+            path = self._segment_path(seq)
+        self._file = open(path, 'ab')
+
+    def read(self, from_seq: int, limit: int) -> List[QueueEntry]:
+        """Up to `limit` entries starting at sequence number `from_seq`"""
+        with self._lock:
+            if from_seq >= self.next_seq or not self.segments:
+                return []
+            if self._file is not None:
+                self._file.flush()
+
+            # Vị trí đã biết từ lần đọc trước giúp không phải quét lại segment từ đầu
+            if from_seq in self._positions:
+                segment, offset = self._positions[from_seq]
+                seq = from_seq
+            else:
+                segment = self.segments[max(0, bisect.bisect_right(self.segments, from_seq) - 1)]
+                offset, seq = 0, segment
+
+            entries, positions = [], {}
+            while len(entries) < limit:
+                with open(self._segment_path(segment), 'rb') as file:
+                    for start, end, seq, body in self._scan(file, offset, seq):
+                        if seq < from_seq:
+                            continue
+                        record = json.loads(body)
+                        entries.append(QueueEntry(seq, record['ts'], record['topic'], record['payload'],
+                                                  record['qos']))
+                        positions[seq] = (segment, start)
+                        positions[seq + 1] = (segment, end)
+                        if len(entries) >= limit:
+                            break
+                index = bisect.bisect_right(self.segments, segment)
+                if len(entries) >= limit or index >= len(self.segments):
+                    break
+                segment = self.segments[index]
+                offset, seq = 0, segment
+            self._positions = positions
+            return entries
+
+    def ack(self, seqs) -> None:
+        """Mark entries as delivered; fully delivered segments are deleted"""
+        if self.on_ack is not None:
+            seqs = list(seqs)
+            self.on_ack(seqs)
+        with self._lock:
+            self._acked.update(seq for seq in seqs if seq > self.acked_through)
+            advanced = False
+            while self.acked_through + 1 in self._acked:
+                self.acked_through += 1
+                self._acked.discard(self.acked_through)
+                advanced = True
+            if not advanced:
+                return
+
+            deleted = False
+            while len(self.segments) > 1 and self.segments[1] - 1 <= self.acked_through:
+                self._segment_path(self.segments.pop(0)).unlink(missing_ok = True)
+                deleted = True
+            if self.segments and self.acked_through >= self.next_seq - 1:
+                # Mọi bản ghi đã được xác nhận: xoá luôn segment đang ghi
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._segment_path(self.segments.pop()).unlink(missing_ok = True)
+                self._positions = {}
+                deleted = True
+            if deleted or time.monotonic() - self._cursor_saved >= self.config['cursor_interval']:
+                self._save_cursor()
+
+    def pending(self) -> int:
+        """Entries not acknowledged yet"""
+        with self._lock:
+            return self.next_seq - 1 - self.acked_through - len(self._acked)
+
+    def close(self) -> None:
+        with self._lock:
+            self._save_cursor()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _telemetry_values(payload: str) -> Optional[Dict[str, Any]]:
+    """The JSON object of a telemetry payload, or None if it is not one"""
+    try:
+        values = json.loads(payload)
+    except ValueError:
+        return None
+    return values if isinstance(values, dict) else None
+
+
+def _encode_binary(group: List[QueueEntry], values: List[Dict[str, Any]], live: bool) -> Optional[bytes]:
+    import telemetry_codec
+
+    try:
+        if len(group) == 1 and live:
+            return telemetry_codec.encode_measurement(values[0])
+        return telemetry_codec.encode_batch([(entry.ts, value) for entry, value in zip(group, values)])
+    except ValueError:
+        # Ví dụ các bản ghi cách nhau quá xa: gửi bằng JSON như bình thường
+        return None
+
+
+def _gateway_payload(group: List[QueueEntry], values: List[Dict[str, Any]]) -> str:
+    devices = {}
+    for entry, value in zip(group, values):
+        for device, device_values in value.items():
+            if isinstance(device_values, list):
+                devices.setdefault(device, []).extend(device_values)  # Đã có sẵn ts
+            else:
+                devices.setdefault(device, []).append({'ts': entry.ts, 'values': device_values})
+    return json.dumps(devices, ensure_ascii = False)
+
+
+def coalesce(entries: List[QueueEntry], config: Dict[str, Any]) -> List[Tuple[str, Union[str, bytes], int, List[int]]]:
+    """
+    Group consecutive queue entries into (topic, payload, qos, seqs) messages
+
+    With config['wire_encoding'] == 'binary' the telemetry payloads are bytes
+    in the telemetry_codec format instead of JSON text.
+    """
+    topics = config['coalesce_topics']
+    gateway_topics = config.get('gateway_topics', ())
+    now = time.time() * 1000
+    messages = []
+    for entry in entries:
+        last = messages[-1] if messages else None
+        if (last is not None and (entry.topic in topics or entry.topic in gateway_topics) and
+                last[0] == entry.topic and last[2] == entry.qos):
+            last[1].append(entry)
+        else:
+            messages.append((entry.topic, [entry], entry.qos))
+
+    binary = config.get('wire_encoding') == 'binary'
+    result = []
+    for topic, group, qos in messages:
+        values = [_telemetry_values(entry.payload) for entry in group]
+        if topic in gateway_topics and None not in values:
+            result.append((topic, _gateway_payload(group, values), qos, [entry.seq for entry in group]))
+            continue
+        if binary and topic in topics and None not in values:
+            payload = _encode_binary(group, values, now - group[0].ts <= config['live_seconds'] * 1000)
+            if payload is not None:
+                result.append((topic, payload, qos, [entry.seq for entry in group]))
+                continue
+        if (topic in topics and None not in values and
+                (len(group) > 1 or now - group[0].ts > config['live_seconds'] * 1000)):
+            payload = json.dumps([{'ts': entry.ts, 'values': value} for entry, value in zip(group, values)],
+                                 ensure_ascii = False)
+            result.append((topic, payload, qos, [entry.seq for entry in group]))
+        else:
+            result.extend((topic, entry.payload, qos, [entry.seq]) for entry in group)
+    return result
+
+
+class QueueDrainer:
+    """
+    Sends the queue through a paho client with a bounded in-flight window
+
+    Args:
+        queue: TelemetryQueue to drain
+        client: Connected (or reconnecting) paho.mqtt.client.Client
+    """
+
+    def __init__(self, queue: TelemetryQueue, client, config: Dict[str, Any] = None):
+        self.queue = queue
+        self.client = client
+        self.config = {**queue.config, **(config or {})}
+        self._inflight: Dict[int, List[int]] = {}  # mid -> sequence numbers
+        self._qos: Dict[int, int] = {}  # mid -> QoS of the in-flight messages
+        self._early_acks = set()  # mids acknowledged before publish() returned
+        self._condition = queue.new_entries
+        self._next_seq = queue.acked_through + 1
+        self._stop = False
+        self.messages_sent = 0
+        self.entries_acked = 0
+        self._thread = threading.Thread(target = self._run, name = 'mqtt-drainer', daemon = True)
+
+    def start(self) -> 'QueueDrainer':
+        self._thread.start()
+        return self
+
+    def on_publish(self, mid: int) -> None:
+        """Call from the paho on_publish callback"""
+        with self._condition:
+            seqs = self._inflight.pop(mid, None)
+            self._qos.pop(mid, None)
+            if seqs is None:
+                self._early_acks.add(mid)
+                return
+            self._condition.notify_all()
+        self.queue.ack(seqs)
+        self.entries_acked += len(seqs)
+
+    def on_connect(self) -> None:
+        """Call from the paho on_connect callback: resume sending without waiting for retry_interval"""
+        with self._condition:
+            self._condition.notify_all()
+
+    def on_disconnect(self) -> None:
+        """
+        Call from the paho on_disconnect callback
+
+        paho re-sends unacknowledged QoS 1/2 messages after reconnecting, but
+        QoS 0 messages still waiting in its buffers are dropped; those are
+        read from the log again.
+        """
+        with self._condition:
+            lost = [mid for mid, seqs in self._inflight.items() if self._qos.get(mid) == 0]
+            for mid in lost:
+                seqs = self._inflight.pop(mid)
+                self._qos.pop(mid)
+                self._next_seq = min(self._next_seq, seqs[0])
+            self._condition.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                # Chờ khi cửa sổ gửi đã đầy hoặc không còn gì để gửi
+                self._condition.wait_for(lambda: self._stop or (len(self._inflight) < self.config['max_inflight']
+                                                                and self._next_seq < self.queue.next_seq),
+                                         timeout = self.config['retry_interval'])
+                if self._stop:
+                    return
+                room = self.config['max_inflight'] - len(self._inflight)
+                from_seq = self._next_seq
+            if room <= 0 or not self.client.is_connected():
+                if not self.client.is_connected():
+                    with self._condition:
+                        self._condition.wait(self.config['retry_interval'])
+                continue
+
+            entries = self.queue.read(from_seq, self.config['batch_size'])
+            if not entries:
+                continue
+            messages = coalesce(entries, self.config)[:room]
+            for topic, payload, qos, seqs in messages:
+                info = self.client.publish(topic, payload, qos)
+                if info.rc not in (MQTT_ERR_SUCCESS, MQTT_ERR_NO_CONN) or (info.rc == MQTT_ERR_NO_CONN and qos == 0):
+                    break
+                self.messages_sent += 1
+                with self._condition:
+                    self._next_seq = seqs[-1] + 1
+                    self._qos[info.mid] = qos
+                    if info.mid in self._early_acks:
+                        self._early_acks.discard(info.mid)
+                        acked = True
+                    else:
+                        self._inflight[info.mid] = seqs
+                        acked = False
+                if acked:
+                    self.queue.ack(seqs)
+                    self.entries_acked += len(seqs)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._condition:
+            inflight = len(self._inflight)
+        return {'pending': self.queue.pending(), 'inflight': inflight,
+                'messages_sent': self.messages_sent, 'entries_acked': self.entries_acked}
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Các module nằm phẳng ở thư mục gốc của repo
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
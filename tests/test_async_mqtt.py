@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+import async_mqtt as am
+
+
+def read_all(data):
+    """Every packet in `data`, parsed with read_packet"""
+    async def parse():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        packets = []
+        while not reader.at_eof():
+            packets.append(await am.read_packet(reader))
+        return packets
+
+    return asyncio.run(parse())
+
+
+@pytest.mark.parametrize('length, encoded', [
+    (0, b'\x00'),
+    (127, b'\x7f'),
+    (128, b'\x80\x01'),
+    (16383, b'\xff\x7f'),
+    (16384, b'\x80\x80\x01'),
+    (268435455, b'\xff\xff\xff\x7f'),
+])
+def test_remaining_length_matches_the_spec_examples(length, encoded):
+    assert am.encode_remaining_length(length) == encoded
+
+
+@pytest.mark.parametrize('qos, mid', [(0, 0), (1, 17), (1, 65535)])
+@pytest.mark.parametrize('payload', [b'', b'{"weight": 60.5}', 'Nguyễn'.encode('utf-8') * 5000])
+def test_publish_round_trips_through_read_packet(qos, mid, payload):
+    topic = 'v1/devices/me/telemetry'
+    [(packet_type, flags, body)] = read_all(am.encode_publish(topic, payload, qos, mid))
+
+    assert packet_type == am.PUBLISH
+    assert am.decode_publish(flags, body) == (topic, payload, qos, mid)
+
+
+def test_retain_and_dup_flags_do_not_change_the_decoded_publish():
+    [(packet_type, flags, body)] = read_all(am.encode_publish('a/b', b'x', 1, 5, retain = True, dup = True))
+    assert flags == 0x08 | 0x02 | 0x01
+    assert am.decode_publish(flags, body) == ('a/b', b'x', 1, 5)
+
+
+def test_consecutive_packets_are_split_on_their_lengths():
+    data = am.encode_mid(am.PUBACK, 258) + am.encode_packet(am.PINGRESP, 0, b'') + am.encode_mid(am.PUBACK, 3)
+    assert read_all(data) == [(am.PUBACK, 0, b'\x01\x02'), (am.PINGRESP, 0, b''), (am.PUBACK, 0, b'\x00\x03')]
+
+
+def test_connect_packet_layout():
+    [(packet_type, flags, body)] = read_all(am.encode_connect('kiosk-1', username = 'token', keepalive = 30))
+    assert (packet_type, flags) == (am.CONNECT, 0)
+    # Tên giao thức, level 4, cờ (username + clean session), keepalive, client id, username
+    assert body == b'\x00\x04MQTT\x04\x82\x00\x1e\x00\x07kiosk-1\x00\x05token'
+
+
+def test_malformed_remaining_length_is_a_protocol_error():
+    with pytest.raises(am.MQTTProtocolError):
+        read_all(bytes([am.PUBLISH << 4]) + b'\xff\xff\xff\xff\x01')
+
+
+def test_truncated_packet_raises_incomplete_read():
+    with pytest.raises(asyncio.IncompleteReadError):
+        read_all(am.encode_publish('a/b', b'payload', 0)[:-2])
@@ -0,0 +1,177 @@
+import csv
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import csv_update as cu
+import sharded_writes as sw
+
+START = datetime(2026, 9, 1, 8, 0)
+
+USER_INFO = {'gender': 'male', 'dob': '01/01/1990', 'cccd_id': '001090000001', 'address': 'Hà Nội',
+             'height': 170, 'age': 36, 'activity_factor': 1.2}
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return cu.CSVDataManager({**cu.CSV_CONFIG, 'file_path': str(tmp_path / 'history.csv')})
+
+
+@pytest.fixture
+def config(tmp_path):
+    return {'shard_dir': str(tmp_path / 'shards'), 'fsync': False}
+
+
+def record(number):
+    """User info and measurements of row `number`, measured `number` minutes after START"""
+    measured = (START + timedelta(minutes = number)).strftime(cu.CSV_CONFIG['date_format'])
+    return {**USER_INFO, 'name': f'User {number}'}, {'weight': 60.0 + number / 10, 'datetime': measured}
+
+
+def write_canonical(manager, numbers):
+    for number in numbers:
+        success, messages = manager.update_csv(*record(number))
+        assert success, messages
+
+
+def write_shard(manager, config, numbers):
+    writer = sw.ShardWriter(manager, config)
+    for number in numbers:
+        success, messages = writer.submit(*record(number))
+        assert success, messages
+
+
+def canonical_names(manager):
+    with open(manager.file_path, newline = '', encoding = manager.config['encoding']) as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == list(manager.headers.keys())
+    return [row[rows[0].index('name')] for row in rows[1:]]
+
+
+def leftovers(shard_dir):
+    """Files of a shard directory apart from the lock files"""
+    return [path.name for path in shard_dir.iterdir() if path.suffix != '.lock']
+
+
+def expected_names(numbers):
+    return [f'User {number}' for number in sorted(numbers)]
+
+
+def interrupted_merge(manager, config, monkeypatch):
+    """Run a merge that stops right after writing its journal, before the canonical file is touched"""
+    save_journal = sw.ShardMerger._save_journal
+
+    def crash_after_journal(self, journal):
+        save_journal(self, journal)
+        raise KeyboardInterrupt("simulated crash")
+
+    monkeypatch.setattr(sw.ShardMerger, '_save_journal', crash_after_journal)
+    with pytest.raises(KeyboardInterrupt):
+        sw.ShardMerger(manager, config).merge()
+    monkeypatch.undo()
+
+
+def test_merge_appends_later_rows(manager, config):
+    write_canonical(manager, range(0, 5))
+    write_shard(manager, config, range(5, 8))
+
+    assert sw.ShardMerger(manager, config).merge() == 3
+    assert canonical_names(manager) == expected_names(range(8))
+    assert not leftovers(manager.file_path.parent / 'shards')
+
+
+def test_merge_rewrites_tail_in_place(manager, config):
+    write_canonical(manager, [0, 1, 2, 4, 6])
+    inode = manager.file_path.stat().st_ino
+    write_shard(manager, config, [5, 3])
+
+    assert sw.ShardMerger(manager, config).merge() == 2
+    assert canonical_names(manager) == expected_names([0, 1, 2, 3, 4, 5, 6])
+    assert manager.file_path.stat().st_ino == inode
+
+
+def test_merge_appends_rows_older_than_the_window_at_the_end(manager, config):
+    write_canonical(manager, range(2, 40))
+    inode = manager.file_path.stat().st_ino
+    head = manager.file_path.read_bytes()[:-512]
+    write_shard(manager, config, [1, 45])
+
+    # Chỉ cho phép ghi lại vài trăm byte cuối, hàng số 1 nằm ngoài cửa sổ đó
+    assert sw.ShardMerger(manager, {**config, 'rewrite_window': 512}).merge() == 2
+    assert canonical_names(manager) == [*expected_names([*range(2, 40), 45]), 'User 1']
+    assert manager.file_path.stat().st_ino == inode
+    assert manager.file_path.read_bytes().startswith(head)
+
+
+def test_late_rows_do_not_invalidate_the_parquet_archive(manager, config, tmp_path):
+    parquet_archive = pytest.importorskip('parquet_archive')
+    archive_dir = tmp_path / 'archive'
+    archive_config = {'settle_bytes': 512}
+    write_canonical(manager, range(2, 40))
+    archived = parquet_archive.archive_csv(manager.file_path, archive_dir, archive_config)
+    assert archived > 0
+
+    write_shard(manager, config, [1, 45])
+    assert sw.ShardMerger(manager, {**config, 'rewrite_window': 512}).merge() == 2
+    parquet_archive.archive_csv(manager.file_path, archive_dir, {'settle_bytes': 0})
+
+    names = parquet_archive.read_archive(['name'], archive_dir = archive_dir)['name'].tolist()
+    assert names == expected_names([1, *range(2, 40), 45])
+
+
+def test_merge_creates_missing_canonical_file(manager, config):
+    write_shard(manager, config, [3, 1, 2])
+
+    assert sw.ShardMerger(manager, config).merge() == 3
+    assert canonical_names(manager) == expected_names([1, 2, 3])
+
+
+def test_merge_drops_incomplete_shard_rows(manager, config):
+    write_canonical(manager, [0])
+    write_shard(manager, config, [1])
+    shard = sw.shard_path(config['shard_dir'], manager.file_path)
+    with open(shard, 'a', encoding = 'utf-8') as file:
+        file.write('01/09/2026 09:00,Torn row')
+
+    assert sw.ShardMerger(manager, config).merge() == 1
+    assert canonical_names(manager) == expected_names([0, 1])
+
+
+@pytest.mark.parametrize('shard_numbers, rewrite_window, mode', [
+    ([5, 6], 65536, 'tail'),  # append at the end
+    ([3, 6], 65536, 'tail'),  # tail rewrite
+    ([1, 6], 256, 'tail'),  # row 1 is older than the window
+])
+def test_interrupted_merge_is_rolled_forward(manager, config, monkeypatch, shard_numbers, rewrite_window, mode):
+    write_canonical(manager, range(0, 10, 2))
+    before = manager.file_path.read_bytes()
+    write_shard(manager, config, shard_numbers)
+    config = {**config, 'rewrite_window': rewrite_window}
+
+    interrupted_merge(manager, config, monkeypatch)
+
+    shard_dir = manager.file_path.parent / 'shards'
+    with open(shard_dir / sw.MERGE_JOURNAL, encoding = 'utf-8') as file:
+        assert json.load(file)['mode'] == mode
+    assert list(shard_dir.glob('*.merging'))
+    assert manager.file_path.read_bytes() == before
+
+    # Lần gộp sau hoàn tất lần bị gián đoạn; không có hàng nào bị mất hay lặp lại
+    assert sw.ShardMerger(manager, config).merge() == 0
+    merged = canonical_names(manager)
+    assert sorted(merged) == expected_names([*range(0, 10, 2), *shard_numbers])
+    assert not leftovers(shard_dir)
+
+    assert sw.ShardMerger(manager, config).merge() == 0
+    assert canonical_names(manager) == merged
+
+
+def test_rows_written_after_an_interrupted_merge_are_merged_once(manager, config, monkeypatch):
+    write_canonical(manager, [0, 2])
+    write_shard(manager, config, [3])
+    interrupted_merge(manager, config, monkeypatch)
+
+    write_shard(manager, config, [5])
+    assert sw.ShardMerger(manager, config).merge() == 1
+    assert canonical_names(manager) == expected_names([0, 2, 3, 5])
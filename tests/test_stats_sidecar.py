@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import stats_sidecar as ss
+
+DATE_FORMAT = "%d/%m/%Y %H:%M"
+START = datetime(2026, 9, 1, 8, 0)
+
+
+def write_rows(path, numbers, header=True):
+    with open(path, 'a', encoding = 'utf-8', newline = '') as file:
+        if header:
+            file.write('\ufeffdatetime,name,weight\n')
+        for number in numbers:
+            measured = (START + timedelta(hours = number)).strftime(DATE_FORMAT)
+            file.write(f'{measured},Người dùng {number % 3},{60 + number / 10}\n')
+
+
+def open_sidecar(path, **kwargs):
+    return ss.StatisticsSidecar(path, date_format = DATE_FORMAT, **kwargs)
+
+
+@pytest.mark.parametrize('chunk_bytes', [7, 64, ss.CHUNK_BYTES])
+def test_chunked_pass_matches_single_pass(tmp_path, chunk_bytes):
+    path = tmp_path / 'history.csv'
+    write_rows(path, range(20))
+
+    state = open_sidecar(path, chunk_bytes = chunk_bytes).refresh()
+    assert state['offset'] == path.stat().st_size
+    assert state['total_records'] == 20
+    assert state['columns'] == ['datetime', 'name', 'weight']
+    assert {name: user['count'] for name, user in state['users'].items()} == \
+        {'Người dùng 0': 7, 'Người dùng 1': 7, 'Người dùng 2': 6}
+    assert state['earliest'] == START.isoformat()
+    assert state['latest'] == (START + timedelta(hours = 19)).isoformat()
+
+
+def test_partial_last_line_waits_for_its_newline(tmp_path):
+    path = tmp_path / 'history.csv'
+    write_rows(path, range(3))
+    with open(path, 'a', encoding = 'utf-8') as file:
+        file.write('01/09/2026 20:00,Người')
+
+    sidecar = open_sidecar(path, chunk_bytes = 16)
+    state = sidecar.refresh()
+    assert state['total_records'] == 3
+    assert state['offset'] < path.stat().st_size
+
+    with open(path, 'a', encoding = 'utf-8') as file:
+        file.write(' dùng 9,61.0\n')
+    assert sidecar.refresh()['total_records'] == 4
+    assert 'Người dùng 9' in sidecar.refresh()['users']
+
+
+def test_failed_chunk_keeps_the_rows_already_counted(tmp_path, monkeypatch):
+    path = tmp_path / 'history.csv'
+    write_rows(path, range(10))
+    sidecar = open_sidecar(path, chunk_bytes = 64)
+    add_lines = ss.StatisticsSidecar._add_lines
+    calls = []
+
+    def fail_on_third_chunk(self, state, lines):
+        calls.append(len(lines))
+        if len(calls) == 3:
+            raise OSError("simulated read error")
+        return add_lines(self, state, lines)
+
+    monkeypatch.setattr(ss.StatisticsSidecar, '_add_lines', fail_on_third_chunk)
+    with pytest.raises(OSError):
+        sidecar.refresh()
+    monkeypatch.undo()
+
+    # Phần đã đọc được lưu lại; lần sau chỉ đọc tiếp từ offset đó mà không đếm trùng
+    saved = open_sidecar(path, chunk_bytes = 64)
+    partial = saved._load()
+    assert 0 < partial['offset'] < path.stat().st_size
+    assert saved.refresh()['total_records'] == 10
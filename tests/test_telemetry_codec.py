@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+import telemetry_codec as tc
+
+METRICS = {'gender': 'male', 'weight': 68.45, 'age': 36, 'bmi': 22.35, 'bmr': 1612.4, 'tdee': 1934.88,
+           'lbm': 54.1, 'fp': 20.97, 'wp': 55.32, 'bm': 2.9, 'ms': 51.2, 'pp': 17.66, 'vf': 7.0, 'iw': 63.58}
+
+
+def test_measurement_round_trip_is_compact():
+    payload = tc.encode_measurement(METRICS)
+    assert payload[0] == tc.SCHEMA_VERSION
+    assert tc.decode_payload(payload) == METRICS
+    assert len(payload) < len(json.dumps(METRICS)) / 4
+
+
+def test_partial_measurement_round_trip():
+    # Tin nhắn bổ sung chỉ có điểm thăng bằng
+    assert tc.decode_payload(tc.encode_measurement({'ols': 12.3})) == {'ols': 12.3}
+
+
+@pytest.mark.parametrize('values', [
+    {'weight': 68.456},  # more decimals than the scale keeps
+    {'weight': 1000.0},  # does not fit in the field
+    {'weight': float('nan')},
+    {'gender': 'unknown', 'weight': 60.0},
+    {'weight': 60.0, 'note': 'Cân lại', 'device': {'id': 7}},  # keys without a field
+])
+def test_values_that_do_not_fit_a_field_travel_as_extras(values):
+    decoded = tc.decode_payload(tc.encode_measurement(values))
+    assert json.dumps(decoded, sort_keys = True) == json.dumps(values, sort_keys = True)
+
+
+def test_batch_round_trip_gives_the_thingsboard_list():
+    entries = [(1760000000000, METRICS), (1760000060000, {'ols': 8.5}), (1760000060500, {'weight': 68.4})]
+    assert tc.decode_payload(tc.encode_batch(entries)) == [{'ts': ts, 'values': values} for ts, values in entries]
+
+
+def test_batch_entries_must_be_in_time_order():
+    with pytest.raises(ValueError):
+        tc.encode_batch([(1760000060000, METRICS), (1760000000000, METRICS)])
+
+
+@pytest.mark.parametrize('payload', ['{"weight": 60.5}', b'{"weight": 60.5}', b'[{"ts": 1, "values": {}}]'])
+def test_json_payloads_are_accepted(payload):
+    assert tc.decode_payload(payload) == json.loads(payload)
+
+
+@pytest.mark.parametrize('payload', [
+    b'',
+    bytes([tc.SCHEMA_VERSION + 1]) + b'\x00\x00',  # unknown schema
+    tc.encode_measurement(METRICS)[:-3],
+    tc.encode_batch([(0, METRICS), (10, METRICS)])[:-5],
+])
+def test_invalid_payloads_raise_value_error(payload):
+    with pytest.raises(ValueError):
+        tc.decode_payload(payload)
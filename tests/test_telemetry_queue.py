@@ -0,0 +1,176 @@
+import json
+
+import pytest
+
+import telemetry_queue as tq
+
+TOPIC = 'v1/devices/me/telemetry'
+
+
+@pytest.fixture
+def queue_dir(tmp_path):
+    return tmp_path / 'queue'
+
+
+def open_queue(queue_dir, **config):
+    return tq.TelemetryQueue(queue_dir, {'fsync': False, **config})
+
+
+def fill(queue, count, start=0):
+    return [queue.append(TOPIC, json.dumps({'weight': 60 + start + i})) for i in range(count)]
+
+
+def pending_weights(queue, limit=1000):
+    """Weights of every entry the drainer would send next"""
+    return [json.loads(entry.payload)['weight'] for entry in queue.read(queue.acked_through + 1, limit)]
+
+
+def segment_files(queue_dir):
+    return sorted(path.name for path in queue_dir.glob('seg-*.log'))
+
+
+def test_sequence_numbers_start_after_the_cursor(queue_dir):
+    queue = open_queue(queue_dir)
+    assert fill(queue, 3) == [1, 2, 3]
+    assert [entry.seq for entry in queue.read(2, 10)] == [2, 3]
+    assert queue.pending() == 3
+
+
+@pytest.mark.parametrize('garbage', [
+    tq.HEADER.pack(100, 0) + b'{"ts": 1',  # body cut short
+    tq.HEADER.pack(2, 12345) + b'{}',  # CRC mismatch
+    b'\x07\x00',  # header cut short
+])
+def test_torn_record_is_truncated_on_reopen(queue_dir, garbage):
+    queue = open_queue(queue_dir)
+    fill(queue, 3)
+    queue.close()
+    segment = queue_dir / segment_files(queue_dir)[-1]
+    intact_size = segment.stat().st_size
+    with open(segment, 'ab') as file:
+        file.write(garbage)
+
+    queue = open_queue(queue_dir)
+    assert segment.stat().st_size == intact_size
+    assert queue.next_seq == 4
+    assert pending_weights(queue) == [60, 61, 62]
+
+    # Bản ghi mới được nối tiếp ngay sau phần còn nguyên vẹn
+    assert fill(queue, 1, start = 3) == [4]
+    queue.close()
+    assert pending_weights(open_queue(queue_dir)) == [60, 61, 62, 63]
+
+
+def test_out_of_order_acks_advance_the_cursor_once_contiguous(queue_dir):
+    queue = open_queue(queue_dir)
+    fill(queue, 5)
+
+    queue.ack([3, 2])
+    assert queue.acked_through == 0
+    assert queue.pending() == 3
+
+    queue.ack([1])
+    assert queue.acked_through == 3
+    assert queue.pending() == 2
+
+    queue.ack([5])
+    assert queue.acked_through == 3
+    queue.close()
+
+    # Mục 5 đã được xác nhận nhưng chưa liên tục với con trỏ: gửi lại (ít nhất một lần), mục 4 không mất
+    queue = open_queue(queue_dir)
+    assert queue.acked_through == 3
+    assert pending_weights(queue) == [63, 64]
+
+
+def test_duplicate_and_stale_acks_are_ignored(queue_dir):
+    queue = open_queue(queue_dir)
+    fill(queue, 3)
+    queue.ack([1, 1, 2])
+    queue.ack([1, 2])
+    assert queue.acked_through == 2
+    assert queue.pending() == 1
+
+
+def test_fully_acknowledged_segments_are_deleted(queue_dir):
+    queue = open_queue(queue_dir, segment_bytes = 200)
+    fill(queue, 12)
+    segments = list(queue.segments)
+    assert len(segments) >= 3
+
+    # Xác nhận hết segment đầu tiên: chỉ segment đó bị xoá
+    queue.ack(range(1, segments[1]))
+    assert segment_files(queue_dir) == [f'seg-{seq:012d}.log' for seq in segments[1:]]
+    assert pending_weights(queue) == [60 + seq - 1 for seq in range(segments[1], 13)]
+
+    # One entry short of the second segment keeps it
+    queue.ack(range(segments[1], segments[2] - 1))
+    assert segment_files(queue_dir) == [f'seg-{seq:012d}.log' for seq in segments[1:]]
+
+    queue.ack(range(segments[2] - 1, 13))
+    assert segment_files(queue_dir) == []
+    assert queue.pending() == 0
+    queue.close()
+
+    # Số thứ tự không bị dùng lại sau khi mọi segment đã bị xoá
+    queue = open_queue(queue_dir, segment_bytes = 200)
+    assert queue.acked_through == 12
+    assert fill(queue, 2, start = 12) == [13, 14]
+    assert pending_weights(queue) == [72, 73]
+
+
+def test_unsaved_cursor_redelivers_but_never_loses_entries(queue_dir):
+    queue = open_queue(queue_dir, cursor_interval = 3600)
+    fill(queue, 6)
+    queue.ack([1, 2])  # The first ack saves the cursor
+    queue.ack([3, 4])  # Within cursor_interval: only in memory
+    assert queue.acked_through == 4
+
+    # Process dies without close(): the entries after the saved cursor are sent again
+    queue = open_queue(queue_dir, cursor_interval = 3600)
+    assert queue.acked_through == 2
+    assert pending_weights(queue) == [62, 63, 64, 65]
+
+
+GATEWAY = 'v1/gateway/telemetry'
+
+
+def entry(seq, topic, payload, qos=1, ts=None):
+    return tq.QueueEntry(seq, ts or 1760000000000 + seq * 1000, topic,
+                         payload if isinstance(payload, str) else json.dumps(payload), qos)
+
+
+def test_coalesce_merges_gateway_entries_by_device():
+    entries = [entry(1, GATEWAY, {'Cân 1': {'weight': 60.1}}),
+               entry(2, GATEWAY, {'Cân 2': {'weight': 70.2}, 'Cân 1': {'ols': 9.5}}),
+               entry(3, GATEWAY, {'Cân 1': [{'ts': 5, 'values': {'weight': 60.0}}]})]
+
+    [(topic, payload, qos, seqs)] = tq.coalesce(entries, tq.QUEUE_CONFIG)
+    assert (topic, qos, seqs) == (GATEWAY, 1, [1, 2, 3])
+    assert json.loads(payload) == {
+        'Cân 1': [{'ts': entries[0].ts, 'values': {'weight': 60.1}},
+                  {'ts': entries[1].ts, 'values': {'ols': 9.5}},
+                  {'ts': 5, 'values': {'weight': 60.0}}],  # Giữ nguyên ts có sẵn
+        'Cân 2': [{'ts': entries[1].ts, 'values': {'weight': 70.2}}],
+    }
+
+
+def test_coalesce_keeps_topic_and_qos_boundaries():
+    entries = [entry(1, GATEWAY, {'Cân 1': {'weight': 60.1}}),
+               entry(2, TOPIC, {'weight': 60.1}),
+               entry(3, GATEWAY, {'Cân 1': {'weight': 60.2}}, qos = 0),
+               entry(4, GATEWAY, {'Cân 1': {'weight': 60.3}}, qos = 0)]
+
+    messages = tq.coalesce(entries, {**tq.QUEUE_CONFIG, 'live_seconds': float('inf')})
+    assert [(topic, qos, seqs) for topic, _, qos, seqs in messages] == \
+        [(GATEWAY, 1, [1]), (TOPIC, 1, [2]), (GATEWAY, 0, [3, 4])]
+    # A live single telemetry entry is sent as it was queued
+    assert messages[1][1] == entries[1].payload
+
+
+def test_coalesce_sends_unparseable_gateway_payloads_unchanged():
+    entries = [entry(1, GATEWAY, {'Cân 1': {'weight': 60.1}}), entry(2, GATEWAY, 'not json')]
+
+    messages = tq.coalesce(entries, tq.QUEUE_CONFIG)
+    assert [(payload, seqs) for _, payload, _, seqs in messages] == \
+        [(entries[0].payload, [1]), ('not json', [2])]
@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import csv_update as cu
+import sharded_writes as sw
+import user_trends as ut
+
+START = datetime(2026, 9, 1, 8, 0)
+
+USER_INFO = {'gender': 'female', 'dob': '01/01/1990', 'cccd_id': '001190000001', 'address': 'Hà Nội',
+             'height': 160, 'age': 36, 'activity_factor': 1.2}
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return cu.CSVDataManager({**cu.CSV_CONFIG, 'file_path': str(tmp_path / 'history.csv')})
+
+
+def record(name, days, weight):
+    measured = (START + timedelta(days = days)).strftime(cu.CSV_CONFIG['date_format'])
+    return {**USER_INFO, 'name': name}, {'weight': weight, 'datetime': measured}
+
+
+def weight_trend(cache, name, days=7):
+    return cache.get(name)['windows'][days]['weight']
+
+
+def test_new_rows_are_added_incrementally(manager):
+    cache = ut.TrendCache(manager)
+    assert manager.update_csv(*record('Alice', 0, 60.0))[0]
+    assert weight_trend(cache, 'Alice')['count'] == 1
+
+    assert manager.update_csv(*record('Alice', 2, 62.0))[0]
+    assert weight_trend(cache, 'Alice') == {'mean': 61.0, 'slope_per_day': 1.0, 'count': 2}
+
+
+def test_rows_merged_into_the_tail_are_not_counted_twice(manager, tmp_path):
+    cache = ut.TrendCache(manager)
+    assert manager.update_csv(*record('Alice', 0, 60.0))[0]
+    assert manager.update_csv(*record('Alice', 2, 62.0))[0]
+    assert weight_trend(cache, 'Alice')['count'] == 2
+
+    # Hàng của Bob được chèn giữa hai hàng của Alice: các hàng sau nó được đánh số lại
+    config = {'shard_dir': str(tmp_path / 'shards'), 'fsync': False}
+    assert sw.ShardWriter(manager, config).submit(*record('Bob', 1, 80.0))[0]
+    assert sw.ShardMerger(manager, config).merge() == 1
+
+    assert weight_trend(cache, 'Alice') == {'mean': 61.0, 'slope_per_day': 1.0, 'count': 2}
+    assert weight_trend(cache, 'Bob')['count'] == 1
@@ -0,0 +1,151 @@
+import tkinter as tk
+from tkinter import ttk, simpledialog, messagebox
+
+import calc_metrics as cm
+from lazy_imports import lazy_import
+
+qr_scaner = lazy_import('qr_scaner')
+
+
+class UserInfoDialog(simpledialog.Dialog):
+    """Dialog for user information input with CCCD QR scanner"""
+
+    def __init__(self, parent, activity_levels):
+        self.cccd_data = None
+        self.activity_levels = activity_levels
+        super().__init__(parent)
+
+    def body(self, master):
+        """Create dialog body"""
+        self.title("Nhập thông tin cá nhân")
+
+        # CCCD QR Scanner section
+        qr_frame = tk.Frame(master)
+        qr_frame.grid(row = 0, column = 0, columnspan = 2, pady = 10)
+
+        tk.Label(qr_frame, text = "1. Quét mã QR trên CCCD:", font = ("Arial", 10, "bold")).pack()
+        self.scan_button = tk.Button(qr_frame, text = "Quét CCCD", command = self.scan_cccd,
+                                     bg = "#4CAF50", fg = "white", font = ("Arial", 9))
+        self.scan_button.pack(pady = 5)
+
+        # Status label for CCCD scan
+        self.cccd_status = tk.Label(qr_frame, text = "Chưa quét CCCD", fg = "red")
+        self.cccd_status.pack()
+
+        # User info display (read-only)
+        info_frame = tk.Frame(master)
+        info_frame.grid(row = 1, column = 0, columnspan = 2, pady = 10)
+
+        tk.Label(info_frame, text = "Thông tin từ CCCD:", font = ("Arial", 10, "bold")).grid(row = 0, column = 0,
+                                                                                             columnspan = 2)
+
+        tk.Label(info_frame, text = "Họ tên:").grid(row = 1, column = 0, sticky = "w")
+        self.name_label = tk.Label(info_frame, text = "", bg = "lightgray", width = 30, anchor = "w")
+        self.name_label.grid(row = 1, column = 1, padx = 5)
+
+        tk.Label(info_frame, text = "Ngày sinh:").grid(row = 2, column = 0, sticky = "w")
+        self.dob_label = tk.Label(info_frame, text = "", bg = "lightgray", width = 30, anchor = "w")
+        self.dob_label.grid(row = 2, column = 1, padx = 5)
+
+        tk.Label(info_frame, text = "Giới tính:").grid(row = 3, column = 0, sticky = "w")
+        self.gender_label = tk.Label(info_frame, text = "", bg = "lightgray", width = 30, anchor = "w")
+        self.gender_label.grid(row = 3, column = 1, padx = 5)
+
+        # Manual input section
+        input_frame = tk.Frame(master)
+        input_frame.grid(row = 2, column = 0, columnspan = 2, pady = 10)
+
+        tk.Label(input_frame, text = "2. Nhập thông tin bổ sung:", font = ("Arial", 10, "bold")).grid(row = 0,
+                                                                                                      column = 0,
+                                                                                                      columnspan = 2)
+
+        # Height input
+        tk.Label(input_frame, text = "Chiều cao (cm):").grid(row = 1, column = 0, sticky = "w")
+        self.height_entry = tk.Entry(input_frame, width = 30)
+        self.height_entry.grid(row = 1, column = 1, padx = 5)
+
+        # Activity level dropdown
+        tk.Label(input_frame, text = "Hệ số hoạt động:").grid(row = 2, column = 0, sticky = "w")
+        self.activity_var = tk.StringVar()
+        self.activity_var.set("Ít vận động")
+        self.activity_menu = ttk.OptionMenu(
+            input_frame, self.activity_var, "Ít vận động", *self.activity_levels.keys()
+        )
+        self.activity_menu.grid(row = 2, column = 1, sticky = "w", padx = 5)
+
+        # Add note about weight measurement
+        note_frame = tk.Frame(master)
+        note_frame.grid(row = 3, column = 0, columnspan = 2, pady = 10)
+
+        note_text = "Lưu ý: Cân nặng sẽ được đo tự động từ thiết bị cân thông minh"
+        tk.Label(note_frame, text = note_text, font = ("Arial", 9, "italic"), fg = "blue").pack()
+
+        return self.scan_button
+
+    def scan_cccd(self):
+        """Handle CCCD QR code scanning"""
+        try:
+            # Call the QR scanner function
+            self.cccd_data = qr_scaner.scan_cccd_qr()
+
+            if self.cccd_data:
+                # Update the display labels
+                self.name_label.config(text = self.cccd_data.get('name', ''))
+                self.dob_label.config(text = self.cccd_data.get('dob', ''))
+                self.gender_label.config(text = self.cccd_data.get('gender', ''))
+
+                # Update status
+                self.cccd_status.config(text = "✓ Đã quét CCCD thành công", fg = "green")
+
+                # Enable input fields
+                self.height_entry.config(state = "normal")
+
+                messagebox.showinfo("Thành công", "Đã quét CCCD thành công!\nVui lòng nhập chiều cao.")
+            else:
+                messagebox.showerror("Lỗi", "Không thể quét mã QR CCCD. Vui lòng thử lại.")
+
+        except Exception as e:
+            messagebox.showerror("Lỗi", f"Lỗi khi quét CCCD: {str(e)}")
+
+    def validate(self):
+        """Validate input before applying"""
+        if not self.cccd_data:
+            messagebox.showerror("Lỗi", "Vui lòng quét CCCD trước!")
+            return False
+
+        if not self.height_entry.get().strip():
+            messagebox.showerror("Lỗi", "Vui lòng nhập chiều cao!")
+            return False
+
+        try:
+            height = float(self.height_entry.get())
+
+            if height <= 0 or height > 300:
+                messagebox.showerror("Lỗi", "Chiều cao không hợp lệ (1-300 cm)!")
+                return False
+
+        except ValueError:
+            messagebox.showerror("Lỗi", "Vui lòng nhập số hợp lệ cho chiều cao!")
+            return False
+
+        return True
+
+    def apply(self):
+        """Apply user input"""
+        if self.cccd_data:
+            # Calculate age from date of birth
+            age = cm.calculate_age(self.cccd_data['dob'])
+
+            self.result = {
+                "name": self.cccd_data['name'],
+                "dob": self.cccd_data['dob'],
+                "gender": self.cccd_data['gender'],
+                "cccd_id": self.cccd_data['cccd_id'],
+                "address": self.cccd_data.get('address', ''),
+                "height": float(self.height_entry.get()),
+                "weight": None,  # Weight will be set later from scale data
+                "age": age,
+                "activity_factor": self.activity_levels[self.activity_var.get()]
+            }
+        else:
+            self.result = None
@@ -0,0 +1,104 @@
+"""
+User profiles for headless operation.
+
+Without the Tk dialog, the profile of the person on the scale comes from the
+measurement history (the most recent row for a name or CCCD number) or from
+a JSON document, either a local file or a URL served by a local API.
+"""
+import json
+import logging
+import math
+from typing import Any, Dict, Optional
+from urllib.request import urlopen
+
+import calc_metrics as cm
+from lazy_imports import lazy_import
+
+cu = lazy_import('csv_update')
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FIELDS = ('name', 'dob', 'gender', 'cccd_id', 'address', 'height', 'activity_factor')
+
+DEFAULT_ACTIVITY_FACTOR = 1.2
+
+# CCCD numbers have 12 digits
+CCCD_LENGTH = 12
+
+
+class ProfileNotFoundError(LookupError):
+    """Raised when no profile matches the requested user"""
+
+
+def complete_profile(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Turn stored profile fields into the user_info dictionary used by main.py
+
+    Age is recomputed from the date of birth and weight is left for the scale.
+    """
+    # Empty CSV cells are read back as NaN
+    profile = {key: None if isinstance(value, float) and math.isnan(value) else value
+               for key, value in profile.items()}
+    missing = [field for field in ('name', 'dob', 'height') if not profile.get(field)]
+    if missing:
+        raise ValueError(f"Profile is missing required fields: {missing}")
+
+    activity_factor = profile.get('activity_factor')
+    return {
+        "name": str(profile['name']),
+        "dob": str(profile['dob']),
+        "gender": str(profile.get('gender') or ''),
+        "cccd_id": str(profile.get('cccd_id') or ''),
+        "address": str(profile.get('address') or ''),
+        "height": float(profile['height']),
+        "weight": None,  # Weight will be set later from scale data
+        "age": cm.calculate_age(str(profile['dob'])),
+        "activity_factor": float(activity_factor) if activity_factor else DEFAULT_ACTIVITY_FACTOR,
+    }
+
+
+def profile_from_history(identifier: str, manager: Optional['cu.CSVDataManager'] = None) -> Dict[str, Any]:
+    """
+    Build a profile from the latest history row of a user
+
+    Args:
+        identifier: CCCD number or name (case-insensitive)
+        manager: CSVDataManager to read from (default: the standard history file)
+
+    Raises:
+        ProfileNotFoundError: If no row matches
+    """
+    manager = manager or cu.CSVDataManager()
+    df = manager.read_csv_data()
+    if df.empty:
+        raise ProfileNotFoundError(f"No measurement history to load '{identifier}' from")
+
+    # cccd_id is read back as a number, which drops its leading zeros
+    cccd_ids = df['cccd_id'].astype(str).str.replace(r'\.0$', '', regex = True).str.lstrip('0')
+    matches = df[(cccd_ids == identifier.lstrip('0')) |
+                 (df['name'].astype(str).str.lower() == identifier.lower())]
+    matches = matches.dropna(subset = ['dob', 'height'])
+    if matches.empty:
+        raise ProfileNotFoundError(f"No usable history for user '{identifier}'")
+
+    latest = matches.iloc[-1]
+    profile = {field: latest.get(field) for field in PROFILE_FIELDS}
+    if cccd_ids[latest.name].isdigit():
+        profile['cccd_id'] = cccd_ids[latest.name].zfill(CCCD_LENGTH)
+    logger.info(f"Loaded profile of {profile['name']} from history")
+    return complete_profile(profile)
+
+
+def profile_from_source(source: str) -> Dict[str, Any]:
+    """Build a profile from a JSON file path or an http(s) URL returning a JSON object"""
+    if source.startswith(('http://', 'https://')):
+        with urlopen(source, timeout = 10) as response:
+            profile = json.loads(response.read().decode('utf-8'))
+    else:
+        with open(source, 'r', encoding = 'utf-8') as file:
+            profile = json.load(file)
+
+    if not isinstance(profile, dict):
+        raise ValueError(f"Profile from {source} must be a JSON object")
+    logger.info(f"Loaded profile of {profile.get('name')} from {source}")
+    return complete_profile(profile)
@@ -0,0 +1,239 @@
+"""
+Per-user trend analytics: moving averages and slopes over recent windows.
+
+For each window (7/30/90 days ending at the user's latest weigh-in) and each
+trend metric, the mean and the least-squares slope (units per day) are kept
+as running sums (n, Σt, Σt², Σv, Σtv) over the rows inside the window.
+
+The first request for a user loads their history from the history index and
+computes the sums with vectorized NumPy operations. After that, a request
+only reads the rows the user gained since (UserHistoryIndex.rows_after, or
+StorageBackend.user_rows_after with a storage backend configured) and
+adds them to the sums, dropping the rows that fell out of each window, so
+the cost does not depend on the length of the history. A row older than the
+latest one seen (imported history) triggers a rebuild for that user, and so
+does a new generation of the history index (rows rewritten in place or
+merged into the tail renumber the rows after them).
+"""
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import csv_update as cu
+from history_index import normalize_name
+
+logger = logging.getLogger(__name__)
+
+TREND_CONFIG = {
+    'windows': (7, 30, 90),  # days
+    'metrics': ('weight', 'bmi', 'fat_percentage', 'muscle_mass'),  # CSV columns
+    'exact_every': 256,  # Recompute the running sums exactly after this many updates
+    'min_slope_days': 1.0,  # No slope until a window's weigh-ins span this many days
+}
+
+SECONDS_PER_DAY = 86400.0
+
+
+class WindowSums:
+    """Rows of one time window and the running sums for the regression of every metric"""
+
+    def __init__(self, days: float, metric_count: int):
+        self.days = days
+        self.rows = deque()  # (t, values)
+        self.n = np.zeros(metric_count)
+        self.st = np.zeros(metric_count)
+        self.stt = np.zeros(metric_count)
+        self.sv = np.zeros(metric_count)
+        self.stv = np.zeros(metric_count)
+
+    def _apply(self, t: float, values: np.ndarray, sign: int):
+        present = ~np.isnan(values)
+        v = np.where(present, values, 0.0)
+        self.n += sign * present
+        self.st += sign * t * present
+        self.stt += sign * t * t * present
+        self.sv += sign * v
+        self.stv += sign * t * v
+
+    def load(self, times: np.ndarray, values: np.ndarray):
+        """Set the window to the rows at or after its start, computed vectorized"""
+        inside = times >= times[-1] - self.days if len(times) else np.zeros(0, dtype = bool)
+        times, values = times[inside], values[inside]
+        self.rows = deque(zip(times.tolist(), values))
+        present = ~np.isnan(values)
+        v = np.where(present, values, 0.0)
+        t = times[:, None]
+        self.n = present.sum(axis = 0).astype(float)
+        self.st = (t * present).sum(axis = 0)
+        self.stt = (t * t * present).sum(axis = 0)
+        self.sv = v.sum(axis = 0)
+        self.stv = (t * v).sum(axis = 0)
+
+    def add(self, t: float, values: np.ndarray):
+        self.rows.append((t, values))
+        self._apply(t, values, 1)
+        # Bỏ các hàng đã nằm ngoài cửa sổ tính từ lần cân mới nhất
+        while self.rows and self.rows[0][0] < t - self.days:
+            old_t, old_values = self.rows.popleft()
+            self._apply(old_t, old_values, -1)
+
+    def reload(self):
+        """Recompute the sums exactly from the rows, removing accumulated rounding error"""
+        if self.rows:
+            times = np.array([t for t, _ in self.rows])
+            self.load(times, np.vstack([v for _, v in self.rows]))
+
+    def summary(self, metrics, min_slope_days: float = 0.0) -> Dict[str, Dict[str, Any]]:
+        # Vài lần cân cách nhau vài phút cho độ dốc theo ngày vô nghĩa
+        span = self.rows[-1][0] - self.rows[0][0] if self.rows else 0.0
+        result = {}
+        for i, metric in enumerate(metrics):
+            n = self.n[i]
+            mean = slope = None
+            if n > 0:
+                mean = round(float(self.sv[i] / n), 2)
+            denominator = n * self.stt[i] - self.st[i] ** 2
+            if n >= 2 and denominator > 1e-9 and span >= min_slope_days:
+                slope = round(float((n * self.stv[i] - self.st[i] * self.sv[i]) / denominator), 4)
+            result[metric] = {'mean': mean, 'slope_per_day': slope, 'count': int(n)}
+        return result
+
+
+class UserTrendState:
+    """Cached windows of one user"""
+
+    def __init__(self, windows, metric_count: int):
+        self.origin = None  # Timestamp of t = 0 (days are counted from the first row)
+        self.last_time = None
+        self.last_row = -1
+        self.generation = None  # UserHistoryIndex.generation that last_row belongs to
+        self.updates = 0
+        self.windows = [WindowSums(days, metric_count) for days in windows]
+
+
+class TrendCache:
+    """
+    Per-user trend cache on top of the CSV history index
+
+    Args:
+        manager: CSVDataManager of the history file (default: the standard one)
+        config: TREND_CONFIG overrides
+    """
+
+    def __init__(self, manager: Optional[cu.CSVDataManager] = None, config: Dict[str, Any] = None):
+        self.manager = manager or cu.CSVDataManager()
+        self.config = {**TREND_CONFIG, **(config or {})}
+        self.metrics = list(self.config['metrics'])
+        self._states: Dict[str, UserTrendState] = {}
+        self._lock = threading.Lock()
+
+    def _rows_after(self, name: str, after_row: int = -1) -> Tuple[pd.DataFrame, int, int]:
+        """Rows of a user after a row number (row id with a backend), the number of their last row and its generation"""
+        if self.manager.backend is not None:
+            # Backend không có số hàng trong file: dùng id của hàng, chỉ đọc các hàng mới
+            rows, last_id = self.manager.backend.user_rows_after(name, max(after_row, 0))
+            if not rows.empty:
+                rows['datetime'] = pd.to_datetime(rows['datetime'], format = self.manager.config['date_format'],
+                                                  errors = 'coerce')
+            # Id của hàng không bao giờ bị đánh lại
+            return rows, last_id, 0
+
+        index = cu.get_history_index(self.manager.file_path, self.manager.config['encoding'],
+                                     self.manager.config['date_format'])
+        return index.rows_after(name, after_row)
+
+    def _arrays(self, rows: pd.DataFrame):
+        rows = rows.dropna(subset = ['datetime'])
+        values = np.column_stack([pd.to_numeric(rows[metric], errors = 'coerce').to_numpy(dtype = float)
+                                  if metric in rows else np.full(len(rows), np.nan)
+                                  for metric in self.metrics]) if len(rows) else np.zeros((0, len(self.metrics)))
+        return rows['datetime'], values
+
+    def _rebuild(self, name: str) -> UserTrendState:
+        history, last_row, generation = self._rows_after(name)
+        state = UserTrendState(self.config['windows'], len(self.metrics))
+        state.last_row = last_row
+        state.generation = generation
+        if history.empty:
+            return state
+
+        history = history.sort_values('datetime', kind = 'stable')
+        timestamps, values = self._arrays(history)
+        if len(timestamps):
+            state.origin = timestamps.iloc[0]
+            state.last_time = timestamps.iloc[-1]
+            times = ((timestamps - state.origin).dt.total_seconds() / SECONDS_PER_DAY).to_numpy()
+            for window in state.windows:
+                window.load(times, values)
+        return state
+
+    def _update(self, name: str, state: UserTrendState) -> UserTrendState:
+        rows, last_row, generation = self._rows_after(name, state.last_row)
+        if generation != state.generation:
+            # Số hàng đã được đánh lại: các hàng "mới" có thể đã được cộng vào trước đó
+            return self._rebuild(name)
+        if rows.empty:
+            state.last_row = last_row
+            return state
+
+        timestamps, values = self._arrays(rows)
+        if state.origin is None or (len(timestamps) and
+                                    (timestamps.iloc[0] < state.last_time or not timestamps.is_monotonic_increasing)):
+            return self._rebuild(name)
+
+        times = ((timestamps - state.origin).dt.total_seconds() / SECONDS_PER_DAY).to_numpy()
+        for t, row_values in zip(times, values):
+            for window in state.windows:
+                window.add(float(t), row_values)
+        state.last_time = timestamps.iloc[-1] if len(timestamps) else state.last_time
+        state.last_row = last_row
+        state.updates += len(times)
+        if state.updates >= self.config['exact_every']:
+            for window in state.windows:
+                window.reload()
+            state.updates = 0
+        return state
+
+    def get(self, name: str) -> Dict[str, Any]:
+        """
+        Trends of a user as of their latest weigh-in
+
+        Returns:
+            {'as_of': datetime string or None,
+             'windows': {days: {metric: {'mean', 'slope_per_day', 'count'}}}}
+        """
+        key = normalize_name(name)
+        with self._lock:
+            state = self._states.get(key)
+            state = self._rebuild(name) if state is None else self._update(name, state)
+            self._states[key] = state
+
+            as_of = state.last_time.strftime(self.manager.config['date_format']) if state.last_time is not None else None
+            return {'as_of': as_of,
+                    'windows': {window.days: window.summary(self.metrics, self.config['min_slope_days'])
+                                for window in state.windows}}
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """Drop the cached state of a user (or of every user)"""
+        with self._lock:
+            if name is None:
+                self._states.clear()
+            else:
+                self._states.pop(normalize_name(name), None)
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_user_trends(name: str) -> Dict[str, Any]:
+    """Trends of a user from the standard history file, using a process-wide cache"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = TrendCache()
+    return _shared_cache.get(name)